@@ -0,0 +1,18 @@
+import gc
+import lib.bme680_driver as bme680
+
+gc.collect()
+free = gc.mem_free()
+sensor = bme680.BME680(i2c_device=bme680.I2CAdapter())
+gc.collect()
+print("Driver footprint: {} bytes".format(free - gc.mem_free()))
+
+READS = 20
+gc.collect()
+gc.disable()
+free = gc.mem_free()
+for i in range(READS):
+    sensor.get_sensor_data()
+allocated = free - gc.mem_free()
+gc.enable()
+print("Allocated per read: {} bytes".format(allocated // READS))
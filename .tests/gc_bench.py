@@ -0,0 +1,31 @@
+import time
+import gc
+from lib.memory import MemoryManager
+
+ITERATIONS = 500
+
+def work():
+    # Roughly what one module iteration allocates: a reading, its JSON and a packet
+    message = '{"value": ' + str(time.ticks_us() / 7.0) + '}'
+    pkt = bytearray(64) + message.encode('utf-8')
+    return len(pkt)
+
+def run(name, before):
+    times = []
+    start = time.ticks_ms()
+    for i in range(ITERATIONS):
+        t = time.ticks_us()
+        before(i)
+        work()
+        times.append(time.ticks_diff(time.ticks_us(), t))
+    total = time.ticks_ms() - start
+    mean = sum(times) / len(times)
+    jitter = (sum([(x - mean) ** 2 for x in times]) / len(times)) ** 0.5
+    print("{}: {} loops/s, mean {} us, max {} us, jitter {} us".format(
+            name, int(ITERATIONS * 1000 / max(total, 1)), int(mean), max(times), int(jitter)))
+
+memory = MemoryManager()
+memory.setup()
+
+run("always-collect", lambda i: gc.collect())
+run("managed", lambda i: memory.tick(i % 10 == 0))
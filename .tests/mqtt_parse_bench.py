@@ -0,0 +1,44 @@
+import time
+from lib.mqtt import MQTTC
+
+PACKETS = 2000
+
+# Behaves like the client's non-blocking socket: short reads, None when empty
+class FakeSock:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def readinto(self, buf):
+        if self.pos >= len(self.data):
+            return None
+        n = min(len(buf), len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def write(self, data):
+        return len(data)
+
+class FakePoll:
+    def __init__(self, sock):
+        self.sock = sock
+
+    def poll(self, timeout):
+        return self.sock.pos < len(self.sock.data)
+
+# A mix of PINGRESP, PUBACK and small PUBLISH packets
+publish = b"\x30\x0e\x00\x05cmd/xhello=1"
+frame = b"\xd0\x00" + b"\x40\x02\x00\x01" + publish
+data = frame * (PACKETS // 3)
+
+client = MQTTC("bench", "127.0.0.1")
+client.sock = FakeSock(data)
+client._poll = FakePoll(client.sock)
+client.set_callback(lambda topic, msg: None)
+
+start = time.ticks_ms()
+while client.sock.pos < len(data):
+    client.check_msg()
+elapsed = max(time.ticks_ms() - start, 1)
+print("Parsed {} bytes in {} ms: {} packets/s".format(len(data), elapsed, (PACKETS // 3) * 3 * 1000 // elapsed))
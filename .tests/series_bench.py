@@ -0,0 +1,48 @@
+import math
+from ubinascii import b2a_base64
+from lib import series
+
+# Trace shaped like a BME680 temperature log: 3 s period, slow drift plus noise
+BATCH = 20
+timestamps = [1577836800000 + 3000 * i for i in range(BATCH)]
+values = [round(21.5 + 0.4 * math.sin(i / 7.0) + 0.03 * ((i * 7919) % 5 - 2), 2) for i in range(BATCH)]
+iv = bytes(16)
+
+single = 0
+for v in values:
+    single += len(b2a_base64(iv + ('{"value": ' + str(v) + '}').encode('utf-8')))
+
+frame = series.encode(timestamps, values, 2)
+batched = len(b2a_base64(iv + frame))
+
+decoded_ts, decoded_values, decimals = series.decode(frame)
+assert decoded_ts == timestamps
+assert decoded_values == values
+
+def roundtrip(timestamps, values, decimals):
+    assert series.decode(series.encode(timestamps, values, decimals)) == (timestamps, values, decimals)
+
+# Falling and negative values
+roundtrip([1000, 2000, 2500, 9000, 9001], [5.25, -3.5, -120.75, 0.0, 42.0], 2)
+# Integer readings, decoded as ints
+roundtrip([0, 2000, 4000, 6000], [63, 58, 85, 32], 0)
+# One reading, and none
+roundtrip([1577836800000], [21.5], 2)
+roundtrip([], [], 2)
+# Epoch timestamps far past 2038 and 2^53, with long gaps
+roundtrip([4102444800000, 4102444800001, 4102531200000, 2 ** 62], [1.0, 2.0, 3.0, 4.0], 1)
+# Deltas on both sides of each varint length: zigzag 63/-64 fit one byte, 64/-65 need two
+deltas = [0, 63, 64, -64, -65, 8191, 8192, -8192, -8193, 2 ** 31, -2 ** 31 - 1]
+levels = []
+v = 0
+for d in deltas:
+    v += d
+    levels.append(v)
+roundtrip(list(range(len(levels))), levels, 0)
+for d, size in ((63, 1), (-64, 1), (64, 2), (-65, 2), (8191, 2), (-8192, 2), (8192, 3), (-8193, 3)):
+    buf = bytearray()
+    series._put(buf, d)
+    assert len(buf) == size, (d, len(buf))
+
+print("{} readings: {} bytes one by one, {} bytes as a series ({}x)".format(
+        BATCH, single, batched, round(single / batched, 1)))
@@ -2,12 +2,25 @@
 from network import WLAN
 from crypto import AES
 from ubinascii import b2a_base64
-import machine, ujson, _thread, crypto
-import time, sys, gc
+import machine, ujson, crypto
+import time, sys, gc, os
 from machine import WDT
 
 # Lib imports
 from lib.mqtt import MQTTClient
+from lib.health import Health
+from lib.memory import MemoryManager
+from lib.adaptive import Adaptive
+from lib.aggregate import Aggregator
+from lib import series
+from lib.ringbuf import Ring
+from lib.alerts import Rule
+from lib import trace
+from lib.radio import Radio
+from lib.link import Link
+from lib import config
+from lib.worker import Worker
+from lib.supervisor import Supervisor
 
 # Config dicts
 detimotic_conf = None
@@ -18,38 +31,83 @@ wlan = None
 client = None
 modules = []
 watchdog = None
+clock_base = 0
+health = Health()
+memory = None
+radio = Radio()
+link = None
+worker = None
+supervisor = None
+
+# Deep-sleep duty cycling
+STATE_FILE = 'detimotic/state.json'
+RTC_MEM_SIZE = 2048
+state = None
+pending = []
+alerts = []
+
+# History backfill requests: [module, metric, resume from, until, requested from]
+backfills = []
+last_backfill = 0
+
+# Set by a trace dump command, served from the main loop
+trace_dump = False
+
+# Validated config delta (version, module entries), applied between ticks
+reconfig = None
+config_rejected = 0
 
 def main():
     global watchdog
 
     setup_config()
+    if detimotic_conf['trace']['enabled']:
+        trace.enable(detimotic_conf['trace']['size'])
+    setup_memory()
+    setup_link()
+    setup_worker()
+    setup_supervisor()
+    sync_clock()
+    if detimotic_conf['deepsleep']['enabled']:
+        duty_cycle()
+
     setup_connectivity()
-    gc.collect()
     setup_sensors()
+    memory.setup()
 
     watchdog = WDT(timeout=detimotic_conf['watchdog'])
+    supervisor.watch(watchdog)
 
     try:
         while True:
             try:
+                if reconfig is not None:
+                    apply_config()
+                ran = False
                 for i in range(len(modules)):
-                    watchdog.feed()
+                    supervisor.progress()
                     module, last = modules[i]
-                    if time.ticks_ms() - last >= module.time():
-                        gc.collect()
-                        module.loop()
-                        modules[i] = (module, time.ticks_ms())
-                if time.ticks_ms() - client.last_pingreq >= detimotic_conf['gateway']['ping_freq']:
-                    client.ping()
-                elif time.ticks_ms() - client.last_pingresp >= 3*detimotic_conf['gateway']['ping_freq']:
-                    print('Forcibly reconnecting!')
-                    client.disconnect()
-                    wlan.disconnect()
-                    watchdog.feed()
-                    setup_connectivity()
-                client.check_msg()
+                    due = module.time() - (time.ticks_ms() - last)
+                    if due <= 0:
+                        run_module(i)
+                        ran = True
+                    elif due <= module.lead():
+                        module.prepare()
+                if worker is not None:
+                    worker.drain()
+                memory.tick(not ran)
+                health.memory()
+                if not link.up and (alerts or link.due(len(pending))):
+                    supervisor.progress()
+                    link_up()
+                if link.up:
+                    serve_link()
+                supervisor.tick()
             except MemoryError:
+                health.mem_errors += 1
                 print('Memory Error!')
+                memory.oom()
+                trim_pending()
     except KeyboardInterrupt:
         print("KB INTERRUPT!")
         client.disconnect()
@@ -58,6 +116,30 @@ def main():
         sys.exit(2)
 
 
+def serve_link():
+    # WiFi traffic that can wait is kept out of BLE scan windows
+    if health.due(detimotic_conf['gateway']['health_freq']) and not radio.scanning:
+        publish_health()
+    if not wlan.isconnected():
+        print('Forcibly reconnecting!')
+        try:
+            client.disconnect()
+        except OSError:
+            pass
+        supervisor.progress()
+        setup_connectivity()
+    # Sends PINGREQ when idle and reconnects on a missed PINGRESP
+    client.check_msg()
+    drain_alerts()
+    if pending and not radio.scanning:
+        flush(detimotic_conf['queue']['flush_max'])
+    if not radio.scanning:
+        serve_backfill()
+    if trace_dump:
+        publish_trace()
+    if link.burst and not (pending or alerts or backfills or trace_dump):
+        link_down()
+
 def setup_config():
     global detimotic_conf
     global conf
@@ -78,70 +160,832 @@ def setup_config():
         print("ERROR loading ISU configuration file!")
         sys.exit(2)
 
-def setup_connectivity():
+def setup_memory():
+    global memory
+
+    mem_conf = detimotic_conf['memory']
+    memory = MemoryManager(low_water=mem_conf['low_water'], critical=mem_conf['critical'],
+            gc_period=mem_conf['gc_period'], idle_interval=mem_conf['idle_interval'],
+            min_gap=mem_conf['min_gap'], health=health)
+
+def setup_link():
+    global link
+
+    link_conf = detimotic_conf['link']
+    link = Link(burst=link_conf['mode'] == 'burst', flush_interval=link_conf['flush_interval'],
+            buffer=link_conf['buffer'])
+
+def setup_worker():
+    global worker
+
+    worker_conf = detimotic_conf['worker']
+    if worker_conf['enabled']:
+        worker = Worker(size=worker_conf['queue'], stack=worker_conf['stack'])
+
+def setup_supervisor():
+    global supervisor
+
+    sup_conf = detimotic_conf['supervisor']
+    supervisor = Supervisor(stall=sup_conf['stall'], strikes=sup_conf['strikes'], recover=sup_conf['recover'],
+            max_stretch=sup_conf['max_stretch'])
+
+def setup_connectivity(planned=False):
     global wlan
     global client
 
-    wlan = WLAN(mode=WLAN.STA)
-    wlan.connect(detimotic_conf['wifi']['ssid'], auth=(WLAN.WPA2, detimotic_conf['wifi']['passw']), timeout=5000)
+    start = time.ticks_ms()
+    if wlan is None:
+        wlan = WLAN(mode=WLAN.STA)
+    # The cached access point skips the scan for it
+    bssid = link.bssid
+    wlan.connect(detimotic_conf['wifi']['ssid'], auth=(WLAN.WPA2, detimotic_conf['wifi']['passw']), bssid=bssid, timeout=5000)
 
     while not wlan.isconnected():
+        if bssid is not None and time.ticks_ms() - start > 5000:
+            # The cached access point is gone, look for any with the SSID
+            bssid = None
+            link.bssid = None
+            wlan.connect(detimotic_conf['wifi']['ssid'], auth=(WLAN.WPA2, detimotic_conf['wifi']['passw']), timeout=5000)
+        supervisor.progress()
         machine.idle()
     print("Connected to WiFi")
+    try:
+        link.bssid = wlan.joined_ap_info()[0]
+    except (AttributeError, OSError):
+        pass
 
-    client = MQTTClient(conf['isu_id'], detimotic_conf['gateway']['addr'],user=detimotic_conf['gateway']['uname'], password=detimotic_conf['gateway']['passw'], port=detimotic_conf['gateway']['port'])
-    client.connect()
+    # The client, its persistent session and TLS session survive WiFi drops
+    if client is None:
+        client = MQTTClient(conf['isu_id'], detimotic_conf['gateway']['addr'],user=detimotic_conf['gateway']['uname'], password=detimotic_conf['gateway']['passw'], port=detimotic_conf['gateway']['port'],
+                keepalive=detimotic_conf['gateway']['keepalive'], ping_timeout=detimotic_conf['gateway']['ping_timeout'],
+                ssl=detimotic_conf['gateway']['ssl'], connect_timeout=detimotic_conf['gateway']['connect_timeout'],
+                failback=detimotic_conf['gateway']['failback'], rbuf_size=detimotic_conf['gateway']['rbuf_size'])
+        client.set_callback(on_message)
+        client.oversize = on_oversize
+        # Connection attempts and backoff waits count as progress for the watchdog
+        client.progress = supervisor.progress
+        # A gateway down at boot is waited out with the usual backoff, not raised out of main()
+        client.reconnect(True)
+        # QoS 1, so the session keeps commands and deltas while the radio is off or the node sleeps
+        client.subscribe(detimotic_conf['gateway']['command_topic'] + "/" + conf['isu_id'], qos=1)
+        client.subscribe(detimotic_conf['gateway']['config_topic'] + "/" + conf['isu_id'], qos=1)
+    else:
+        client.reconnect(planned)
+    sync_clock()
+    link.wake(time.ticks_ms() - start)
 
     print("Connected to MQTT gateway\n")
 
+def link_up():
+    # Radio back on: the MQTT session and TLS session are resumed, not rebuilt
+    wlan.init(mode=WLAN.STA)
+    setup_connectivity(True)
+
+def link_down():
+    try:
+        client.disconnect()
+    except OSError:
+        pass
+    wlan.deinit()
+    link.sleep()
+
 
 def setup_sensors():
     for module in conf['modules']:
         if module['active']:
-            s = Module(module)
-            s.setup()
-            modules.append((s, 0))
+            try:
+                config.check(module)
+            except (ValueError, KeyError, TypeError) as e:
+                print("ERROR skipping module: {}".format(e))
+                continue
+            start_module(module)
+
+def start_module(s):
+    module = Module(s)
+    module.setup()
+    modules.append((module, 0))
+
+def stop_module(i):
+    module, last = modules.pop(i)
+    if worker is not None:
+        worker.cancel(module)
+    module.stop()
+    for job in backfills[:]:
+        if job[0] is module:
+            backfills.remove(job)
+
+def apply_config():
+    global reconfig
+    global config_rejected
+
+    # Runs between ticks, so no module is mid-loop while it is swapped
+    version, entries = reconfig
+    reconfig = None
+    running = [module.name() for module, last in modules]
+    # Modules turned on are set up first: if one fails, the ones already
+    # started are stopped again and nothing else has changed yet
+    started = []
+    try:
+        for s in entries:
+            if s['active'] and s['name'] not in running:
+                module = Module(s)
+                started.append(module)
+                module.setup()
+    except Exception as e:
+        for module in started:
+            try:
+                module.stop()
+            except Exception:
+                pass
+        config_rejected += 1
+        print("ERROR rejected configuration version {}: {}".format(version, e))
+        return
+    for module in started:
+        modules.append((module, 0))
+    for s in entries:
+        if s['name'] in running:
+            i = running.index(s['name'])
+            if not s['active']:
+                stop_module(i)
+                running.pop(i)
+            else:
+                modules[i][0].reconfigure(s)
+        for j in range(len(conf['modules'])):
+            if conf['modules'][j]['name'] == s['name']:
+                conf['modules'][j] = s
+    conf['version'] = version
+    print("Applied configuration version {}".format(version))
+    save_config()
+
+def save_config():
+    # Written aside and renamed, so a reset mid-write keeps the old file
+    try:
+        with open('conf.json.new', 'w') as f:
+            ujson.dump(conf, f)
+        os.rename('conf.json.new', 'conf.json')
+    except OSError:
+        print("ERROR saving ISU configuration file!")
+
+def run_module(i):
+    module, last = modules[i]
+    wait = module.time()
+    start = time.ticks_ms()
+    module.loop()
+    end = time.ticks_ms()
+    health.loop(module.name(), end - start, start - last - wait, module.time())
+    modules[i] = (module, end)
 
-def publish(id, message):
+def drain_client_stats():
+    health.bytes_out += client.bytes_out
+    health.reconnects += client.reconnects
+    client.bytes_out = 0
+    client.reconnects = 0
+
+def publish_health():
+    drain_client_stats()
+    try:
+        extra = {"gw": [client.current, client.rtt], "radio": radio.frame(), "link": link.frame(),
+                "cfg": [conf.get('version', 0), config_rejected]}
+        if worker is not None:
+            extra["worker"] = worker.frame()
+        if state is not None:
+            # [wake cycles, awake ms this cycle, average awake ms, last sleep ms]
+            extra["ds"] = [state['cycles'], time.ticks_ms(), int(state['awake_avg']), state['slept']]
+        extra.update(supervisor.frame())
+        frame = health.frame(extra)
+        client.publish(topic=detimotic_conf['gateway']['health_topic'] + "/" + conf['isu_id'], msg=frame)
+    except:
+        print("Error publishing health frame")
+
+def duty_cycle():
+    global watchdog
+
+    load_state()
+    watchdog = WDT(timeout=detimotic_conf['watchdog'])
+    supervisor.watch(watchdog)
+
+    # Sample every module whose deadline elapsed while asleep
+    setup_sensors()
+    for i in range(len(modules)):
+        supervisor.progress()
+        module, last = modules[i]
+        name = module.name()
+        if name in state['modules']:
+            module.restore(state['modules'][name], state['slept'])
+        deadline = state['deadlines'].get(name, 0)
+        if deadline <= 0:
+            if module.lead():
+                # Scan windows cannot span deep sleep, open one now
+                module.prepare()
+                end = time.ticks_ms() + module.lead()
+                while time.ticks_ms() < end:
+                    supervisor.progress()
+                    machine.idle()
+            run_module(i)
+        else:
+            modules[i] = (module, time.ticks_ms() - module.time() + deadline)
+
+    # Background reads finish before anything is flushed
+    while worker is not None and worker.pending():
+        supervisor.progress()
+        worker.drain()
+        machine.idle()
+    for module, last in modules:
+        module.flush()
+    # Health frames keep gateway.health_freq across sleeps
+    health_due = state['health_in'] <= 0
+    if pending or alerts or health_due:
+        supervisor.progress()
+        setup_connectivity()
+        drain_alerts()
+        flush()
+        if health_due:
+            publish_health()
+            state['health_in'] = detimotic_conf['gateway']['health_freq']
+        # Config deltas queued in the session while asleep
+        client.check_msg()
+        client.disconnect()
+    if reconfig is not None:
+        apply_config()
+    if wlan is not None:
+        wlan.deinit()
+        link.sleep()
+
+    # Sleep until the earliest module deadline
+    now = time.ticks_ms()
+    sleep = None
+    for module, last in modules:
+        due = module.time() - (now - last)
+        if sleep is None or due < sleep:
+            sleep = due
+    # Without modules, or with long waits, still wake up for health frames
+    # and config deltas now and then
+    if sleep is None:
+        sleep = detimotic_conf['deepsleep']['max_sleep']
+    sleep = min(max(sleep, detimotic_conf['deepsleep']['min_sleep']), detimotic_conf['deepsleep']['max_sleep'])
+    for module, last in modules:
+        state['deadlines'][module.name()] = module.time() - (now - last) - sleep
+        saved = module.save()
+        if saved is not None:
+            state['modules'][module.name()] = saved
+    state['slept'] = sleep
+    state['pending'] = pending
+    state['alerts'] = alerts
+
+    awake = time.ticks_ms()
+    state['health_in'] -= awake + sleep
+    state['cycles'] += 1
+    state['awake_avg'] += (awake - state['awake_avg']) / state['cycles']
+    print("Cycle awake: {} ms (avg {} ms), sleeping {} ms".format(awake, int(state['awake_avg']), sleep))
+
+    save_state()
+    machine.deepsleep(sleep)
+
+def load_state():
+    global state
+    global pending
+    global alerts
+
+    state = None
+    if machine.reset_cause() == machine.DEEPSLEEP_RESET:
+        try:
+            state = ujson.loads(_read_state())
+        except:
+            print("ERROR loading deep-sleep state, starting fresh!")
+    if state is None:
+        state = {'deadlines': {}, 'modules': {}, 'pending': [], 'alerts': [], 'slept': 0, 'cycles': 0, 'awake_avg': 0}
+    state.setdefault('health_in', 0)
+    pending = state['pending']
+    alerts = state.get('alerts', [])
+
+def save_state():
+    # RTC memory takes bytes only
+    data = ujson.dumps(state).encode()
+    try:
+        if len(data) <= RTC_MEM_SIZE:
+            machine.RTC().memory(data)
+            return
+        machine.RTC().memory(b'')
+    except AttributeError:
+        pass
+    with open(STATE_FILE, 'wb') as f:
+        f.write(data)
+
+def _read_state():
+    try:
+        data = machine.RTC().memory()
+        if data:
+            return data
+    except AttributeError:
+        pass
+    with open(STATE_FILE) as f:
+        return f.read()
+
+def flush(limit=None):
+    # Regular telemetry goes out in throttled chunks, alerts jump the queue
+    sent = 0
+    while pending and (limit is None or sent < limit):
+        drain_alerts()
+        sent += 1
+        uuid, message = pending[0]
+        try:
+            client.publish(topic=detimotic_conf['gateway']['telemetry_topic'] + "/" + str(uuid), msg=message)
+        except:
+            health.publish_errors += 1
+            print("Error publishing for metric: {}".format(uuid))
+            return
+        health.published += 1
+        pending.pop(0)
+
+def raise_alert(uuid, message):
     if message is None:
         return
+    if len(alerts) >= detimotic_conf['queue']['max_alerts']:
+        alerts.pop(0)
+    alerts.append((uuid, message))
+    drain_alerts()
+
+def drain_alerts():
+    while alerts and client is not None and link.up:
+        uuid, message = alerts[0]
+        try:
+            client.publish(topic=detimotic_conf['gateway']['alert_topic'] + "/" + str(uuid), msg=message, qos=1)
+        except:
+            health.publish_errors += 1
+            print("Error publishing alert for metric: {}".format(uuid))
+            return
+        health.published += 1
+        alerts.pop(0)
+
+def timestamp():
+    return clock_base + time.ticks_ms()
+
+def sync_clock():
+    global clock_base
+
+    rtc = machine.RTC()
+    if detimotic_conf['gateway']['ntp'] and client is not None:
+        # Gateways serve NTP, so samples share the gateway's time base
+        try:
+            rtc.ntp_sync(client.server)
+            for i in range(20):
+                if rtc.synced():
+                    break
+                time.sleep_ms(50)
+        except AttributeError:
+            pass
+    clock_base = int(time.time() * 1000) - time.ticks_ms()
+
+def trim_pending():
+    # Drop the oldest buffered readings first, harder under memory pressure
+    limit = detimotic_conf['deepsleep']['max_pending'] // memory.stretch
+    while len(pending) > limit:
+        pending.pop(0)
+
+def publish(id, message, topic=None):
+    if message is None:
+        return
+    # Only live telemetry is queued, anything else can be served again
+    live = topic is None
+    if live:
+        if client is None or not link.up or radio.scanning:
+            if client is not None and link.up:
+                radio.defer()
+            pending.append((id, message))
+            trim_pending()
+            return
+        topic = detimotic_conf['gateway']['telemetry_topic']
     try:
-        client.publish(topic=detimotic_conf['gateway']['telemetry_topic'] + "/" + str(id), msg=message)
+        client.publish(topic=topic + "/" + str(id), msg=message)
+        health.published += 1
     except:
+        health.publish_errors += 1
         print("Error publishing for metric: {}".format(id))
+        if live:
+            # Keep the reading until a gateway takes it
+            pending.append((id, message))
+            trim_pending()
+
+def publish_trace():
+    global trace_dump
+
+    # Stop recording while the ring is read, then start over
+    trace_dump = False
+    was = trace.enabled
+    trace.disable()
+    topic = detimotic_conf['gateway']['trace_topic'] + "/" + conf['isu_id']
+    try:
+        for chunk in trace.chunks(detimotic_conf['trace']['chunk']):
+            client.publish(topic=topic, msg=chunk)
+    except:
+        print("Error publishing trace")
+    trace.clear()
+    if was:
+        trace.enable(detimotic_conf['trace']['size'])
+
+def on_message(topic, msg):
+    try:
+        request = ujson.loads(msg)
+    except ValueError:
+        print("ERROR parsing command on topic: {}".format(topic))
+        return
+    if topic.decode().startswith(detimotic_conf['gateway']['config_topic'] + "/"):
+        request_config(request)
+        return
+    try:
+        if request['op'] == 'backfill':
+            request_backfill(request)
+        elif request['op'] == 'trace':
+            request_trace(request)
+    except (KeyError, TypeError, ValueError):
+        print("ERROR invalid command on topic: {}".format(topic))
+
+def on_oversize(op, topic, size):
+    global config_rejected
+
+    # Too big for the receive buffer, so it never reached on_message
+    print("ERROR dropped a {} byte message on topic: {}".format(size, topic))
+    if topic is not None and topic.decode().startswith(detimotic_conf['gateway']['config_topic'] + "/"):
+        config_rejected += 1
+
+def request_backfill(request):
+    # {"op": "backfill", "metrics": [uuid, ...], "from": ms, "to": ms}
+    # Checked here: a bad value would only fail later, inside the main loop
+    start = request['from']
+    end = request['to']
+    if type(start) is not int or type(end) is not int or not isinstance(request['metrics'], list):
+        raise TypeError("backfill needs int from/to and a list of metrics")
+    for uuid in request['metrics']:
+        if not isinstance(uuid, str):
+            raise TypeError("backfill metrics are uuid strings")
+    # A repeated request is already queued; past max_jobs the rest is
+    # refused and the requester told so, each job holds the link up
+    refused = []
+    for module, last in modules:
+        for uuid in request['metrics']:
+            id = module.metric(uuid)
+            if id is None:
+                continue
+            if any(job[0] is module and job[1] == id and job[3] == end and job[4] == start for job in backfills):
+                continue
+            if len(backfills) >= detimotic_conf['backfill']['max_jobs']:
+                refused.append(uuid)
+            else:
+                backfills.append([module, id, start, end, start])
+    if refused:
+        try:
+            client.publish(topic=detimotic_conf['gateway']['backfill_topic'] + "/" + conf['isu_id'],
+                    msg=ujson.dumps({"error": "queue full", "metrics": refused}))
+        except:
+            print("Error publishing backfill reply")
+
+def request_config(request):
+    global reconfig
+    global config_rejected
+
+    # {"version": n, "modules": [{"name": ..., "active": ..., "wait_time": ..., "metrics": {id: {"key": ...}}}]}
+    # A delta still waiting for the tick boundary is the base for the next one
+    staged = {}
+    base = conf
+    if reconfig is not None:
+        for s in reconfig[1]:
+            staged[s['name']] = s
+        base = {'version': reconfig[0], 'modules': [staged.get(s['name'], s) for s in conf['modules']]}
+    try:
+        version, entries = config.merge(base, request)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        config_rejected += 1
+        print("ERROR rejected configuration: {}".format(e))
+        return
+    for s in entries:
+        staged[s['name']] = s
+    reconfig = (version, list(staged.values()))
+
+def request_trace(request):
+    global trace_dump
+
+    # {"op": "trace", "enable": true|false, "size": n, "dump": true}, every key optional
+    if 'enable' in request:
+        if request['enable']:
+            size = request.get('size', detimotic_conf['trace']['size'])
+            # 14 bytes per event, so a remote size is bounded by the config
+            if type(size) is not int or not 0 < size <= detimotic_conf['trace']['max_size']:
+                raise ValueError("trace size out of range")
+            trace.enable(size)
+        else:
+            trace.disable()
+    if request.get('dump'):
+        trace_dump = True
+
+def serve_backfill():
+    global last_backfill
+
+    # One chunk per pass, so live telemetry keeps flowing in between
+    if not backfills or time.ticks_ms() - last_backfill < detimotic_conf['backfill']['interval']:
+        return
+    last_backfill = time.ticks_ms()
+    job = backfills[0]
+    module, id, start, end = job[:4]
+    resume = module.backfill(id, start, end, detimotic_conf['backfill']['chunk'])
+    if resume is None:
+        backfills.pop(0)
+    else:
+        job[2] = resume
 
 class Module:
     _module = None
     _instance = None
+    _adaptive = None
+    _aggregator = None
+    _batch = None
+    _rings = None
+    _unsent = None
+    _rules = None
+    _span = None
+    _ids = None
+    _budget = None
+    _job = False
+    _done = None
+    _loop_ms = 0
+    _retry = None
 
     def __init__(self, s):
         self._module = s
+        self._span = 'loop ' + s['name']
+        self._timing(s)
+        self._index(s)
+        self._budget = supervisor.budget(s['name'], s.get('budget', detimotic_conf['supervisor']['budget']))
+        if 'aggregate' in s:
+            self._aggregator = Aggregator(s['metrics'], s['aggregate']['window'], s['aggregate'].get('raw', ()),
+                    timestamp)
+        capacity = s.get('history', detimotic_conf['history'])
+        if 'batch' in s:
+            self._batch = s['batch']
+            capacity = max(capacity, self._batch['size'])
+        # Every reading lands in its metric's ring; publishing reads from there
+        self._rings = {}
+        self._unsent = {}
+        for id in s['metrics']:
+            self._rings[id] = Ring(capacity)
+            self._unsent[id] = 0
+        self._rules = {}
+        for id in s.get('alerts', {}):
+            self._rules[id] = Rule(s['alerts'][id])
 
     def setup(self):
+        start = time.ticks_ms()
         self._instance = __import__('sensors/' + str(self._module['name']))
+        imported = time.ticks_ms()
         print('Starting module ' + str(self._module['name']))
         getattr(self._instance, "setup")(self)
+        print('Module {}: import {} ms, setup {} ms'.format(self._module['name'],
+                imported - start, time.ticks_ms() - imported))
 
     def loop(self):
+        t = trace.begin()
+        start = time.ticks_ms()
+        self._job = False
+        self._retry = None
         getattr(self._instance, "loop")(self)
+        self._loop_ms = time.ticks_ms() - start
+        if not self._job:
+            self._finish(0)
+        trace.end(t, self._span)
+
+    def _finish(self, job_ms):
+        # Once the run's readings are published; for a background read that
+        # is after its done callback, so the adaptive wait sees them first.
+        # The budget covers the loop and the background read together
+        if self._adaptive is not None:
+            self._adaptive.tick()
+        self.flush()
+        self.timed(self._loop_ms + job_ms)
+
+    def _timing(self, s):
+        self._adaptive = None
+        if 'min_wait' in s and 'max_wait' in s:
+            self._adaptive = Adaptive(s['wait_time'], s['min_wait'], s['max_wait'])
+
+    def _index(self, s):
+        # Metric uuid -> name, for commands that address metrics by uuid
+        self._ids = {}
+        for id in s['metrics']:
+            self._ids[s['metrics'][id]['id']] = id
+
+    def reconfigure(self, s):
+        # Rings, batches and alert state carry over; timing restarts from the new wait_time
+        old = self._module
+        self._module = s
+        for key in ('wait_time', 'min_wait', 'max_wait'):
+            if s.get(key) != old.get(key):
+                self._timing(s)
+                break
+        # Keys are looked up per message, so a rotated key applies from the next send
+        self._index(s)
+        self._budget.budget = s.get('budget', detimotic_conf['supervisor']['budget'])
+
+    def stop(self):
+        # Readings held by an aggregate window or a partial batch go out now
+        self.flush(True)
+        for id in self._unsent:
+            if self._unsent[id] and self._batch is not None:
+                timestamps, values = self._rings[id].last(self._unsent[id])
+                self._send(id, series.encode(timestamps, values, self._batch['decimals']))
+            self._unsent[id] = 0
+        f = getattr(self._instance, "stop", None)
+        if f is not None:
+            f(self)
+        print('Stopped module ' + str(self._module['name']))
+
+    def flush(self, force=False):
+        if self._aggregator is None or not (force or self._aggregator.due()):
+            return
+        for id, lo, hi, mean, count, start, end in self._aggregator.summaries():
+            self._send(id, '{{"min": {}, "max": {}, "mean": {}, "count": {}, "start": {}, "ts": {}}}'.format(
+                    lo, hi, mean, count, start, end))
+
+    def lead(self):
+        # How long before a run its scan window opens, a share of the wait
+        scan = self._module.get('scan')
+        if scan is None:
+            return 0
+        return int(self.time() * scan['duty'])
+
+    def submit(self, f, args, done):
+        # Hands a blocking read to the worker thread; done(self, result) runs
+        # later in the main loop. False when the last read is still in flight
+        # or the queue is full, in which case this run is skipped
+        if worker is None:
+            done(self, f(*args))
+            return True
+        if not worker.submit(self, f, args, self._complete):
+            return False
+        self._done = done
+        self._job = True
+        return True
+
+    def _complete(self, result, error, elapsed):
+        if error is None:
+            self._done(self, result)
+        self._finish(elapsed)
+
+    def prepare(self):
+        f = getattr(self._instance, "prepare", None)
+        if f is not None:
+            f(self)
+
+    def scanning(self, on):
+        if on:
+            radio.begin()
+        else:
+            radio.end()
+
+    def timed(self, duration):
+        # Loops over budget too often stretch this module's interval
+        if self._budget.add(duration):
+            if self._budget.degraded:
+                print('Module {} degraded: loops over {} ms, interval x{}'.format(self.name(),
+                        self._budget.budget, self._budget.stretch))
+            else:
+                print('Module {} recovered'.format(self.name()))
+
+    def retry(self, ms):
+        # The next run comes ms after this one instead of a whole wait later,
+        # for a sensor whose reading failed and can be taken again sooner
+        self._retry = ms
 
     def time(self):
-        return self._module['wait_time']
+        if self._retry is not None:
+            return self._retry
+        if self._adaptive is not None:
+            return self._adaptive.wait * memory.stretch * self._budget.stretch
+        return self._module['wait_time'] * memory.stretch * self._budget.stretch
+
+    def name(self):
+        return self._module['name']
+
+    def history(self, id):
+        return self._rings.get(id)
+
+    def metric(self, uuid):
+        return self._ids.get(uuid)
+
+    def backfill(self, id, start, end, size):
+        # Sends the next chunk of history in [start, end] and returns where to resume
+        timestamps = []
+        values = []
+        for t, value in self._rings[id].between(start, end):
+            timestamps.append(t)
+            values.append(value)
+            if len(values) >= size:
+                break
+        if not values:
+            return None
+        decimals = self._batch['decimals'] if self._batch is not None else 2
+        self._send(id, series.encode(timestamps, values, decimals), detimotic_conf['gateway']['backfill_topic'])
+        return timestamps[-1] + 1
+
+    def save(self):
+        f = getattr(self._instance, "save", None)
+        unsent = {}
+        for id in self._unsent:
+            if self._unsent[id]:
+                unsent[id] = self._rings[id].last(self._unsent[id])
+        # Raised alerts, and the last sent reading for rate rules, so rules
+        # carry on across the wake instead of starting over
+        rules = {}
+        last = {}
+        for id in self._rules:
+            if self._rules[id].active is not None:
+                rules[id] = self._rules[id].active
+            ring = self._rings[id]
+            if not self._unsent[id] and len(ring):
+                last[id] = ring.get(len(ring) - 1)
+        data = {'sensor': f(self) if f is not None else None, 'unsent': unsent, 'rules': rules, 'last': last}
+        if self._aggregator is not None:
+            # The open window carries over, summaries go out once it has elapsed
+            data['aggregate'] = self._aggregator.save()
+        if self._adaptive is not None:
+            # The interval and noise estimates, or every wake starts at wait_time
+            data['adaptive'] = self._adaptive.save()
+        return data
+
+    def restore(self, data, slept):
+        for id in data.get('last', {}):
+            if id in self._rings:
+                t, value = data['last'][id]
+                self._rings[id].append(t, value)
+        for id in data['unsent']:
+            timestamps, values = data['unsent'][id]
+            for i in range(len(values)):
+                self._rings[id].append(timestamps[i], values[i])
+            self._unsent[id] = len(values)
+        for id in data.get('rules', {}):
+            if id in self._rules:
+                self._rules[id].active = data['rules'][id]
+        if self._aggregator is not None and 'aggregate' in data:
+            self._aggregator.restore(data['aggregate'])
+        if self._adaptive is not None and 'adaptive' in data:
+            self._adaptive.restore(data['adaptive'])
+        f = getattr(self._instance, "restore", None)
+        if f is not None and data['sensor'] is not None:
+            f(self, data['sensor'], slept)
 
     def publish(self, id, message):
+        t = trace.begin()
+        self._publish(id, message)
+        trace.end(t, 'publish')
+
+    def _publish(self, id, message):
+        ring = self._rings.get(id)
+        if message is None or ring is None:
+            return
+        now = timestamp()
+        rule = self._rules.get(id)
+        if rule is not None:
+            prev = None
+            dt = 0
+            if len(ring):
+                t, prev = ring.get(len(ring) - 1)
+                dt = now - t
+            alert = rule.check(message, prev, dt)
+            if alert is not None:
+                uuid = self._module['metrics'][id]['id']
+                raise_alert(uuid, self._encrypt(id, '{{"alert": "{}", "value": {}, "ts": {}}}'.format(alert, message, now)))
+        ring.append(now, message)
+        if self._adaptive is not None:
+            self._adaptive.update(id, message)
+        if self._aggregator is not None and self._aggregator.add(id, message, now):
+            return
+        self._unsent[id] += 1
+        if self._batch is None:
+            t, value = ring.get(len(ring) - 1)
+            self._send(id, '{{"value": {}, "ts": {}}}'.format(message, t))
+            self._unsent[id] = 0
+        elif self._unsent[id] >= self._batch['size']:
+            # One delta/varint frame instead of a message per reading
+            timestamps, values = ring.last(self._unsent[id])
+            self._send(id, series.encode(timestamps, values, self._batch['decimals']))
+            self._unsent[id] = 0
+
+    def _send(self, id, message, topic=None):
         try:
             uuid = self._module['metrics'][id]['id']
         except:
             print("ERROR loading ID for metric: " + str(id) + " of sensor " + str(self._module['name']) + ". Cannot publish telemetry!")
             return
-        publish(uuid, self._encrypt(id, '{"value": ' + str(message) + '}'))
+        publish(uuid, self._encrypt(id, message), topic)
 
     def _encrypt(self, id, message):
-        gc.collect()
+        t = trace.begin()
         try:
             iv = crypto.getrandbits(128)
             cipher = AES(self._module['metrics'][id]['key'].encode('utf-8'), AES.MODE_CFB, iv)
-            return b2a_base64(iv + cipher.encrypt(message.encode('utf-8'))).decode('utf-8')
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+            message = b2a_base64(iv + cipher.encrypt(message)).decode('utf-8')
+            trace.end(t, 'encrypt')
+            return message
         except:
             print("ERROR encrypting message for metric: " + str(id) + " of sensor " + str(self._module['name']) + ". Cannot proceed!")
             return None
@@ -0,0 +1,54 @@
+"""Decoder throughput on synthetic ISU traffic, one core and a process pool.
+
+Run from the repository root: python -m gateway.bench [messages]
+"""
+import os
+import sys
+import time
+from binascii import b2a_base64
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+
+from gateway.decoder import Decoder, decode_parallel, _mode
+from lib import series
+
+METRICS = 50
+
+
+def encrypt(key, plain):
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(key.encode('utf-8')), _mode(iv)).encryptor()
+    return b2a_base64(iv + encryptor.update(plain) + encryptor.finalize()).decode('utf-8')
+
+
+def traffic(count):
+    keys = dict(('metric-{:04d}'.format(i), '{:016d}'.format(i)) for i in range(METRICS))
+    uuids = list(keys)
+    messages = []
+    for i in range(count):
+        uuid = uuids[i % METRICS]
+        if i % 10 == 0:
+            plain = series.encode([1577836800000 + 3000 * j for j in range(10)], [20.0 + j / 10 for j in range(10)], 2)
+        else:
+            plain = '{{"value": {}, "ts": {}}}'.format(20 + i % 7, 1577836800000 + i).encode('utf-8')
+        messages.append((uuid, encrypt(keys[uuid], plain)))
+    return keys, messages
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    keys, messages = traffic(count)
+
+    start = time.perf_counter()
+    rows = Decoder(keys).decode(messages)
+    elapsed = time.perf_counter() - start
+    print("1 core: {:.0f} msg/s, {} rows".format(count / elapsed, len(rows)))
+
+    start = time.perf_counter()
+    rows = decode_parallel(keys, messages)
+    elapsed = time.perf_counter() - start
+    print("{} processes: {:.0f} msg/s, {} rows".format(os.cpu_count(), count / elapsed, len(rows)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Bulk decoder for ISU telemetry payloads.
+
+Reverses what ``Module._encrypt`` does on the node: base64 -> 16-byte IV +
+AES-CFB ciphertext -> a JSON reading or a ``lib.series`` frame. Messages are
+grouped by metric and each group is decoded in bulk: one AES pass for all
+of its payloads, one JSON parse for its readings and NumPy varint decoding
+for its series frames, written straight into NumPy columns.
+
+Requires ``numpy`` and ``cryptography`` (see gateway/requirements.txt).
+"""
+import json
+from binascii import a2b_base64
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError as e:
+    raise ImportError("gateway.decoder needs numpy and cryptography: {}".format(e))
+
+try:
+    from cryptography.hazmat.decrepit.ciphers.modes import CFB8
+except ImportError:
+    CFB8 = modes.CFB8
+
+from lib import series
+
+IV_SIZE = 16
+BLOCK_SIZE = 16
+SERIES_PREFIX = bytes([series.FRAME_SERIES])
+
+# Pycom's crypto.AES uses 8-bit segments for MODE_CFB
+CFB_SEGMENT_BITS = 8
+
+# Values of the 'kind' column
+KIND_VALUE = 0
+KIND_MEAN = 1
+KIND_ALERT = 2
+
+DTYPE = np.dtype([
+    ('metric', np.int32),
+    ('timestamp', np.int64),
+    ('value', np.float64),
+    ('kind', np.uint8),
+])
+
+
+def _mode(iv):
+    if CFB_SEGMENT_BITS == 8:
+        return CFB8(iv)
+    return modes.CFB(iv)
+
+
+class Decoder:
+    """Decodes batches of (uuid, payload) messages into a structured array.
+
+    ``keys`` maps each metric uuid to the key string from the node's conf.json.
+    The ``metric`` column holds the uuid's position in ``self.metrics``.
+    """
+
+    def __init__(self, keys):
+        self.metrics = list(keys)
+        self._index = dict((uuid, i) for i, uuid in enumerate(self.metrics))
+        self._keys = dict((uuid, algorithms.AES(key.encode('utf-8'))) for uuid, key in keys.items())
+
+    def decrypt(self, uuid, payloads):
+        """Decrypts every payload of one metric in a single AES pass.
+
+        CFB-8 decrypts each byte with the first byte of AES over the 16
+        bytes before it (IV, then ciphertext). Those are all known up front,
+        so the whole group is one ECB call over a sliding window.
+        """
+        key = self._keys[uuid]
+        raws = [a2b_base64(payload) for payload in payloads]
+        if CFB_SEGMENT_BITS != 8:
+            plain = []
+            for raw in raws:
+                decryptor = Cipher(key, _mode(raw[:IV_SIZE])).decryptor()
+                plain.append(decryptor.update(raw[IV_SIZE:]) + decryptor.finalize())
+            return plain
+        if not raws:
+            return []
+        sizes = np.fromiter((max(len(raw) - IV_SIZE, 0) for raw in raws), np.int64, len(raws))
+        offsets = np.cumsum([0] + [len(raw) for raw in raws[:-1]])
+        data = np.frombuffer(b''.join(raws) + bytes(BLOCK_SIZE), np.uint8)
+        # Ciphertext byte positions; byte i decrypts with the block at i - 16
+        first = np.cumsum(sizes) - sizes
+        positions = np.repeat(offsets + IV_SIZE - first, sizes) + np.arange(sizes.sum())
+        windows = np.lib.stride_tricks.sliding_window_view(data, BLOCK_SIZE)[positions - IV_SIZE]
+        encryptor = Cipher(key, modes.ECB()).encryptor()
+        stream = np.frombuffer(encryptor.update(windows.tobytes()) + encryptor.finalize(), np.uint8)
+        text = (data[positions] ^ stream[::BLOCK_SIZE]).tobytes()
+        ends = np.cumsum(sizes)
+        return [text[start:end] for start, end in zip(first.tolist(), ends.tolist())]
+
+    def decode(self, messages):
+        """Decodes an iterable of (uuid, payload) pairs.
+
+        Unknown metrics and undecodable payloads are skipped and counted in
+        ``self.errors``.
+        """
+        groups = {}
+        for uuid, payload in messages:
+            groups.setdefault(uuid, []).append(payload)
+
+        self.errors = 0
+        chunks = []
+        for uuid, payloads in groups.items():
+            if uuid not in self._index:
+                self.errors += len(payloads)
+                continue
+            chunks.append(self._decode_group(self._index[uuid], self.decrypt(uuid, payloads)))
+        if not chunks:
+            return np.empty(0, dtype=DTYPE)
+        return np.concatenate(chunks)
+
+    def _decode_group(self, metric, plaintexts):
+        frames = []
+        texts = []
+        for plain in plaintexts:
+            if plain[:1] == SERIES_PREFIX:
+                frames.append(plain)
+            else:
+                texts.append(plain)
+        timestamps, values = self._decode_series(frames)
+        json_timestamps, json_values, kinds = self._decode_json(texts)
+        count = len(timestamps)
+        out = np.empty(count + len(json_timestamps), dtype=DTYPE)
+        out['metric'] = metric
+        out['timestamp'][:count] = timestamps
+        out['value'][:count] = values
+        out['kind'][:count] = KIND_VALUE
+        out['timestamp'][count:] = json_timestamps
+        out['value'][count:] = json_values
+        out['kind'][count:] = kinds
+        return out
+
+    def _decode_series(self, frames):
+        # Every varint of every frame is decoded at once: a byte below 0x80
+        # ends one, and its 7-bit groups are summed little-endian
+        good = []
+        for frame in frames:
+            if len(frame) > 2 and frame[-1] < 0x80:
+                good.append(frame)
+            else:
+                self.errors += 1
+        if not good:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        data = np.frombuffer(b''.join(frame[2:] for frame in good), np.uint8)
+        last = data < 0x80
+        ends = np.flatnonzero(last)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+        groups = (data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+        zigzag = np.add.reduceat(groups, starts)
+        ints = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+
+        # Frame layout: count, then count (timestamp delta, value delta) pairs
+        sizes = [len(frame) - 2 for frame in good]
+        varints = np.add.reduceat(last.astype(np.int64), np.cumsum([0] + sizes[:-1])).tolist()
+        heads = []
+        counts = []
+        scales = []
+        index = 0
+        for frame, n in zip(good, varints):
+            count = int(ints[index])
+            if count > 0 and n == 1 + 2 * count:
+                heads.append(index + 1)
+                counts.append(count)
+                scales.append(10 ** frame[1])
+            elif n != 1:
+                self.errors += 1
+            index += n
+        if not counts:
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        counts = np.array(counts)
+        first = np.cumsum(counts) - counts
+        pairs = np.repeat(np.array(heads) - 2 * first, counts) + 2 * np.arange(counts.sum())
+        timestamps = self._cumsum(ints[pairs], first, counts)
+        values = self._cumsum(ints[pairs + 1], first, counts) / np.repeat(scales, counts)
+        return timestamps, values
+
+    def _cumsum(self, deltas, first, counts):
+        # Running sums that restart at every frame
+        sums = np.cumsum(deltas)
+        return sums - np.repeat(sums[first] - deltas[first], counts)
+
+    def _decode_json(self, texts):
+        # One parse for the whole group; a bad payload sends it through one by one
+        readings = []
+        if texts:
+            try:
+                readings = json.loads(b'[' + b','.join(texts) + b']')
+            except ValueError:
+                for text in texts:
+                    try:
+                        readings.append(json.loads(text))
+                    except ValueError:
+                        self.errors += 1
+        timestamps = []
+        values = []
+        kinds = []
+        for reading in readings:
+            try:
+                if 'mean' in reading:
+                    # Stamped with the window's last reading; older firmware sent none
+                    value, kind, ts = reading['mean'], KIND_MEAN, reading.get('ts', -1)
+                elif 'alert' in reading:
+                    value, kind, ts = reading['value'], KIND_ALERT, reading['ts']
+                else:
+                    value, kind, ts = reading['value'], KIND_VALUE, reading.get('ts', -1)
+                value = float(value)
+                ts = int(ts)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                self.errors += 1
+                continue
+            timestamps.append(ts)
+            values.append(value)
+            kinds.append(kind)
+        return timestamps, values, kinds
+
+
+_worker = None
+
+
+def _init_worker(keys):
+    global _worker
+    _worker = Decoder(keys)
+
+
+def _decode_chunk(messages):
+    return _worker.decode(messages)
+
+
+def decode_parallel(keys, messages, processes=None, chunk_size=10000):
+    """Decodes messages across a process pool and returns one array."""
+    messages = list(messages)
+    chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+    with Pool(processes, initializer=_init_worker, initargs=(keys,)) as pool:
+        results = pool.map(_decode_chunk, chunks)
+    if not results:
+        return np.empty(0, dtype=DTYPE)
+    return np.concatenate(results)
@@ -0,0 +1,70 @@
+import math
+
+class Adaptive:
+
+    # Weight of each reading in the slow noise estimate
+    BETA = 0.01
+    # How far past the noise a change must be to count as a transition
+    THRESHOLD = 5.0
+    # Readings averaged before the noise estimate is trusted
+    WARMUP = 8
+    # Activity comes in spells (a lecture, a break, the heating coming on),
+    # so the interval stays short this long after the last transition
+    HOLD = 7200000
+    BACKOFF = 1.5
+
+    def __init__(self, wait, min_wait, max_wait, tolerance=0.01):
+        self.wait = wait
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.tolerance = tolerance
+        # Interval through a busy spell, halfway between the bounds on a log scale
+        self.busy_wait = int(math.sqrt(min_wait * max_wait))
+        # metric -> [last value, variance of the change between readings, readings]
+        self.stats = {}
+        self.active = False
+        # ms since the last transition, None before the first one
+        self.quiet = None
+
+    def update(self, metric, value):
+        stats = self.stats.get(metric)
+        if stats is None:
+            self.stats[metric] = [value, 0.0, 0]
+            return
+        last, var, n = stats
+        change = (value - last) ** 2
+        if n < self.WARMUP:
+            var += (change - var) / (n + 1)
+        else:
+            # Changes within the tolerance band never count as a transition
+            noise = max(var, (self.tolerance * abs(last)) ** 2, 1e-12)
+            if change > self.THRESHOLD * self.THRESHOLD * noise:
+                self.active = True
+            # A transition weighs in as at most 4x the noise, so a step
+            # does not blind the estimate to the next one
+            var += self.BETA * (min(change, 4 * noise) - var)
+        stats[0] = value
+        stats[1] = var
+        stats[2] = n + 1
+
+    def tick(self):
+        if self.active:
+            # One quick reading to catch the new level, then the busy interval
+            self.quiet = 0
+            self.wait = self.min_wait
+        else:
+            if self.quiet is not None and self.quiet < self.HOLD:
+                self.quiet += self.wait
+            if self.quiet is not None and self.quiet < self.HOLD:
+                self.wait = self.busy_wait
+            else:
+                self.wait = min(int(self.wait * self.BACKOFF), self.max_wait)
+        self.active = False
+        return self.wait
+
+    def save(self):
+        return [self.wait, self.quiet, self.stats]
+
+    def restore(self, data):
+        self.wait, self.quiet, self.stats = data
+        self.wait = min(max(self.wait, self.min_wait), self.max_wait)
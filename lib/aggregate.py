@@ -0,0 +1,66 @@
+import time
+from array import array
+
+class Aggregator:
+
+    def __init__(self, metrics, window, raw=(), clock=time.ticks_ms):
+        n = len(metrics)
+        self.metrics = list(metrics)
+        self.window = window
+        self.raw = raw
+        # One fixed slot per metric
+        self.min = array('f', [0] * n)
+        self.max = array('f', [0] * n)
+        self.sum = array('f', [0] * n)
+        self.count = array('H', [0] * n)
+        # Timestamps of each metric's first and last reading in the window
+        self.first = [0] * n
+        self.last = [0] * n
+        # detimotic passes its wall clock, ticks_ms starts over on every wake
+        self.clock = clock
+        self.start = clock()
+
+    def add(self, metric, value, t=0):
+        if metric in self.raw or metric not in self.metrics:
+            return False
+        i = self.metrics.index(metric)
+        if self.count[i] == 0:
+            self.first[i] = t
+        if self.count[i] == 0 or value < self.min[i]:
+            self.min[i] = value
+        if self.count[i] == 0 or value > self.max[i]:
+            self.max[i] = value
+        self.sum[i] += value
+        if self.count[i] < 0xffff:
+            self.count[i] += 1
+        self.last[i] = t
+        return True
+
+    def due(self):
+        return self.clock() - self.start >= self.window
+
+    def summaries(self):
+        self.start = self.clock()
+        for i in range(len(self.metrics)):
+            count = self.count[i]
+            if count == 0:
+                continue
+            self.count[i] = 0
+            yield self.metrics[i], self.min[i], self.max[i], self.sum[i] / count, count, self.first[i], self.last[i]
+            self.sum[i] = 0
+
+    def save(self):
+        # [window start, {metric: [min, max, sum, count, first, last]}]
+        held = {}
+        for i in range(len(self.metrics)):
+            if self.count[i]:
+                held[self.metrics[i]] = [self.min[i], self.max[i], self.sum[i], self.count[i],
+                        self.first[i], self.last[i]]
+        return [self.start, held]
+
+    def restore(self, data):
+        self.start, held = data
+        for metric in held:
+            if metric in self.metrics:
+                i = self.metrics.index(metric)
+                self.min[i], self.max[i], self.sum[i], self.count[i], self.first[i], self.last[i] = held[metric]
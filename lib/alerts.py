@@ -0,0 +1,28 @@
+class Rule:
+
+    def __init__(self, spec):
+        self.above = spec.get('above')
+        self.below = spec.get('below')
+        self.hysteresis = spec.get('hysteresis', 0)
+        # Max change per second before a reading counts as a spike
+        self.rate = spec.get('rate')
+        self.active = None
+
+    def check(self, value, prev=None, dt=0):
+        # Returns the alert raised or cleared by this reading, if any
+        if self.active is None:
+            if self.above is not None and value > self.above:
+                self.active = 'above'
+            elif self.below is not None and value < self.below:
+                self.active = 'below'
+            elif self.rate is not None and prev is not None and dt > 0 \
+                    and abs(value - prev) * 1000 / dt > self.rate:
+                return 'rate'
+            return self.active
+        if self.active == 'above' and value < self.above - self.hysteresis:
+            self.active = None
+            return 'clear'
+        if self.active == 'below' and value > self.below + self.hysteresis:
+            self.active = None
+            return 'clear'
+        return None
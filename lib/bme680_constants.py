@@ -1,12 +1,16 @@
-lookupTable1 = [2147483647, 2147483647, 2147483647, 2147483647,
+from array import array
+from micropython import const
+
+# Gas range lookup tables, packed as 32-bit words instead of boxed big ints
+lookupTable1 = array('L', [2147483647, 2147483647, 2147483647, 2147483647,
         2147483647, 2126008810, 2147483647, 2130303777, 2147483647,
         2147483647, 2143188679, 2136746228, 2147483647, 2126008810,
-        2147483647, 2147483647]
+        2147483647, 2147483647])
 
-lookupTable2 = [4096000000, 2048000000, 1024000000, 512000000,
+lookupTable2 = array('L', [4096000000, 2048000000, 1024000000, 512000000,
         255744255, 127110228, 64000000, 32258064,
         16016016, 8000000, 4000000, 2000000,
-        1000000, 500000, 250000, 125000]
+        1000000, 500000, 250000, 125000])
 
 def bytes_to_word(msb, lsb, bits=16, signed=False):
     word = (msb << 8) | lsb
@@ -19,102 +23,87 @@ def twos_comp(val, bits=16):
         val = val - (1 << bits)
     return val
 
-class FieldData:
-    def __init__(self):
-        self.status = None
-        self.heat_stable = False
-        self.gas_index = None
-        self.meas_index = None
-        self.temperature = None
-        self.pressure = None
-        self.humidity = None
-        self.gas_resistance = None
-
-class CalibrationData:
-    def __init__(self):
-        self.par_h1 = None
-        self.par_h2 = None
-        self.par_h3 = None
-        self.par_h4 = None
-        self.par_h5 = None
-        self.par_h6 = None
-        self.par_h7 = None
-        self.par_gh1 = None
-        self.par_gh2 = None
-        self.par_gh3 = None
-        self.par_t1 = None
-        self.par_t2 = None
-        self.par_t3 = None
-        self.par_p1 = None
-        self.par_p2 = None
-        self.par_p3 = None
-        self.par_p4 = None
-        self.par_p5 = None
-        self.par_p6 = None
-        self.par_p7 = None
-        self.par_p8 = None
-        self.par_p9 = None
-        self.par_p10 = None
-        self.t_fine = None
-        self.res_heat_range = None
-        self.res_heat_val = None
-        self.range_sw_err = None
+# MicroPython ignores __slots__, so the driver keeps its records in arrays
+# indexed by these constants instead of in instance dicts
 
-    def set_from_array(self, calibration):
-        self.par_t1 = bytes_to_word(calibration[34], calibration[33])
-        self.par_t2 = bytes_to_word(calibration[2], calibration[1], bits=16, signed=True)
-        self.par_t3 = twos_comp(calibration[3], bits=8)
-        self.par_p1 = bytes_to_word(calibration[6], calibration[5])
-        self.par_p2 = bytes_to_word(calibration[8], calibration[7], bits=16, signed=True)
-        self.par_p3 = twos_comp(calibration[9], bits=8)
-        self.par_p4 = bytes_to_word(calibration[12], calibration[11], bits=16, signed=True)
-        self.par_p5 = bytes_to_word(calibration[14], calibration[13], bits=16, signed=True)
-        self.par_p6 = twos_comp(calibration[16], bits=8)
-        self.par_p7 = twos_comp(calibration[15], bits=8)
-        self.par_p8 = bytes_to_word(calibration[20], calibration[19], bits=16, signed=True)
-        self.par_p9 = bytes_to_word(calibration[22], calibration[21], bits=16, signed=True)
-        self.par_p10 = calibration[23]
-        self.par_h1 = (calibration[27] << 4) | (calibration[26] & 0x0F)
-        self.par_h2 = (calibration[25] << 4) | (calibration[26] >> 4)
-        self.par_h3 = twos_comp(calibration[28], bits=8)
-        self.par_h4 = twos_comp(calibration[29], bits=8)
-        self.par_h5 = twos_comp(calibration[30], bits=8)
-        self.par_h6 = calibration[31]
-        self.par_h7 = twos_comp(calibration[32], bits=8)
-        self.par_gh1 = twos_comp(calibration[37], bits=8)
-        self.par_gh2 = bytes_to_word(calibration[36], calibration[35], bits=16, signed=True)
-        self.par_gh3 = twos_comp(calibration[38], bits=8)
+# Readings, array('f')
+TEMPERATURE = const(0)
+PRESSURE = const(1)
+HUMIDITY = const(2)
+GAS_RESISTANCE = const(3)
+DATA_LEN = const(4)
 
-    def set_other(self, heat_range, heat_value, sw_error):
-        self.res_heat_range = (heat_range & 0x30) // 16
-        self.res_heat_val = heat_value
-        self.range_sw_err = (sw_error * 0xf0) // 16
+# Field status, bytearray
+STATUS = const(0)
+GAS_INDEX = const(1)
+MEAS_INDEX = const(2)
+STATUS_LEN = const(3)
 
-class TPHSettings:
-    def __init__(self):
-        self.os_hum = None
-        self.os_temp = None
-        self.os_pres = None
-        self.filter = None
+# Settings, array('H')
+OS_HUM = const(0)
+OS_TEMP = const(1)
+OS_PRES = const(2)
+FILTER = const(3)
+NB_CONV = const(4)
+RUN_GAS = const(5)
+HEATR_TEMP = const(6)
+HEATR_DUR = const(7)
+SETTINGS_LEN = const(8)
 
-class GasSettings:
-    def __init__(self):
-        self.nb_conv = None
-        self.heatr_ctrl = None
-        self.run_gas = None
-        self.heatr_temp = None
-        self.heatr_dur = None
+# Calibration, array('l')
+PAR_T1 = const(0)
+PAR_T2 = const(1)
+PAR_T3 = const(2)
+PAR_P1 = const(3)
+PAR_P2 = const(4)
+PAR_P3 = const(5)
+PAR_P4 = const(6)
+PAR_P5 = const(7)
+PAR_P6 = const(8)
+PAR_P7 = const(9)
+PAR_P8 = const(10)
+PAR_P9 = const(11)
+PAR_P10 = const(12)
+PAR_H1 = const(13)
+PAR_H2 = const(14)
+PAR_H3 = const(15)
+PAR_H4 = const(16)
+PAR_H5 = const(17)
+PAR_H6 = const(18)
+PAR_H7 = const(19)
+PAR_GH1 = const(20)
+PAR_GH2 = const(21)
+PAR_GH3 = const(22)
+RES_HEAT_RANGE = const(23)
+RES_HEAT_VAL = const(24)
+RANGE_SW_ERR = const(25)
+T_FINE = const(26)
+CALIBRATION_LEN = const(27)
 
-class BME680Data:
-    def __init__(self):
-        self.chip_id = None
-        self.dev_id = None
-        self.intf = None
-        self.mem_page = None
-        self.ambient_temperature = None
-        self.data = FieldData()
-        self.calibration_data = CalibrationData()
-        self.tph_settings = TPHSettings()
-        self.gas_settings = GasSettings()
-        self.power_mode = None
-        self.new_fields = None
+def set_calibration(cal, calibration, heat_range, heat_value, sw_error):
+    cal[PAR_T1] = bytes_to_word(calibration[34], calibration[33])
+    cal[PAR_T2] = bytes_to_word(calibration[2], calibration[1], bits=16, signed=True)
+    cal[PAR_T3] = twos_comp(calibration[3], bits=8)
+    cal[PAR_P1] = bytes_to_word(calibration[6], calibration[5])
+    cal[PAR_P2] = bytes_to_word(calibration[8], calibration[7], bits=16, signed=True)
+    cal[PAR_P3] = twos_comp(calibration[9], bits=8)
+    cal[PAR_P4] = bytes_to_word(calibration[12], calibration[11], bits=16, signed=True)
+    cal[PAR_P5] = bytes_to_word(calibration[14], calibration[13], bits=16, signed=True)
+    cal[PAR_P6] = twos_comp(calibration[16], bits=8)
+    cal[PAR_P7] = twos_comp(calibration[15], bits=8)
+    cal[PAR_P8] = bytes_to_word(calibration[20], calibration[19], bits=16, signed=True)
+    cal[PAR_P9] = bytes_to_word(calibration[22], calibration[21], bits=16, signed=True)
+    cal[PAR_P10] = calibration[23]
+    cal[PAR_H1] = (calibration[27] << 4) | (calibration[26] & 0x0F)
+    cal[PAR_H2] = (calibration[25] << 4) | (calibration[26] >> 4)
+    cal[PAR_H3] = twos_comp(calibration[28], bits=8)
+    cal[PAR_H4] = twos_comp(calibration[29], bits=8)
+    cal[PAR_H5] = twos_comp(calibration[30], bits=8)
+    cal[PAR_H6] = calibration[31]
+    cal[PAR_H7] = twos_comp(calibration[32], bits=8)
+    cal[PAR_GH1] = twos_comp(calibration[37], bits=8)
+    cal[PAR_GH2] = bytes_to_word(calibration[36], calibration[35], bits=16, signed=True)
+    cal[PAR_GH3] = twos_comp(calibration[38], bits=8)
+    cal[RES_HEAT_RANGE] = (heat_range & 0x30) // 16
+    cal[RES_HEAT_VAL] = heat_value
+    cal[RANGE_SW_ERR] = (sw_error * 0xf0) // 16
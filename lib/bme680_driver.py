@@ -1,21 +1,77 @@
 from machine import I2C
+from micropython import const
 from lib.bme680_constants import *
+from lib import trace
+from array import array
 import math
 import time
 
-class BME680(BME680Data):
-    def __init__(self, i2c_addr=0x77, i2c_device=None):
-        BME680Data.__init__(self)
+# Register map
+_CHIP_ID_ADDR = const(0xd0)
+_CHIP_ID = const(0x61)
+_SOFT_RESET_ADDR = const(0xe0)
+_SOFT_RESET_CMD = const(0xb6)
+_COEFF_ADDR1 = const(0x89)
+_COEFF_ADDR1_LEN = const(25)
+_COEFF_ADDR2 = const(0xe1)
+_COEFF_ADDR2_LEN = const(16)
+_RES_HEAT_VAL_ADDR = const(0x00)
+_RES_HEAT_RANGE_ADDR = const(0x02)
+_RANGE_SW_ERR_ADDR = const(0x04)
+_FIELD0_ADDR = const(0x1d)
+_FIELD_LENGTH = const(15)
+_RES_HEAT0_ADDR = const(0x5a)
+_GAS_WAIT0_ADDR = const(0x64)
+_CONF_ODR_RUN_GAS_NBC_ADDR = const(0x71)
+_CONF_OS_H_ADDR = const(0x72)
+_CONF_T_P_MODE_ADDR = const(0x74)
+_CONF_ODR_FILT_ADDR = const(0x75)
+
+# Register masks and bit positions
+_OSH_MSK = const(0x07)
+_OSP_MSK = const(0x1c)
+_OSP_POS = const(2)
+_OST_MSK = const(0xe0)
+_OST_POS = const(5)
+_FILTER_MSK = const(0x1c)
+_FILTER_POS = const(2)
+_NBCONV_MSK = const(0x0f)
+_RUN_GAS_MSK = const(0x10)
+_RUN_GAS_POS = const(4)
+_MODE_MSK = const(0x03)
+_NEW_DATA_MSK = const(0x80)
+_GAS_INDEX_MSK = const(0x0f)
+_GAS_RANGE_MSK = const(0x0f)
+_GASM_VALID_MSK = const(0x20)
+_HEAT_STAB_MSK = const(0x10)
+
+_NBCONV_MIN = const(0)
+_NBCONV_MAX = const(9)
+_SLEEP_MODE = const(0)
+_FORCED_MODE = const(1)
+
+class BME680:
 
+    def __init__(self, i2c_addr=0x77, i2c_device=None):
         self.i2c_addr = i2c_addr
         self._i2c = i2c_device
-
-        self.chip_id = self._get_regs(0xd0, 1)
-        if self.chip_id != 0x61:
+        # Reused by every get_sensor_data() call
+        self._field = bytearray(_FIELD_LENGTH)
+        # Records indexed by the bme680_constants names; one object each
+        # instead of an instance dict per record
+        self.data = array('f', [0] * DATA_LEN)
+        self.status = bytearray(STATUS_LEN)
+        self.settings = array('H', [0] * SETTINGS_LEN)
+        self.calibration_data = array('l', [0] * CALIBRATION_LEN)
+        self.ambient_temperature = 0
+        self.power_mode = None
+
+        self.chip_id = self._get_regs(_CHIP_ID_ADDR, 1)
+        if self.chip_id != _CHIP_ID:
             raise RuntimeError("BME680 Not Found. Invalid CHIP ID: 0x{0:02x}".format(self.chip_id))
 
         self.soft_reset()
-        self.set_power_mode(0)
+        self.set_power_mode(_SLEEP_MODE)
 
         self._get_calibration_data()
 
@@ -28,140 +84,145 @@ class BME680(BME680Data):
         self.get_sensor_data()
 
     def _get_calibration_data(self):
-        calibration = self._get_regs(0x89, 25)
-        calibration += self._get_regs(0xe1, 16)
+        calibration = self._get_regs(_COEFF_ADDR1, _COEFF_ADDR1_LEN)
+        calibration += self._get_regs(_COEFF_ADDR2, _COEFF_ADDR2_LEN)
 
-        heat_range = self._get_regs(0x02, 1)
-        heat_value = twos_comp(self._get_regs(0x00, 1), bits=8)
-        sw_error = twos_comp(self._get_regs(0x04, 1), bits=8)
+        heat_range = self._get_regs(_RES_HEAT_RANGE_ADDR, 1)
+        heat_value = twos_comp(self._get_regs(_RES_HEAT_VAL_ADDR, 1), bits=8)
+        sw_error = twos_comp(self._get_regs(_RANGE_SW_ERR_ADDR, 1), bits=8)
 
-        self.calibration_data.set_from_array(calibration)
-        self.calibration_data.set_other(heat_range, heat_value, sw_error)
+        set_calibration(self.calibration_data, calibration, heat_range, heat_value, sw_error)
 
     def soft_reset(self):
-        self._set_regs(0xe0, 0xb6)
+        self._set_regs(_SOFT_RESET_ADDR, _SOFT_RESET_CMD)
         time.sleep(10 / 1000.0)
 
     def set_humidity_oversample(self, value):
-        self.tph_settings.os_hum = value
-        self._set_bits(0x72, 0X07, 0, value)
+        self.settings[OS_HUM] = value
+        self._set_bits(_CONF_OS_H_ADDR, _OSH_MSK, 0, value)
 
     def get_humidity_oversample(self):
-        return (self._get_regs(0x72, 1) & 0X07) >> 0
+        return self._get_regs(_CONF_OS_H_ADDR, 1) & _OSH_MSK
 
     def set_pressure_oversample(self, value):
-        self.tph_settings.os_pres = value
-        self._set_bits(0x74, 0X1C, 2, value)
+        self.settings[OS_PRES] = value
+        self._set_bits(_CONF_T_P_MODE_ADDR, _OSP_MSK, _OSP_POS, value)
 
     def get_pressure_oversample(self):
-        return (self._get_regs(0x74, 1) & 0X1C) >> 2
+        return (self._get_regs(_CONF_T_P_MODE_ADDR, 1) & _OSP_MSK) >> _OSP_POS
 
     def set_temperature_oversample(self, value):
-        self.tph_settings.os_temp = value
-        self._set_bits(0x74, 0XE0, 5, value)
+        self.settings[OS_TEMP] = value
+        self._set_bits(_CONF_T_P_MODE_ADDR, _OST_MSK, _OST_POS, value)
 
     def get_temperature_oversample(self):
-        return (self._get_regs(0x74, 1) & 0XE0) >> 5
+        return (self._get_regs(_CONF_T_P_MODE_ADDR, 1) & _OST_MSK) >> _OST_POS
 
     def set_filter(self, value):
-        self.tph_settings.filter = value
-        self._set_bits(0x75, 0X1C, 2, value)
+        self.settings[FILTER] = value
+        self._set_bits(_CONF_ODR_FILT_ADDR, _FILTER_MSK, _FILTER_POS, value)
 
     def get_filter(self):
-        return (self._get_regs(0x75, 1) & 0X1C) >> 2
+        return (self._get_regs(_CONF_ODR_FILT_ADDR, 1) & _FILTER_MSK) >> _FILTER_POS
 
     def select_gas_heater_profile(self, value):
-        if value > 9 or value < 0:
-            raise ValueError("Profile '{}' should be between {} and {}".format(value, NBCONV_MIN, NBCONV_MAX))
+        if value > _NBCONV_MAX or value < _NBCONV_MIN:
+            raise ValueError("Profile '{}' should be between {} and {}".format(value, _NBCONV_MIN, _NBCONV_MAX))
 
-        self.gas_settings.nb_conv = value
-        self._set_bits(0x71, 0X0F, 0, value)
+        self.settings[NB_CONV] = value
+        self._set_bits(_CONF_ODR_RUN_GAS_NBC_ADDR, _NBCONV_MSK, 0, value)
 
     def get_gas_heater_profile(self):
-        return self._get_regs(0x71, 1) & 0X0F
+        return self._get_regs(_CONF_ODR_RUN_GAS_NBC_ADDR, 1) & _NBCONV_MSK
 
     def set_gas_status(self, value):
-        self.gas_settings.run_gas = value
-        self._set_bits(0x71, 0x10, 4, value)
+        self.settings[RUN_GAS] = value
+        self._set_bits(_CONF_ODR_RUN_GAS_NBC_ADDR, _RUN_GAS_MSK, _RUN_GAS_POS, value)
 
     def get_gas_status(self):
-        return (self._get_regs(0x71, 1) & 0x10) >> 4
+        return (self._get_regs(_CONF_ODR_RUN_GAS_NBC_ADDR, 1) & _RUN_GAS_MSK) >> _RUN_GAS_POS
 
     def set_gas_heater_profile(self, temperature, duration, nb_profile=0):
         self.set_gas_heater_temperature(temperature, nb_profile=nb_profile)
         self.set_gas_heater_duration(duration, nb_profile=nb_profile)
 
     def set_gas_heater_temperature(self, value, nb_profile=0):
-        if nb_profile > 9 or value < 0:
-            raise ValueError("Profile '{}' should be between {} and {}".format(nb_profile, NBCONV_MIN, NBCONV_MAX))
+        if nb_profile > _NBCONV_MAX or value < 0:
+            raise ValueError("Profile '{}' should be between {} and {}".format(nb_profile, _NBCONV_MIN, _NBCONV_MAX))
 
-        self.gas_settings.heatr_temp = value
-        temp = int(self._calc_heater_resistance(self.gas_settings.heatr_temp))
-        self._set_regs(0x5a + nb_profile, temp)
+        self.settings[HEATR_TEMP] = value
+        temp = int(self._calc_heater_resistance(self.settings[HEATR_TEMP]))
+        self._set_regs(_RES_HEAT0_ADDR + nb_profile, temp)
 
     def set_gas_heater_duration(self, value, nb_profile=0):
-        if nb_profile > 9 or value < 0:
-            raise ValueError("Profile '{}' should be between {} and {}".format(nb_profile, NBCONV_MIN, NBCONV_MAX))
+        if nb_profile > _NBCONV_MAX or value < 0:
+            raise ValueError("Profile '{}' should be between {} and {}".format(nb_profile, _NBCONV_MIN, _NBCONV_MAX))
 
-        self.gas_settings.heatr_dur = value
-        temp = self._calc_heater_duration(self.gas_settings.heatr_dur)
-        self._set_regs(0x64 + nb_profile, temp)
+        self.settings[HEATR_DUR] = value
+        temp = self._calc_heater_duration(self.settings[HEATR_DUR])
+        self._set_regs(_GAS_WAIT0_ADDR + nb_profile, temp)
 
     def set_power_mode(self, value, blocking=True):
         """Set power mode"""
-        if value not in (0, 1):
+        if value != _SLEEP_MODE and value != _FORCED_MODE:
             print("Power mode should be one of SLEEP_MODE or FORCED_MODE")
 
         self.power_mode = value
 
-        self._set_bits(0x74, 0x03, 0, value)
+        self._set_bits(_CONF_T_P_MODE_ADDR, _MODE_MSK, 0, value)
 
         while blocking and self.get_power_mode() != self.power_mode:
             time.sleep(10 / 1000.0)
 
     def get_power_mode(self):
-        self.power_mode = self._get_regs(0x74, 1)
+        self.power_mode = self._get_regs(_CONF_T_P_MODE_ADDR, 1)
         return self.power_mode
 
     def get_sensor_data(self):
-        self.set_power_mode(1)
+        # The poll span covers the forced measurement until the data is read
+        t = trace.begin()
+        self.set_power_mode(_FORCED_MODE)
 
         for attempt in range(10):
-            status = self._get_regs(0x1d, 1)
+            status = self._get_regs(_FIELD0_ADDR, 1)
 
-            if (status & 0x80) == 0:
+            if (status & _NEW_DATA_MSK) == 0:
                 time.sleep(10 / 1000.0)
                 continue
 
-            regs = self._get_regs(0x1d, 15)
+            regs = self._field
+            self._i2c.read_i2c_block_data_into(self.i2c_addr, _FIELD0_ADDR, regs)
+            trace.end(t, 'bme680.poll')
 
-            self.data.status = regs[0] & 0x80
+            status = self.status
             # Contains the nb_profile used to obtain the current measurement
-            self.data.gas_index = regs[0] & 0x0f
-            self.data.meas_index = regs[1]
+            status[GAS_INDEX] = regs[0] & _GAS_INDEX_MSK
+            status[MEAS_INDEX] = regs[1]
 
             adc_pres = (regs[2] << 12) | (regs[3] << 4) | (regs[4] >> 4)
             adc_temp = (regs[5] << 12) | (regs[6] << 4) | (regs[7] >> 4)
             adc_hum = (regs[8] << 8) | regs[9]
             adc_gas_res = (regs[13] << 2) | (regs[14] >> 6)
-            gas_range = regs[14] & 0x0f
+            gas_range = regs[14] & _GAS_RANGE_MSK
 
-            self.data.status |= regs[14] & 0x20
-            self.data.status |= regs[14] & 0x10
-
-            self.data.heat_stable = (self.data.status & 0x10) > 0
+            status[STATUS] = (regs[0] & _NEW_DATA_MSK) | (regs[14] & (_GASM_VALID_MSK | _HEAT_STAB_MSK))
 
+            data = self.data
             temperature = self._calc_temperature(adc_temp)
-            self.data.temperature = temperature / 100.0
+            data[TEMPERATURE] = temperature / 100.0
             self.ambient_temperature = temperature
 
-            self.data.pressure = self._calc_pressure(adc_pres) / 100.0
-            self.data.humidity = self._calc_humidity(adc_hum) / 1000.0
-            self.data.gas_resistance = self._calc_gas_resistance(adc_gas_res, gas_range)
+            data[PRESSURE] = self._calc_pressure(adc_pres) / 100.0
+            data[HUMIDITY] = self._calc_humidity(adc_hum) / 1000.0
+            data[GAS_RESISTANCE] = self._calc_gas_resistance(adc_gas_res, gas_range)
             return True
 
+        trace.end(t, 'bme680.poll')
         return False
 
+    def heat_stable(self):
+        return (self.status[STATUS] & _HEAT_STAB_MSK) > 0
+
     def _set_bits(self, register, mask, position, value):
         temp = self._get_regs(register, 1)
         temp &= ~mask
@@ -181,29 +242,31 @@ class BME680(BME680Data):
             return self._i2c.read_i2c_block_data(self.i2c_addr, register, length)
 
     def _calc_temperature(self, temperature_adc):
-        var1 = (temperature_adc >> 3) - (self.calibration_data.par_t1 << 1)
-        var2 = (var1 * self.calibration_data.par_t2) >> 11
+        cal = self.calibration_data
+        var1 = (temperature_adc >> 3) - (cal[PAR_T1] << 1)
+        var2 = (var1 * cal[PAR_T2]) >> 11
         var3 = ((var1 >> 1) * (var1 >> 1)) >> 12
-        var3 = ((var3) * (self.calibration_data.par_t3 << 4)) >> 14
+        var3 = ((var3) * (cal[PAR_T3] << 4)) >> 14
 
         # Save teperature data for pressure calculations
-        self.calibration_data.t_fine = (var2 + var3)
-        calc_temp = (((self.calibration_data.t_fine * 5) + 128) >> 8)
+        cal[T_FINE] = (var2 + var3)
+        calc_temp = (((cal[T_FINE] * 5) + 128) >> 8)
 
         return calc_temp
 
     def _calc_pressure(self, pressure_adc):
-        var1 = ((self.calibration_data.t_fine) >> 1) - 64000
+        cal = self.calibration_data
+        var1 = ((cal[T_FINE]) >> 1) - 64000
         var2 = ((((var1 >> 2) * (var1 >> 2)) >> 11) *
-            self.calibration_data.par_p6) >> 2
-        var2 = var2 + ((var1 * self.calibration_data.par_p5) << 1)
-        var2 = (var2 >> 2) + (self.calibration_data.par_p4 << 16)
+            cal[PAR_P6]) >> 2
+        var2 = var2 + ((var1 * cal[PAR_P5]) << 1)
+        var2 = (var2 >> 2) + (cal[PAR_P4] << 16)
         var1 = (((((var1 >> 2) * (var1 >> 2)) >> 13 ) *
-                ((self.calibration_data.par_p3 << 5)) >> 3) +
-                ((self.calibration_data.par_p2 * var1) >> 1))
+                ((cal[PAR_P3] << 5)) >> 3) +
+                ((cal[PAR_P2] * var1) >> 1))
         var1 = var1 >> 18
 
-        var1 = ((32768 + var1) * self.calibration_data.par_p1) >> 15
+        var1 = ((32768 + var1) * cal[PAR_P1]) >> 15
         calc_pressure = 1048576 - pressure_adc
         calc_pressure = ((calc_pressure - (var2 >> 12)) * (3125))
 
@@ -212,30 +275,31 @@ class BME680(BME680Data):
         else:
             calc_pressure = ((calc_pressure << 1) // var1)
 
-        var1 = (self.calibration_data.par_p9 * (((calc_pressure >> 3) *
+        var1 = (cal[PAR_P9] * (((calc_pressure >> 3) *
             (calc_pressure >> 3)) >> 13)) >> 12
         var2 = ((calc_pressure >> 2) *
-            self.calibration_data.par_p8) >> 13
+            cal[PAR_P8]) >> 13
         var3 = ((calc_pressure >> 8) * (calc_pressure >> 8) *
             (calc_pressure >> 8) *
-            self.calibration_data.par_p10) >> 17
+            cal[PAR_P10]) >> 17
 
         calc_pressure = (calc_pressure) + ((var1 + var2 + var3 +
-            (self.calibration_data.par_p7 << 7)) >> 4)
+            (cal[PAR_P7] << 7)) >> 4)
 
         return calc_pressure
 
     def _calc_humidity(self, humidity_adc):
-        temp_scaled = ((self.calibration_data.t_fine * 5) + 128) >> 8
-        var1 = (humidity_adc - ((self.calibration_data.par_h1 * 16))) \
-                - (((temp_scaled * self.calibration_data.par_h3) // (100)) >> 1)
-        var2 = (self.calibration_data.par_h2
-                * (((temp_scaled * self.calibration_data.par_h4) // (100))
-                + (((temp_scaled * ((temp_scaled * self.calibration_data.par_h5) // (100))) >> 6)
+        cal = self.calibration_data
+        temp_scaled = ((cal[T_FINE] * 5) + 128) >> 8
+        var1 = (humidity_adc - ((cal[PAR_H1] * 16))) \
+                - (((temp_scaled * cal[PAR_H3]) // (100)) >> 1)
+        var2 = (cal[PAR_H2]
+                * (((temp_scaled * cal[PAR_H4]) // (100))
+                + (((temp_scaled * ((temp_scaled * cal[PAR_H5]) // (100))) >> 6)
                 // (100)) + (1 * 16384))) >> 10
         var3 = var1 * var2
-        var4 = self.calibration_data.par_h6 << 7
-        var4 = ((var4) + ((temp_scaled * self.calibration_data.par_h7) // (100))) >> 4
+        var4 = cal[PAR_H6] << 7
+        var4 = ((var4) + ((temp_scaled * cal[PAR_H7]) // (100))) >> 4
         var5 = ((var3 >> 14) * (var3 >> 14)) >> 10
         var6 = (var4 * var5) >> 1
         calc_hum = (((var3 + var6) >> 10) * (1000)) >> 12
@@ -243,7 +307,8 @@ class BME680(BME680Data):
         return min(max(calc_hum,0),100000)
 
     def _calc_gas_resistance(self, gas_res_adc, gas_range):
-        var1 = ((1340 + (5 * self.calibration_data.range_sw_err)) * (lookupTable1[gas_range])) >> 16
+        cal = self.calibration_data
+        var1 = ((1340 + (5 * cal[RANGE_SW_ERR])) * (lookupTable1[gas_range])) >> 16
         var2 = (((gas_res_adc << 15) - (16777216)) + var1)
         var3 = ((lookupTable2[gas_range] * var1) >> 9)
         calc_gas_res = ((var3 + (var2 >> 1)) / var2)
@@ -251,13 +316,14 @@ class BME680(BME680Data):
         return calc_gas_res
 
     def _calc_heater_resistance(self, temperature):
+        cal = self.calibration_data
         temperature = min(max(temperature,200),400)
 
-        var1 = ((self.ambient_temperature * self.calibration_data.par_gh3) / 1000) * 256
-        var2 = (self.calibration_data.par_gh1 + 784) * (((((self.calibration_data.par_gh2 + 154009) * temperature * 5) / 100) + 3276800) / 10)
+        var1 = ((self.ambient_temperature * cal[PAR_GH3]) / 1000) * 256
+        var2 = (cal[PAR_GH1] + 784) * (((((cal[PAR_GH2] + 154009) * temperature * 5) / 100) + 3276800) / 10)
         var3 = var1 + (var2 / 2)
-        var4 = (var3 / (self.calibration_data.res_heat_range + 4))
-        var5 = (131 * self.calibration_data.res_heat_val) + 65536
+        var4 = (var3 / (cal[RES_HEAT_RANGE] + 4))
+        var5 = (131 * cal[RES_HEAT_VAL]) + 65536
         heatr_res_x100 = (((var4 / var5) - 250) * 34)
         heatr_res = ((heatr_res_x100 + 50) / 100)
 
@@ -278,13 +344,28 @@ class BME680(BME680Data):
 class I2CAdapter(I2C):
 
     def read_byte_data(self, addr, register):
-        return self.readfrom_mem(addr, register, 1)[0]
+        t = trace.begin()
+        value = self.readfrom_mem(addr, register, 1)[0]
+        trace.end(t, 'i2c')
+        return value
 
     def read_i2c_block_data(self, addr, register, length):
-        return self.readfrom_mem(addr, register, length)
+        t = trace.begin()
+        data = self.readfrom_mem(addr, register, length)
+        trace.end(t, 'i2c')
+        return data
+
+    def read_i2c_block_data_into(self, addr, register, buf):
+        t = trace.begin()
+        self.readfrom_mem_into(addr, register, buf)
+        trace.end(t, 'i2c')
 
     def write_byte_data(self, addr, register, data):
-        return self.writeto_mem(addr, register, data)
+        t = trace.begin()
+        self.writeto_mem(addr, register, data)
+        trace.end(t, 'i2c')
 
     def write_i2c_block_data(self, addr, register, data):
-        return self.writeto_mem(addr, register, data)
+        t = trace.begin()
+        self.writeto_mem(addr, register, data)
+        trace.end(t, 'i2c')
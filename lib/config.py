@@ -0,0 +1,119 @@
+# Keys a config delta may change per module; anything else needs a re-flash
+MODULE_KEYS = ('active', 'wait_time', 'min_wait', 'max_wait', 'budget', 'metrics')
+METRIC_KEYS = ('id', 'key')
+# AES-128, 192 and 256
+KEY_SIZES = (16, 24, 32)
+RULE_KEYS = ('above', 'below', 'hysteresis', 'rate')
+# Readings are single-precision floats, good for about 7 digits
+MAX_DECIMALS = 6
+
+def merge(conf, delta):
+    # Returns (version, entries): the delta merged onto copies of the module
+    # entries it names. conf itself is left untouched, so a delta that fails
+    # validation anywhere is rejected as a whole
+    version = delta.get('version')
+    if not _int(version) or version <= conf.get('version', 0):
+        raise ValueError('stale or missing version')
+    current = {}
+    for module in conf['modules']:
+        current[module['name']] = module
+    entries = []
+    names = []
+    for change in delta.get('modules', ()):
+        name = change.get('name')
+        if name not in current or name in names:
+            raise ValueError('unknown or repeated module: {}'.format(name))
+        names.append(name)
+        module = dict(current[name])
+        for key in change:
+            if key == 'name':
+                continue
+            if key not in MODULE_KEYS:
+                raise ValueError('{}: {} cannot be changed'.format(name, key))
+            if key == 'metrics':
+                module['metrics'] = _metrics(name, module['metrics'], change['metrics'])
+            else:
+                module[key] = change[key]
+        _check(name, module)
+        entries.append(module)
+    return version, entries
+
+def check(module):
+    # Validates a conf.json module entry, as loaded at boot
+    _check(module.get('name'), module)
+
+def _int(value):
+    # bool is an int subclass, but true is no wait time
+    return type(value) is int
+
+def _number(value):
+    return type(value) is int or type(value) is float
+
+def _check(name, module):
+    if type(module['active']) is not bool:
+        raise ValueError('{}: active must be true or false'.format(name))
+    for key in ('wait_time', 'min_wait', 'max_wait', 'budget'):
+        if key in module and (not _int(module[key]) or module[key] <= 0):
+            raise ValueError('{}: {} must be a positive int'.format(name, key))
+    if ('min_wait' in module) != ('max_wait' in module):
+        raise ValueError('{}: min_wait and max_wait go together'.format(name))
+    if 'min_wait' in module and not module['min_wait'] <= module['wait_time'] <= module['max_wait']:
+        raise ValueError('{}: wait_time outside [min_wait, max_wait]'.format(name))
+    for id in module['metrics']:
+        metric = module['metrics'][id]
+        if not isinstance(metric, dict) or not isinstance(metric.get('id'), str) \
+                or not isinstance(metric.get('key'), str):
+            raise ValueError('{}: metric {} needs an "id" and a "key"'.format(name, id))
+        if len(metric['key'].encode('utf-8')) not in KEY_SIZES:
+            raise ValueError('{}: metric {} key must be 16, 24 or 32 bytes'.format(name, id))
+    # Not changeable by a delta, but a delta may start a module that has them
+    if 'batch' in module:
+        batch = module['batch']
+        if not isinstance(batch, dict) or not _int(batch.get('size')) or batch['size'] <= 0:
+            raise ValueError('{}: batch size must be a positive int'.format(name))
+        if not _int(batch.get('decimals')) or not 0 <= batch['decimals'] <= MAX_DECIMALS:
+            raise ValueError('{}: batch decimals must be 0 to {}'.format(name, MAX_DECIMALS))
+    if 'aggregate' in module:
+        aggregate = module['aggregate']
+        if not isinstance(aggregate, dict) or not _int(aggregate.get('window')) or aggregate['window'] <= 0:
+            raise ValueError('{}: aggregate window must be a positive int'.format(name))
+        raw = aggregate.get('raw', [])
+        if not isinstance(raw, list) or any(id not in module['metrics'] for id in raw):
+            raise ValueError('{}: aggregate raw must list metrics of the module'.format(name))
+    if 'alerts' in module:
+        if not isinstance(module['alerts'], dict):
+            raise ValueError('{}: alerts must map metrics to rules'.format(name))
+        for id in module['alerts']:
+            _rule(name, id, module)
+    if 'scan' in module:
+        scan = module['scan']
+        if not isinstance(scan, dict) or not _number(scan.get('duty')) or not 0 < scan['duty'] < 1:
+            raise ValueError('{}: scan duty must be between 0 and 1'.format(name))
+
+def _rule(name, id, module):
+    rule = module['alerts'][id]
+    if id not in module['metrics'] or not isinstance(rule, dict):
+        raise ValueError('{}: alert on unknown metric {}'.format(name, id))
+    for key in rule:
+        if key not in RULE_KEYS or not _number(rule[key]):
+            raise ValueError('{}: bad {} in the alert on {}'.format(name, key, id))
+    if 'above' not in rule and 'below' not in rule and 'rate' not in rule:
+        raise ValueError('{}: the alert on {} needs above, below or rate'.format(name, id))
+    if rule.get('hysteresis', 0) < 0 or rule.get('rate', 1) <= 0:
+        raise ValueError('{}: the alert on {} needs a positive rate and hysteresis'.format(name, id))
+
+def _metrics(name, metrics, changes):
+    # Metrics can be re-keyed or re-identified, not added; their rings and
+    # readings are tied to the sensor code
+    metrics = dict(metrics)
+    for id in changes:
+        if id not in metrics or not isinstance(changes[id], dict):
+            raise ValueError('{}: unknown metric {}'.format(name, id))
+        metric = dict(metrics[id])
+        for key in changes[id]:
+            value = changes[id][key]
+            if key not in METRIC_KEYS or not isinstance(value, str):
+                raise ValueError('{}: bad {} for metric {}'.format(name, key, id))
+            metric[key] = value
+        metrics[id] = metric
+    return metrics
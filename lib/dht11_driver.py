@@ -0,0 +1,115 @@
+import time
+import pycom
+from machine import Pin
+
+class DTHResult:
+    ERR_NO_ERROR = 0
+    ERR_MISSING_DATA = 1
+    ERR_CRC = 2
+
+    error_code = ERR_NO_ERROR
+    temperature = -1
+    humidity = -1
+    ticks = None
+
+    def __init__(self, error_code, temperature, humidity):
+        self.error_code = error_code
+        self.temperature = temperature
+        self.humidity = humidity
+
+    def is_valid(self):
+        return self.error_code == DTHResult.ERR_NO_ERROR
+
+
+class DTH:
+    DHT11 = 0
+    DHT22 = 1
+
+    # Shortest time between two conversions, and after power-up, in ms
+    MIN_INTERVAL = (1000, 2000)
+
+    # High pulse widths in us: ~26 us is a 0 bit, ~70 us a 1 bit
+    ZERO_MIN = 18
+    ZERO_MAX = 28
+    ONE_MIN = 65
+    ONE_MAX = 75
+
+    def __init__(self, pin, sensor=0):
+        self.__pin = Pin(pin, mode=Pin.OPEN_DRAIN)
+        self.__dhttype = sensor
+        self.__pin(1)
+        self.__interval = DTH.MIN_INTERVAL[sensor]
+        # The sensor is not ready until a full interval after power-up
+        self.__next = time.ticks_ms() + self.__interval
+        self.__bytes = bytearray(5)
+        self.last = DTHResult(DTHResult.ERR_MISSING_DATA, 0, 0)
+        self.error = DTHResult.ERR_NO_ERROR
+        self.errors = 0
+
+    def read(self):
+        # Returns the last valid reading, measuring again only once the sensor
+        # allows it; result.ticks tells a fresh reading from a cached one
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self.__next) < 0:
+            return self.last
+        self.__next = now + self.__interval
+
+        # Start signal: hold the line low for at least 18 ms
+        self.__pin(0)
+        time.sleep_ms(19)
+        data = pycom.pulses_get(self.__pin, 100)
+        self.__pin.init(Pin.OPEN_DRAIN)
+        self.__pin(1)
+
+        # A failed conversion is not retried here, the cached reading stands
+        # until the next read() after ready() ms measures again
+        self.error = self.__decode(data)
+        if self.error != DTHResult.ERR_NO_ERROR:
+            self.errors += 1
+            return self.last
+
+        int_rh, dec_rh, int_t, dec_t, csum = self.__bytes
+        if self.__dhttype == DTH.DHT11:
+            rh = int_rh         # dht11 20% ~ 90%
+            t = int_t           # dht11 0..50°C
+        else:                   # dht21, dht22
+            rh = ((int_rh << 8) | dec_rh) / 10
+            t = (((int_t & 0x7F) << 8) | dec_t) / 10
+            if int_t & 0x80:
+                t = -t
+        last = self.last
+        last.error_code = DTHResult.ERR_NO_ERROR
+        last.temperature = t
+        last.humidity = rh
+        last.ticks = now
+        return last
+
+    def ready(self):
+        # ms until the sensor allows the next conversion
+        return max(time.ticks_diff(self.__next, time.ticks_ms()), 0)
+
+    def __decode(self, data):
+        # Shifts the 40 data bits straight into the 5-byte buffer
+        buf = self.__bytes
+        n = 0
+        byte = 0
+        for level, width in data:
+            if level != 1:
+                continue
+            if self.ZERO_MIN <= width <= self.ZERO_MAX:
+                byte <<= 1
+            elif self.ONE_MIN <= width <= self.ONE_MAX:
+                byte = (byte << 1) | 1
+            else:
+                continue
+            n += 1
+            if not n & 7:
+                buf[(n >> 3) - 1] = byte
+                byte = 0
+                if n == 40:
+                    break
+        if n != 40:
+            return DTHResult.ERR_MISSING_DATA
+        if (buf[0] + buf[1] + buf[2] + buf[3]) & 0xff != buf[4]:
+            return DTHResult.ERR_CRC
+        return DTHResult.ERR_NO_ERROR
@@ -0,0 +1,111 @@
+import time
+import gc
+import ujson
+from lib import trace
+
+class ModuleStats:
+
+    def __init__(self):
+        self.wait = 0
+        self.reset()
+
+    def reset(self):
+        self.runs = 0
+        self.loop_min = 0
+        self.loop_max = 0
+        self.loop_sum = 0
+        self.late_max = 0
+        self.late_sum = 0
+
+    def add(self, duration, late, wait):
+        self.wait = wait
+        if self.runs == 0 or duration < self.loop_min:
+            self.loop_min = duration
+        if duration > self.loop_max:
+            self.loop_max = duration
+        if late < 0:
+            late = 0
+        if late > self.late_max:
+            self.late_max = late
+        self.loop_sum += duration
+        self.late_sum += late
+        self.runs += 1
+
+    def frame(self):
+        if self.runs == 0:
+            return [0, 0, 0, 0, 0, 0, self.wait]
+        return [self.runs, self.loop_min, self.loop_sum // self.runs, self.loop_max,
+                self.late_sum // self.runs, self.late_max, self.wait]
+
+class Health:
+
+    def __init__(self):
+        self.modules = {}
+        self.last_frame = time.ticks_ms()
+        self.bytes_out = 0
+        self.reset()
+
+    def reset(self):
+        for stats in self.modules.values():
+            stats.reset()
+        self.published = 0
+        self.publish_errors = 0
+        self.reconnects = 0
+        self.bytes_out = 0
+        self.mem_errors = 0
+        self.mem_low = 0
+        self.mem_high = 0
+        self.gc_count = 0
+        self.gc_sum = 0
+        self.gc_max = 0
+
+    def loop(self, name, duration, late, wait):
+        stats = self.modules.get(name)
+        if stats is None:
+            stats = ModuleStats()
+            self.modules[name] = stats
+        stats.add(duration, late, wait)
+
+    def memory(self):
+        free = gc.mem_free()
+        if self.mem_low == 0 or free < self.mem_low:
+            self.mem_low = free
+        if free > self.mem_high:
+            self.mem_high = free
+        return free
+
+    def collect(self):
+        start = time.ticks_us()
+        gc.collect()
+        pause = time.ticks_diff(time.ticks_us(), start)
+        trace.end(start, 'gc')
+        self.gc_count += 1
+        self.gc_sum += pause
+        if pause > self.gc_max:
+            self.gc_max = pause
+        self.memory()
+
+    def due(self, freq):
+        return time.ticks_ms() - self.last_frame >= freq
+
+    def frame(self, extra=None):
+        self.last_frame = time.ticks_ms()
+        gc_avg = self.gc_sum // self.gc_count if self.gc_count else 0
+        mod = {}
+        for name in self.modules:
+            mod[name] = self.modules[name].frame()
+        frame = {
+            "up": time.ticks_ms(),
+            "mem": [self.mem_low, self.mem_high, gc.mem_free()],
+            "gc": [self.gc_count, gc_avg, self.gc_max],
+            "pub": [self.published, self.publish_errors],
+            "oom": self.mem_errors,
+            "rc": self.reconnects,
+            "tx": self.bytes_out,
+            "mod": mod
+        }
+        if extra is not None:
+            frame.update(extra)
+        frame = ujson.dumps(frame)
+        self.reset()
+        return frame
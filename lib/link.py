@@ -0,0 +1,51 @@
+import time
+
+class Link:
+    # Radio on/off bookkeeping. In burst mode WiFi is only up while a
+    # flush is in progress; readings wait in the pending buffer meanwhile
+
+    def __init__(self, burst=False, flush_interval=30000, buffer=24):
+        self.burst = burst
+        self.flush_interval = flush_interval
+        self.buffer = buffer
+        self.up = False
+        self.bssid = None
+        self.since = time.ticks_ms()
+        self.last_burst = self.since
+        self.reset()
+
+    def reset(self):
+        self.on_time = 0
+        self.bursts = 0
+        self.connect_time = 0
+        self.period_start = time.ticks_ms()
+
+    def wake(self, connect_time):
+        if not self.up:
+            self.up = True
+            self.since = time.ticks_ms()
+            self.bursts += 1
+        self.connect_time += connect_time
+
+    def sleep(self):
+        if self.up:
+            self.up = False
+            now = time.ticks_ms()
+            self.on_time += now - self.since
+            self.last_burst = now
+
+    def due(self, queued):
+        # Wake on a full buffer or when the oldest reading has waited long enough
+        return queued >= self.buffer or time.ticks_ms() - self.last_burst >= self.flush_interval
+
+    def frame(self):
+        # [ms radio on, bursts, ms spent reconnecting, ms radio on per hour]
+        now = time.ticks_ms()
+        on_time = self.on_time
+        if self.up:
+            on_time += now - self.since
+            self.since = now
+        period = now - self.period_start
+        frame = [on_time, self.bursts, self.connect_time, on_time * 3600000 // period if period > 0 else 0]
+        self.reset()
+        return frame
@@ -3,7 +3,6 @@ import time
 import machine
 import math
 from machine import Pin, ADC
-import gc
 
 class LMV324:
 
@@ -13,15 +12,16 @@ class LMV324:
     def __init__ (self, pin):
         adc= ADC (bits= 12)
         self.apin= adc.channel(pin= pin, attn= ADC.ATTN_11DB)
+        self.decibel_mean= [0] * LMV324.NUM_SOUND_LOOPS
 
     def dbRead (self):
 
-        gc.collect()
-        decibel_mean= [0] * LMV324.NUM_SOUND_LOOPS
+        decibel_mean= self.decibel_mean
         channel_0= -1
         value_1 = 0.0
 
         for i in range (0,LMV324.NUM_SOUND_LOOPS):
+            decibel_mean[i] = 0
             for j in range (0,LMV324.NUM_SOUND_MEAN):
                 while (channel_0 < 0) or (channel_0 > 4000):
                     channel_0= self.apin()
@@ -0,0 +1,71 @@
+import time
+import gc
+
+class MemoryManager:
+
+    MIN_THRESHOLD = 4096
+
+    def __init__(self, low_water=16384, critical=8192, gc_period=5000, idle_interval=10000, min_gap=1000, health=None):
+        self.low_water = low_water
+        self.critical = critical
+        self.gc_period = gc_period
+        self.idle_interval = idle_interval
+        # Shortest time between collections forced by a low heap
+        self.min_gap = min_gap
+        self.health = health
+        self.stretch = 1
+        self.heap = 0
+        self.threshold = 0
+        # Allocation rate in bytes/s; bytes/ms truncates to 0 on a quiet node
+        self.rate = 0
+        self.last_collect = time.ticks_ms()
+        self.last_free = 0
+
+    def setup(self):
+        self.collect()
+        self.heap = self.last_free
+        self._set_threshold(self.heap // 4)
+
+    def collect(self):
+        if self.health is not None:
+            self.health.collect()
+        else:
+            gc.collect()
+        self.last_collect = time.ticks_ms()
+        self.last_free = gc.mem_free()
+        self._update_pressure()
+
+    def tick(self, idle):
+        free = gc.mem_free()
+        elapsed = time.ticks_ms() - self.last_collect
+        if elapsed > 0 and self.last_free > free:
+            rate = (self.last_free - free) * 1000 // elapsed
+            self.rate = (self.rate * 3 + rate) // 4
+        # Below low_water a collection rarely frees much; one per min_gap
+        # instead of one per pass
+        if (free < self.low_water and elapsed >= self.min_gap) or (idle and elapsed >= self.idle_interval):
+            self.collect()
+            self._set_threshold(self.rate * self.gc_period // 1000)
+            return True
+        return False
+
+    def oom(self):
+        self.collect()
+        self.stretch = 4
+
+    def pressure(self):
+        return self.stretch > 1
+
+    def _update_pressure(self):
+        if self.last_free < self.critical:
+            self.stretch = 4
+        elif self.last_free < self.low_water:
+            self.stretch = 2
+        else:
+            self.stretch = 1
+
+    def _set_threshold(self, threshold):
+        threshold = max(self.MIN_THRESHOLD, min(threshold, self.heap // 2))
+        if threshold != self.threshold:
+            self.threshold = threshold
+            gc.threshold(threshold)
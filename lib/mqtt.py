@@ -1,47 +1,94 @@
 import usocket as socket
 import ustruct as struct
+import uselect as select
 from ubinascii import hexlify
 import time
+from lib import trace
+
+# Resolved gateway addresses, shared by every client in this process
+_dns_cache = {}
 
 class MQTTException(Exception):
     pass
 
 class MQTTC:
 
+    PKT_SIZE = 256
+    RBUF_SIZE = 512
+    # Wait for PUBACK/SUBACK and for socket room when ping_timeout is unset
+    ACK_TIMEOUT = 10000
+
     def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0,
-                 ssl=False, ssl_params={}):
+                 ssl=False, ssl_params={}, ping_timeout=0, connect_timeout=0, rbuf_size=0):
         if port == 0:
             port = 8883 if ssl else 1883
         self.client_id = client_id
         self.sock = None
-        self.addr = socket.getaddrinfo(server, port)[0][-1]
+        self.server = server
+        self.port = port
+        self.addr = self.resolve()
         self.ssl = ssl
         self.ssl_params = ssl_params
+        self._tls_session = None
         self.pid = 0
         self.cb = None
         self.user = user
         self.pswd = password
         self.keepalive = keepalive
+        self.ping_timeout = ping_timeout or keepalive * 500
+        self.connect_timeout = connect_timeout
         self.lw_topic = None
         self.lw_msg = None
         self.lw_qos = 0
         self.lw_retain = False
         self.last_pingreq = time.ticks_ms()
         self.last_pingresp = time.ticks_ms()
+        self.last_tx = time.ticks_ms()
+        self._ping_out = False
+        self.bytes_out = 0
+        self.reconnects = 0
+        self._pkt = bytearray(self.PKT_SIZE)
+        if rbuf_size:
+            # Incoming packets larger than the buffer are dropped
+            self.RBUF_SIZE = rbuf_size
+        self._rbuf = bytearray(self.RBUF_SIZE)
+        self._rmv = memoryview(self._rbuf)
+        self._rpos = 0
+        self._wpos = 0
+        self._skip = 0
+        self._poll = None
+        self._puback = 0
+        self._suback = 0
+        self._suback_rc = 0
+        self.dropped = 0
 
-    def _send_str(self, s):
-        self.sock.write(struct.pack("!H", len(s)))
-        self.sock.write(s)
+    def _write(self, data):
+        written = self.sock.write(data)
+        if self._poll is not None and (written is None or written < len(data)):
+            # Non-blocking once attached: wait for room for the rest
+            written = self._write_rest(data, written or 0)
+        if written is not None:
+            self.bytes_out += written
+        self.last_tx = time.ticks_ms()
+        return written
 
-    def _recv_len(self):
-        n = 0
-        sh = 0
-        while 1:
-            b = self.sock.read(1)[0]
-            n |= (b & 0x7f) << sh
-            if not b & 0x80:
-                return n
-            sh += 7
+    def _write_rest(self, data, written):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        data = memoryview(data)
+        start = time.ticks_ms()
+        while written < len(data):
+            if time.ticks_ms() - start >= (self.ping_timeout or self.ACK_TIMEOUT):
+                raise OSError(-4)
+            time.sleep_ms(10)
+            n = self.sock.write(data[written:])
+            if n:
+                written += n
+        return written
+
+    def _send_str(self, s):
+        self._write(struct.pack("!H", len(s)))
+        self._write(s)
 
     def set_callback(self, f):
         self.cb = f
@@ -54,12 +101,33 @@ class MQTTC:
         self.lw_qos = qos
         self.lw_retain = retain
 
+    def resolve(self, refresh=False):
+        key = (self.server, self.port)
+        if refresh or key not in _dns_cache:
+            _dns_cache[key] = socket.getaddrinfo(self.server, self.port)[0][-1]
+        return _dns_cache[key]
+
     def connect(self, clean_session=True):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
         self.sock = socket.socket()
+        if self.connect_timeout:
+            self.sock.settimeout(self.connect_timeout / 1000)
         self.sock.connect(self.addr)
         if self.ssl:
             import ussl
-            self.sock = ussl.wrap_socket(self.sock, **self.ssl_params)
+            params = self.ssl_params
+            if self._tls_session is not None:
+                # Abbreviated handshake; mbedTLS falls back to a full one if refused
+                params = dict(params)
+                params['saved_session'] = self._tls_session
+            self.sock = ussl.wrap_socket(self.sock, **params)
+            save_session = getattr(ussl, 'save_session', None)
+            if save_session is not None:
+                self._tls_session = save_session(self.sock)
         msg = bytearray(b"\x10\0\0\x04MQTT\x04\x02\0\0")
         msg[1] = 10 + 2 + len(self.client_id)
         msg[9] = clean_session << 1
@@ -74,7 +142,7 @@ class MQTTC:
             msg[1] += 2 + len(self.lw_topic) + 2 + len(self.lw_msg)
             msg[9] |= 0x4 | (self.lw_qos & 0x1) << 3 | (self.lw_qos & 0x2) << 3
             msg[9] |= self.lw_retain << 5
-        self.sock.write(msg)
+        self._write(msg)
         #print(hex(len(msg)), hexlify(msg, ":"))
         self._send_str(self.client_id)
         if self.lw_topic:
@@ -87,131 +155,257 @@ class MQTTC:
         assert resp[0] == 0x20 and resp[1] == 0x02
         if resp[3] != 0:
             raise MQTTException(resp[3])
+        if self.connect_timeout:
+            self.sock.settimeout(None)
+        self._attach()
         return resp[2] & 1
 
+    def _attach(self):
+        # A blocking readinto only returns once the whole buffer is full,
+        # so the socket is switched to non-blocking after CONNACK
+        self.sock.setblocking(False)
+        self._rpos = 0
+        self._wpos = 0
+        self._skip = 0
+        self._ping_out = False
+        self._poll = select.poll()
+        self._poll.register(self.sock, select.POLLIN)
+
     def disconnect(self):
-        self.sock.write(b"\xe0\0")
+        self._write(b"\xe0\0")
         self.sock.close()
 
     def ping(self):
-        self.sock.write(b"\xc0\0")
+        self._write(b"\xc0\0")
         self.last_pingreq = time.ticks_ms()
+        self._ping_out = True
+
+    def _on_pingresp(self, rtt):
+        pass
+
+    def oversize(self, op, topic, size):
+        print("mqtt: dropped a {} byte packet on {}".format(size, topic))
+
+    def _keepalive(self):
+        if not self.keepalive:
+            return
+        now = time.ticks_ms()
+        if self._ping_out:
+            if now - self.last_pingreq >= self.ping_timeout:
+                raise OSError(-2)
+        elif now - self.last_tx >= self.keepalive * 1000:
+            # Only ping when nothing else went out during the interval
+            self.ping()
 
     def publish(self, topic, msg, retain=False, qos=0):
+        t = trace.begin()
         topic = topic.encode('utf-8')
         payload = msg.encode('utf-8')
 
-        header = 0x30 | (False << 3) | (qos << 1) | retain
         pkt_len = (2 + len(topic) +
                     (2 if qos else 0) +
                     (len(payload)))
 
-        pkt = bytearray([header])
-        pkt.extend(self._encode_varlen_length(pkt_len)) # len of the remaining
-        pkt.extend(self._pascal_string(topic))
+        # Build the packet in the buffer allocated at construction time
+        pkt = self._pkt
+        if pkt_len + 5 > len(pkt):
+            pkt = bytearray(pkt_len + 5)
+        pkt[0] = 0x30 | (False << 3) | (qos << 1) | retain
+        n = 1
+        length = pkt_len # len of the remaining
+        while length > 0x7f:
+            pkt[n] = (length & 0x7f) | 0x80
+            length >>= 7
+            n += 1
+        pkt[n] = length
+        struct.pack_into("!H", pkt, n + 1, len(topic))
+        n += 3
+        pkt[n:n + len(topic)] = topic
+        n += len(topic)
         if qos:
-            self.pid += 1
-            pkt.extend(self._encode_16(self.pid))
+            pid = self._next_pid()
+            struct.pack_into("!H", pkt, n, pid)
+            n += 2
+        pkt[n:n + len(payload)] = payload
+        n += len(payload)
 
-        pkt = pkt + payload
-        written = self.sock.write(pkt)
-        if(written is None or written != len(pkt)):
+        written = self._write(memoryview(pkt)[:n])
+        if(written is None or written != n):
             print("Socket error")
         if qos == 1:
-            while 1:
-                op = self.wait_msg()
-                if op == 0x40:
-                    sz = self.sock.read(1)
-                    assert sz == b"\x02"
-                    rcv_pid = self.sock.read(2)
-                    rcv_pid = rcv_pid[0] << 8 | rcv_pid[1]
-                    if pid == rcv_pid:
-                        return
+            start = time.ticks_ms()
+            while self._puback != pid:
+                self._wait_ack(start)
         elif qos == 2:
             assert 0
+        trace.end(t, 'mqtt.publish')
+
+    def _next_pid(self):
+        # Packet ids are 16 bits and 0 is not a valid one
+        self.pid = self.pid % 0xffff + 1
+        return self.pid
 
     def subscribe(self, topic, qos=0):
         assert self.cb is not None, "Subscribe callback is not set"
         pkt = bytearray(b"\x82\0\0\0")
-        self.pid += 1
-        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, self.pid)
+        pid = self._next_pid()
+        struct.pack_into("!BH", pkt, 1, 2 + 2 + len(topic) + 1, pid)
         #print(hex(len(pkt)), hexlify(pkt, ":"))
-        self.sock.write(pkt)
+        self._write(pkt)
         self._send_str(topic)
-        self.sock.write(qos.to_bytes(1, "little"))
-        while 1:
-            op = self.wait_msg()
-            if op == 0x90:
-                resp = self.sock.read(4)
-                #print(resp)
-                assert resp[1] == pkt[2] and resp[2] == pkt[3]
-                if resp[3] == 0x80:
-                    raise MQTTException(resp[3])
-                return
+        self._write(qos.to_bytes(1, "little"))
+        start = time.ticks_ms()
+        while self._suback != pid:
+            self._wait_ack(start)
+        if self._suback_rc == 0x80:
+            raise MQTTException(self._suback_rc)
 
-    def wait_msg(self):
-        res = self.sock.read(1)
-        self.sock.setblocking(True)
-        if res is None:
-            return None
-        if res == b"":
+    def _fill(self, timeout):
+        # One readinto per poll, straight into the free tail of the buffer
+        if not self._poll.poll(timeout):
+            return 0
+        if self._rpos == self._wpos:
+            self._rpos = 0
+            self._wpos = 0
+        elif self._wpos == self.RBUF_SIZE:
+            n = self._wpos - self._rpos
+            self._rbuf[:n] = bytes(self._rmv[self._rpos:self._wpos])
+            self._rpos = 0
+            self._wpos = n
+        n = self.sock.readinto(self._rmv[self._wpos:])
+        if n is None:
+            # Readable, but no whole TLS record or a spurious wakeup
+            return 0
+        if not n:
             raise OSError(-1)
-        if res == b"\xd0":  # PINGRESP
-            sz = self.sock.read(1)[0]
-            assert sz == 0
-            self.last_pingresp = time.ticks_ms()
+        self._wpos += n
+        return n
+
+    def _parse(self):
+        buf = self._rbuf
+        if self._skip:
+            n = min(self._skip, self._wpos - self._rpos)
+            self._skip -= n
+            self._rpos += n
+        pos = self._rpos
+        if self._wpos - pos < 2:
             return None
-        op = res[0]
-        if op & 0xf0 != 0x30:
-            return op
-        sz = self._recv_len()
-        topic_len = self.sock.read(2)
-        topic_len = (topic_len[0] << 8) | topic_len[1]
-        topic = self.sock.read(topic_len)
-        sz -= topic_len + 2
-        if op & 6:
-            pid = self.sock.read(2)
-            pid = pid[0] << 8 | pid[1]
-            sz -= 2
-        msg = self.sock.read(sz)
-        self.cb(topic, msg)
-        if op & 6 == 2:
-            pkt = bytearray(b"\x40\x02\0\0")
-            struct.pack_into("!H", pkt, 2, pid)
-            self.sock.write(pkt)
-        elif op & 6 == 4:
-            assert 0
+        op = buf[pos]
+        sz = 0
+        sh = 0
+        i = pos + 1
+        while 1:
+            if i >= self._wpos:
+                return None
+            b = buf[i]
+            i += 1
+            sz |= (b & 0x7f) << sh
+            if not b & 0x80:
+                break
+            sh += 7
+        end = i + sz
+        if end > self._wpos:
+            if end - pos > self.RBUF_SIZE:
+                # Never fits in the buffer. A PUBLISH waits for its topic,
+                # then it is discarded as it arrives
+                topic = None
+                if op & 0xf0 == 0x30 and i + 2 <= self._wpos:
+                    topic_len = buf[i] << 8 | buf[i + 1]
+                    if i + 2 + topic_len <= self._wpos:
+                        topic = bytes(self._rmv[i + 2:i + 2 + topic_len])
+                if topic is None and op & 0xf0 == 0x30 and self._wpos - pos < self.RBUF_SIZE:
+                    return None
+                self._skip = end - self._wpos
+                self._rpos = self._wpos
+                self.dropped += 1
+                self.oversize(op, topic, sz)
+            return None
+        self._rpos = end
 
-    def check_msg(self):
-        self.sock.setblocking(False)
-        return self.wait_msg()
+        if op == 0xd0:  # PINGRESP
+            self.last_pingresp = time.ticks_ms()
+            self._ping_out = False
+            self._on_pingresp(self.last_pingresp - self.last_pingreq)
+        elif op == 0x40:  # PUBACK
+            self._puback = buf[i] << 8 | buf[i + 1]
+        elif op == 0x90:  # SUBACK
+            self._suback = buf[i] << 8 | buf[i + 1]
+            self._suback_rc = buf[i + 2]
+        elif op & 0xf0 == 0x30:  # PUBLISH
+            topic_len = buf[i] << 8 | buf[i + 1]
+            i += 2
+            msg = i + topic_len
+            if op & 6:
+                pid = buf[msg] << 8 | buf[msg + 1]
+                msg += 2
+            if self.cb is not None:
+                self.cb(bytes(self._rmv[i:i + topic_len]), bytes(self._rmv[msg:end]))
+            if op & 6 == 2:
+                pkt = bytearray(b"\x40\x02\0\0")
+                struct.pack_into("!H", pkt, 2, pid)
+                self._write(pkt)
+            elif op & 6 == 4:
+                assert 0
+        return op
 
-    def _encode_16(self, x):
-        return struct.pack("!H", x)
+    def _wait_ack(self, start):
+        # Like wait_msg, but a half-open connection raises instead of
+        # blocking forever, so MQTTClient reconnects
+        if self._parse() is not None:
+            return
+        left = (self.ping_timeout or self.ACK_TIMEOUT) - (time.ticks_ms() - start)
+        if left <= 0:
+            raise OSError(-2)
+        self._fill(left)
 
-    def _pascal_string(self, s):
-        return struct.pack("!H", len(s)) + s
+    def wait_msg(self):
+        t = trace.begin()
+        while 1:
+            op = self._parse()
+            if op is not None:
+                trace.end(t, 'mqtt.wait')
+                return op
+            self._fill(-1)
 
-    def _encode_varlen_length(self, length):
-        i = 0
-        buff = bytearray()
+    def check_msg(self):
+        self._keepalive()
+        self._fill(0)
+        op = None
         while 1:
-            buff.append(length % 128)
-            length = length // 128
-            if length > 0:
-                buff[i] = buff[i] | 0x80
-                i += 1
-            else:
-                break
-        return buff
+            res = self._parse()
+            if res is None:
+                return op
+            op = res
 
 class MQTTClient(MQTTC):
 
     DELAY = 2
     DEBUG = False
+    DOWN_TIME = 60000
+
+    def __init__(self, client_id, server, port=0, failback=300000, **kwargs):
+        # server may be a single gateway or a list of them
+        if isinstance(server, str):
+            server = [server]
+        self.servers = server
+        self.rtt = [0] * len(server)
+        self.down_until = [0] * len(server)
+        self.current = 0
+        self.failback = failback
+        self.last_switch = time.ticks_ms()
+        self._subs = []
+        super().__init__(client_id, server[0], port, **kwargs)
 
     def delay(self, i):
-        time.sleep(self.DELAY)
+        # Sliced, so the wait keeps reporting progress
+        end = time.ticks_ms() + self.DELAY * 1000
+        while time.ticks_ms() < end:
+            self.progress()
+            time.sleep_ms(100)
+
+    def progress(self):
+        # Called between connection attempts; detimotic points it at its supervisor
+        pass
 
     def log(self, in_reconnect, e):
         if self.DEBUG:
@@ -220,20 +414,80 @@ class MQTTClient(MQTTC):
             else:
                 print("mqtt: %r" % e)
 
-    def reconnect(self):
+    def _on_pingresp(self, rtt):
+        self._sample(self.current, rtt)
+
+    def _sample(self, i, rtt):
+        if self.rtt[i] == 0:
+            self.rtt[i] = max(rtt, 1)
+        else:
+            self.rtt[i] = (self.rtt[i] * 3 + rtt) // 4
+
+    def _order(self, now):
+        # Healthy gateways fastest first; unmeasured ones get probed first
+        healthy = [(self.rtt[i], i) for i in range(len(self.servers)) if now - self.down_until[i] >= 0]
+        if not healthy:
+            healthy = [(self.down_until[i], i) for i in range(len(self.servers))]
+        healthy.sort()
+        return [i for _, i in healthy]
+
+    def _connect_to(self, i, clean_session):
+        self.current = i
+        self.server = self.servers[i]
+        self.addr = self.resolve()
+        start = time.ticks_ms()
+        present = super().connect(clean_session)
+        self._sample(i, time.ticks_ms() - start)
+        self.last_switch = time.ticks_ms()
+        if not present:
+            for topic, qos in self._subs:
+                super().subscribe(topic, qos)
+        return present
+
+    def connect(self, clean_session=True):
+        for i in self._order(time.ticks_ms()):
+            self.progress()
+            try:
+                return self._connect_to(i, clean_session)
+            except OSError as e:
+                self.log(True, e)
+                self.down_until[i] = time.ticks_ms() + self.DOWN_TIME
+                self.rtt[i] = 0
+        raise OSError(-3)
+
+    def reconnect(self, planned=False):
+        # Planned reconnects (boot, the radio coming back on, failback) are not counted as failures
         i = 0
+        if not planned:
+            self.reconnects += 1
         while 1:
             try:
-                return super().connect(False)
+                return self.connect(False)
             except OSError as e:
                 self.log(True, e)
                 i += 1
+                if i % 3 == 0:
+                    # The gateways may have moved, drop the cached addresses
+                    _dns_cache.clear()
                 self.delay(i)
 
     def publish(self, topic, msg, retain=False, qos=0):
+        # One pass over the gateways, then the OSError reaches the caller,
+        # which keeps the message queued instead of waiting out the outage
+        try:
+            return super().publish(topic, msg, retain, qos)
+        except OSError as e:
+            self.log(False, e)
+        self.reconnects += 1
+        self.connect(False)
+        return super().publish(topic, msg, retain, qos)
+
+    def subscribe(self, topic, qos=0):
+        if (topic, qos) not in self._subs:
+            self._subs.append((topic, qos))
         while 1:
             try:
-                return super().publish(topic, msg, retain, qos)
+                return super().subscribe(topic, qos)
             except OSError as e:
                 self.log(False, e)
             self.reconnect()
@@ -245,3 +499,21 @@ class MQTTClient(MQTTC):
             except OSError as e:
                 self.log(False, e)
             self.reconnect()
+
+    def check_msg(self):
+        now = time.ticks_ms()
+        if len(self.servers) > 1 and now - self.last_switch >= self.failback:
+            self.last_switch = now
+            if self._order(now)[0] != self.current:
+                # Move back to a faster or recovered gateway, not a failure
+                try:
+                    self.disconnect()
+                except OSError:
+                    pass
+                self.reconnect(True)
+        while 1:
+            try:
+                return super().check_msg()
+            except OSError as e:
+                self.log(False, e)
+            self.reconnect()
@@ -0,0 +1,40 @@
+import time
+
+class Radio:
+    # The ESP32 has a single 2.4 GHz radio: BLE scan windows and WiFi
+    # traffic take turns on it instead of contending for airtime
+
+    def __init__(self):
+        self.scanning = False
+        self.started = 0
+        self.reset()
+
+    def reset(self):
+        self.scan_time = 0
+        self.scans = 0
+        self.deferred = 0
+
+    def begin(self):
+        if not self.scanning:
+            self.scanning = True
+            self.started = time.ticks_ms()
+
+    def end(self):
+        if self.scanning:
+            self.scanning = False
+            self.scan_time += time.ticks_ms() - self.started
+            self.scans += 1
+
+    def defer(self):
+        self.deferred += 1
+
+    def frame(self):
+        # [ms scanned, scans, publishes held back] since the last frame
+        scan_time = self.scan_time
+        if self.scanning:
+            now = time.ticks_ms()
+            scan_time += now - self.started
+            self.started = now
+        frame = [scan_time, self.scans, self.deferred]
+        self.reset()
+        return frame
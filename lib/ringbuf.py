@@ -0,0 +1,56 @@
+from array import array
+
+class Ring:
+
+    # Offsets are kept as unsigned 32-bit ms from base
+    MAX_OFFSET = 0xffffffff
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.offsets = array('L', [0] * capacity)
+        self.values = array('f', [0] * capacity)
+        self.base = None
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        if self.base is None:
+            self.base = timestamp
+        offset = timestamp - self.base
+        if offset > self.MAX_OFFSET:
+            self._rebase(offset - self.MAX_OFFSET // 2)
+            offset = timestamp - self.base
+        self.offsets[self.head] = max(offset, 0)
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def _rebase(self, shift):
+        for i in range(self.capacity):
+            self.offsets[i] = max(self.offsets[i] - shift, 0)
+        self.base += shift
+
+    def get(self, i):
+        # i = 0 is the oldest reading kept
+        j = (self.head - self.count + i) % self.capacity
+        return self.base + self.offsets[j], self.values[j]
+
+    def last(self, n):
+        n = min(n, self.count)
+        timestamps = []
+        values = []
+        for i in range(self.count - n, self.count):
+            t, v = self.get(i)
+            timestamps.append(t)
+            values.append(v)
+        return timestamps, values
+
+    def between(self, start, end):
+        for i in range(self.count):
+            t, v = self.get(i)
+            if start <= t <= end:
+                yield t, v
@@ -0,0 +1,68 @@
+# Compact encoding for a batch of readings of one metric.
+#
+# Frame layout (all integers are zigzag varints unless noted):
+#   FRAME_SERIES (1 byte) | decimals (1 byte) | count
+#   first timestamp (ms) | first value (fixed point)
+#   count - 1 times: timestamp delta | value delta
+#
+# Single readings are still sent as JSON, which always starts with '{'.
+
+FRAME_SERIES = 0x01
+
+def _zigzag(n):
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+def _unzigzag(n):
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+def _put(buf, n):
+    n = _zigzag(n)
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def _get(data, pos):
+    n = 0
+    sh = 0
+    while 1:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << sh
+        if not b & 0x80:
+            return _unzigzag(n), pos
+        sh += 7
+
+def encode(timestamps, values, decimals=2):
+    scale = 10 ** decimals
+    buf = bytearray([FRAME_SERIES, decimals])
+    _put(buf, len(values))
+    last_t = 0
+    last_v = 0
+    for i in range(len(values)):
+        t = timestamps[i]
+        v = int(round(values[i] * scale))
+        _put(buf, t - last_t)
+        _put(buf, v - last_v)
+        last_t = t
+        last_v = v
+    return bytes(buf)
+
+def decode(data):
+    if data[0] != FRAME_SERIES:
+        raise ValueError("Not a series frame")
+    decimals = data[1]
+    scale = 10 ** decimals
+    count, pos = _get(data, 2)
+    timestamps = []
+    values = []
+    t = 0
+    v = 0
+    for i in range(count):
+        dt, pos = _get(data, pos)
+        dv, pos = _get(data, pos)
+        t += dt
+        v += dv
+        timestamps.append(t)
+        values.append(v / scale if decimals else v)
+    return timestamps, values, decimals
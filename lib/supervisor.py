@@ -0,0 +1,101 @@
+import time
+
+class Budget:
+    # Loop time budget of one module. Repeated overruns mark it degraded and
+    # stretch its interval; clean runs shrink the stretch back
+
+    def __init__(self, budget, strikes=3, recover=5, max_stretch=8):
+        self.budget = budget
+        self.strikes = strikes
+        self.recover = recover
+        self.max_stretch = max_stretch
+        self.stretch = 1
+        self.degraded = False
+        self.late = 0
+        self.clean = 0
+        self.overruns = 0
+
+    def add(self, duration):
+        # Returns True when the module's state changed
+        if duration > self.budget:
+            self.overruns += 1
+            self.late += 1
+            self.clean = 0
+            if self.late >= self.strikes and self.stretch < self.max_stretch:
+                self.late = 0
+                self.stretch = min(self.stretch * 2, self.max_stretch)
+                self.degraded = True
+                return True
+            return False
+        self.late = 0
+        self.clean += 1
+        if self.degraded and self.clean >= self.recover:
+            self.clean = 0
+            self.stretch //= 2
+            if self.stretch <= 1:
+                self.stretch = 1
+                self.degraded = False
+            return True
+        return False
+
+    def frame(self):
+        # [overruns since the last frame, budget ms, stretch, degraded]
+        frame = [self.overruns, self.budget, self.stretch, 1 if self.degraded else 0]
+        self.overruns = 0
+        return frame
+
+class Supervisor:
+    # Feeds the watchdog on scheduler progress. Every finished main loop pass
+    # feeds it; long blocking work (reconnects, WiFi joins) reports progress
+    # in between, which only counts while a pass finished within `stall` ms,
+    # so a node stuck in one of them still gets reset eventually
+
+    def __init__(self, stall=300000, strikes=3, recover=5, max_stretch=8):
+        self.stall = stall
+        self.strikes = strikes
+        self.recover = recover
+        self.max_stretch = max_stretch
+        self.watchdog = None
+        self.budgets = {}
+        self.last_tick = time.ticks_ms()
+        self.last_feed = self.last_tick
+        self.gap_max = 0
+
+    def watch(self, watchdog):
+        self.watchdog = watchdog
+        self.tick()
+
+    def budget(self, name, budget):
+        b = self.budgets.get(name)
+        if b is None:
+            b = Budget(budget, self.strikes, self.recover, self.max_stretch)
+            self.budgets[name] = b
+        b.budget = budget
+        return b
+
+    def tick(self):
+        # A full scheduler pass
+        self.last_tick = time.ticks_ms()
+        self._feed(self.last_tick)
+
+    def progress(self):
+        now = time.ticks_ms()
+        if now - self.last_tick < self.stall:
+            self._feed(now)
+
+    def _feed(self, now):
+        if self.watchdog is None:
+            return
+        gap = now - self.last_feed
+        if gap > self.gap_max:
+            self.gap_max = gap
+        self.last_feed = now
+        self.watchdog.feed()
+
+    def frame(self):
+        mod = {}
+        for name in self.budgets:
+            mod[name] = self.budgets[name].frame()
+        frame = {"wdt": self.gap_max, "sup": mod}
+        self.gap_max = 0
+        return frame
@@ -0,0 +1,112 @@
+# Span tracing into a fixed-size ring, exported as Chrome trace events.
+#
+#     t = trace.begin()
+#     ...
+#     trace.end(t, 'encrypt')
+#
+# begin() returns 0 while tracing is off and end() drops it, so an
+# instrumented call costs two function calls when disabled. Events are kept
+# in preallocated arrays; names are interned once, so recording a span does
+# not allocate. The export is the JSON array form of the trace-event format,
+# which chrome://tracing and Perfetto open directly.
+
+import time
+from array import array
+
+try:
+    from _thread import get_ident
+except ImportError:
+    def get_ident():
+        return 0
+
+enabled = False
+
+_size = 0
+_head = 0
+_count = 0
+_names = []
+_ids = {}
+_name = None
+_start = None
+_dur = None
+_tid = None
+
+def enable(size=256):
+    global enabled, _size, _name, _start, _dur, _tid
+    # An empty ring would make every end() fail, on any thread
+    if type(size) is not int or size < 1:
+        raise ValueError('trace size must be a positive int')
+    if size != _size:
+        _size = size
+        _name = array('H', [0] * size)
+        _start = array('L', [0] * size)
+        _dur = array('L', [0] * size)
+        _tid = array('L', [0] * size)
+    clear()
+    enabled = True
+
+def disable():
+    # Recorded events stay available for export
+    global enabled
+    enabled = False
+
+def clear():
+    global _head, _count
+    _head = 0
+    _count = 0
+
+def begin():
+    if not enabled:
+        return 0
+    return time.ticks_us()
+
+def end(start, name):
+    global _head, _count
+    if not start or not enabled:
+        return
+    dur = time.ticks_diff(time.ticks_us(), start)
+    id = _ids.get(name)
+    if id is None:
+        id = len(_names)
+        _names.append(name)
+        _ids[name] = id
+    i = _head
+    _name[i] = id
+    _start[i] = start & 0xffffffff
+    _dur[i] = dur
+    _tid[i] = get_ident() & 0xffffffff
+    _head = (i + 1) % _size
+    if _count < _size:
+        _count += 1
+
+def count():
+    return _count
+
+def events(pid=0):
+    # Oldest first, one trace-event JSON object per span
+    for k in range(_count):
+        i = (_head - _count + k) % _size
+        yield '{{"name":"{}","ph":"X","ts":{},"dur":{},"pid":{},"tid":{}}}'.format(
+                _names[_name[i]], _start[i], _dur[i], pid, _tid[i])
+
+def chunks(n=32, pid=0):
+    # Independent JSON arrays of at most n events, small enough for one MQTT message each
+    chunk = []
+    for event in events(pid):
+        chunk.append(event)
+        if len(chunk) >= n:
+            yield '[' + ','.join(chunk) + ']'
+            chunk = []
+    if chunk:
+        yield '[' + ','.join(chunk) + ']'
+
+def dump(write, pid=0):
+    # Streams the whole ring to write(), e.g. sys.stdout.write or a file's write
+    write('[')
+    first = True
+    for event in events(pid):
+        if not first:
+            write(',\n')
+        write(event)
+        first = False
+    write(']\n')
@@ -1,5 +1,6 @@
 import utime
 from machine import I2C
+from lib import trace
 
 # Default I2C address that is used
 TSL2561_I2C_ADDR_DEFAULT = 0x39
@@ -21,13 +22,24 @@ TSL2561_INTEGRATION_TIME_13_7 = 0
 TSL2561_INTEGRATION_TIME_101 = 1
 """Integration time of 101 ms"""
 
-TSL2561_INTEGRATION_TIME_402 = 0
+TSL2561_INTEGRATION_TIME_402 = 2
 """Integration time of 402 ms"""
 
 # Constants for the available gain stages
 TSL2561_GAIN_1X = 0
 TSL2561_GAIN_16X = 1<<4
 
+# Auto-ranging, indexed by integration time: relative sensitivity (the
+# datasheet's 11/81/322 oscillator periods), clip threshold, and the counts
+# kept free below it for a rising trend the prediction missed
+TSL2561_WEIGHT = (11, 81, 322)
+TSL2561_CLIP = (4900, 37000, 65000)
+TSL2561_HEADROOM = (1200, 9000, 16000)
+
+# Broadband counts below which a reading is too coarse and a longer
+# integration or higher gain is preferred
+TSL2561_MIN_COUNTS = 100
+
 # Constants used for the optimzed calculation of the luminosity in Lux
 # See datasheet for details
 TSL2561_LUX_K1T = (0x0040)
@@ -63,10 +75,14 @@ class device:
         self.i2cAddr = i2cAddr
         self.i2c = I2C(0, I2C.MASTER)
         self.debugOutput = debug
-        self.integrationTime = TSL2561_INTEGRATION_TIME_402
+        self.integrationTime = integrationTime
         self.gain = TSL2561_GAIN_16X
         self.ready = False
         self.error = False
+        self.minCounts = TSL2561_MIN_COUNTS
+        # Light level (counts at unit sensitivity << 10) of the last reading
+        self.light = None
+        self.nextRange = None
 
     def init(self):
         tslReg = None
@@ -121,7 +137,48 @@ class device:
 
     def setIntegrationTime(self, integrationTime):
         self.integrationTime = integrationTime
-        applyTiming(self)
+        self.applyTiming()
+
+    def setRange(self, integrationTime, gain):
+        # Only touches the sensor when the range actually changes
+        if integrationTime != self.integrationTime or gain != self.gain:
+            self.integrationTime = integrationTime
+            self.gain = gain
+            self.applyTiming()
+
+    def sensitivity(self, integrationTime, gain):
+        if gain == TSL2561_GAIN_16X:
+            return TSL2561_WEIGHT[integrationTime] * 16
+        return TSL2561_WEIGHT[integrationTime]
+
+    def predictRange(self, lumB):
+        # Picks the range for the next read from this reading and its trend:
+        # the shortest integration whose counts stay clear of clipping at the
+        # brighter estimate and reach minCounts at the darker one
+        light = (lumB << 10) // self.sensitivity(self.integrationTime, self.gain)
+        prev = light if self.light is None else self.light
+        self.light = light
+        ahead = light + (light - prev)
+        low = min(light, ahead)
+        high = max(light, ahead)
+
+        best = None
+        for integrationTime in (TSL2561_INTEGRATION_TIME_13_7, TSL2561_INTEGRATION_TIME_101,
+                TSL2561_INTEGRATION_TIME_402):
+            limit = TSL2561_CLIP[integrationTime] - TSL2561_HEADROOM[integrationTime]
+            for gain in (TSL2561_GAIN_16X, TSL2561_GAIN_1X):
+                sensitivity = self.sensitivity(integrationTime, gain)
+                if (high * sensitivity) >> 10 > limit:
+                    continue
+                if (low * sensitivity) >> 10 >= self.minCounts:
+                    return integrationTime, gain
+                # Too dark for this integration time, remember the most sensitive fit
+                if best is None or sensitivity > self.sensitivity(best[0], best[1]):
+                    best = (integrationTime, gain)
+                break
+        if best is None:
+            return TSL2561_INTEGRATION_TIME_13_7, TSL2561_GAIN_1X
+        return best
 
     def getSensorDataRaw(self):
         lumB = 0
@@ -133,13 +190,16 @@ class device:
 
         self.enable()
 
+        t = trace.begin()
         if self.integrationTime == TSL2561_INTEGRATION_TIME_13_7:
             utime.sleep_ms(15)
         elif self.integrationTime == TSL2561_INTEGRATION_TIME_101:
             utime.sleep_ms(120)
         else:
             utime.sleep_ms(450)
+        trace.end(t, 'tsl2561.integrate')
 
+        t = trace.begin()
         tslReg = None;
         try:
             tslReg = self.i2c.readfrom_mem(self.i2cAddr,
@@ -159,44 +219,28 @@ class device:
             self.error = True
         if tslReg is not None:
             lumIR = (tslReg[1]<<8) + tslReg[0]
+        trace.end(t, 'i2c')
 
         self.disable()
 
         return {'lumB': lumB, 'lumIR': lumIR}
 
     def getSensorDataAGC(self):
-        agcDone = False
-        done = False
+        # One integration at the predicted range; only a clipped reading is
+        # read again, at the least sensitive range
+        if self.nextRange is not None:
+            self.setRange(self.nextRange[0], self.nextRange[1])
+        lum = self.getSensorDataRaw()
+        if lum is None:
+            return None
 
-        while not done:
+        clip = TSL2561_CLIP[self.integrationTime]
+        if lum['lumB'] >= clip or lum['lumIR'] >= clip:
+            self.light = None
+            self.setRange(TSL2561_INTEGRATION_TIME_13_7, TSL2561_GAIN_1X)
             lum = self.getSensorDataRaw()
-            if lum is None:
-                return None
-
-            if self.integrationTime == TSL2561_INTEGRATION_TIME_13_7:
-                thLow = 100
-                thHigh = 4850
-            elif self.integrationTime == TSL2561_INTEGRATION_TIME_101:
-                thLow = 200
-                thHigh = 36000
-            else:
-                thLow = 500
-                thHigh = 63000
-
-            if not agcDone:
-                if lum['lumB'] < thLow and self.gain == TSL2561_GAIN_1X:
-                    self.gain = TSL2561_GAIN_16X
-                    self.applyTiming()
-                    agcDone = True
-                elif lum['lumB'] > thHigh and self.gain == TSL2561_GAIN_16X:
-                    self.gain = TSL2561_GAIN_1X
-                    self.applyTiming()
-                    agcDone = True
-                else:
-                    agcDone = True
-                    done = True
-            else:
-                done = True
+        self.nextRange = self.predictRange(lum['lumB'])
+
         if self.debugOutput == True:
             print('Final Broadband: ' + str(lum['lumB']))
             print('Final IR: ' + str(lum['lumIR']))
@@ -0,0 +1,111 @@
+import time
+import _thread
+from lib import trace
+
+class Worker:
+    # A single background thread for blocking sensor reads. Jobs run one at
+    # a time, so sensors sharing a bus never overlap. Results wait in a
+    # bounded queue until the main loop drains them; publishing, MQTT and
+    # encryption stay on the main thread
+
+    def __init__(self, size=4, stack=8192):
+        self.size = size
+        self._lock = _thread.allocate_lock()
+        # Held while the thread has nothing to do, released to wake it
+        self._wake = _thread.allocate_lock()
+        self._wake.acquire()
+        self._jobs = []
+        self._results = []
+        # Owners with a job queued, running or waiting to be drained
+        self._owners = []
+        self.reset()
+        try:
+            _thread.stack_size(stack)
+        except ValueError:
+            # CPython wants at least 32 kB, the host simulator keeps its default
+            pass
+        _thread.start_new_thread(self._run, ())
+
+    def reset(self):
+        self.jobs = 0
+        self.busy = 0
+        self.full = 0
+        self.errors = 0
+        self.job_max = 0
+
+    def submit(self, owner, f, args, done):
+        # One job in flight per owner; a full queue pushes back on the caller
+        if owner in self._owners:
+            self.busy += 1
+            return False
+        if len(self._owners) >= self.size:
+            self.full += 1
+            return False
+        self._owners.append(owner)
+        with self._lock:
+            self._jobs.append((owner, f, args, done))
+        if self._wake.locked():
+            self._wake.release()
+        return True
+
+    def cancel(self, owner):
+        # A job already running still finishes, its result is dropped
+        if owner not in self._owners:
+            return
+        self._owners.remove(owner)
+        with self._lock:
+            for job in self._jobs:
+                if job[0] is owner:
+                    self._jobs.remove(job)
+                    break
+
+    def pending(self):
+        return len(self._owners)
+
+    def drain(self):
+        # Runs done(result, error, ms the job took) on the calling thread, in
+        # completion order
+        if not self._results:
+            return
+        with self._lock:
+            results = self._results
+            self._results = []
+        for owner, done, result, error, elapsed in results:
+            if owner not in self._owners:
+                continue
+            self._owners.remove(owner)
+            if error is not None:
+                self.errors += 1
+                print("ERROR in background job: " + repr(error))
+            done(result, error, elapsed)
+
+    def frame(self):
+        # [jobs run, rejected while busy, rejected when full, errors, slowest job ms]
+        with self._lock:
+            frame = [self.jobs, self.busy, self.full, self.errors, self.job_max]
+            self.reset()
+        return frame
+
+    def _run(self):
+        while True:
+            self._wake.acquire()
+            while self._jobs:
+                with self._lock:
+                    if not self._jobs:
+                        break
+                    owner, f, args, done = self._jobs.pop(0)
+                t = trace.begin()
+                start = time.ticks_ms()
+                result = None
+                error = None
+                try:
+                    result = f(*args)
+                except Exception as e:
+                    error = e
+                elapsed = time.ticks_ms() - start
+                trace.end(t, 'job')
+                with self._lock:
+                    self._results.append((owner, done, result, error, elapsed))
+                    self.jobs += 1
+                    if elapsed > self.job_max:
+                        self.job_max = elapsed
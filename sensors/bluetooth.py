@@ -1,19 +1,35 @@
-from network import Bluetooth
-
 bt = None
 
 def setup(dm):
     global bt
 
+    from network import Bluetooth
     bt = Bluetooth()
-    bt.start_scan(-1)
+
+def prepare(dm):
+    # Opens the scan window ahead of the next loop
+    if not bt.isscanning():
+        bt.start_scan(-1)
+        dm.scanning(True)
+
+def stop(dm):
+    # A window left open would hold WiFi traffic back for good
+    if bt.isscanning():
+        bt.stop_scan()
+        dm.scanning(False)
 
 def loop(dm):
-    macs = []
-    advs = bt.get_advertisements()
-    for adv in advs:
-        macs.append(adv.mac)
-    value = len(set(macs))
+    if not bt.isscanning():
+        # No window was opened for this run, scan until the next one
+        prepare(dm)
+        return
+    # The advertisement table is only read while a window is open
+    macs = set()
+    for adv in bt.get_advertisements():
+        macs.add(adv.mac)
+    bt.stop_scan()
+    dm.scanning(False)
+    value = len(macs)
 
     print("Number of BLE devices currently advertising: " + str(value))
     dm.publish("device_num", value)
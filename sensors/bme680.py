@@ -1,4 +1,3 @@
-import lib.bme680_driver as bme680
 import time
 
 sensor = None
@@ -14,6 +13,7 @@ hum_weighting = 0.25
 def setup(dm):
     global sensor
 
+    import lib.bme680_driver as bme680
     i2c_dev = bme680.I2CAdapter()
     sensor = bme680.BME680(i2c_device=i2c_dev)
     sensor.set_humidity_oversample(2)
@@ -23,23 +23,40 @@ def setup(dm):
 
 
 def loop(dm):
-    if sensor.get_sensor_data():
-        iaq = get_iaq(sensor.data.humidity, sensor.data.gas_resistance)
+    # Polling for the gas measurement runs on the worker thread; sensor.data
+    # is only read once it has finished
+    dm.submit(sensor.get_sensor_data, (), done)
 
-        print("{} C, {} hPa, {} RH, {} RES,".format(
-                sensor.data.temperature,
-                sensor.data.pressure,
-                sensor.data.humidity,
-                sensor.data.gas_resistance))
+def done(dm, ready):
+    if ready:
+        temperature, pressure, humidity, gas_resistance = sensor.data
+        iaq = get_iaq(humidity, gas_resistance)
 
-        dm.publish("temp", sensor.data.temperature)
-        dm.publish("hum", sensor.data.humidity)
-        dm.publish("pres", sensor.data.pressure)
+        print("{} C, {} hPa, {} RH, {} RES,".format(temperature, pressure, humidity, gas_resistance))
+
+        dm.publish("temp", temperature)
+        dm.publish("hum", humidity)
+        dm.publish("pres", pressure)
 
         if iaq is not None:
             print("{} IAQ".format(iaq))
             dm.publish("iaq", iaq)
 
+def save(dm):
+    burned = None
+    if start_time is not None:
+        burned = time.ticks_ms() - start_time
+    return {'burned': burned, 'data': burn_in_data, 'len': burn_in_len, 'baseline': gas_baseline}
+
+def restore(dm, data, slept):
+    global start_time, gas_baseline, burn_in_data, burn_in_len
+
+    if data['burned'] is not None:
+        start_time = time.ticks_ms() - data['burned'] - slept
+    burn_in_data = data['data']
+    burn_in_len = data['len']
+    gas_baseline = data['baseline']
+
 def get_iaq(hum, hres):
     global start_time, gas_baseline, burn_in_data, burn_in_len
 
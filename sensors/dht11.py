@@ -0,0 +1,23 @@
+th = None
+last = None
+
+def setup(dm):
+    global th
+
+    from lib.dht11_driver import DTH
+    th = DTH('P8', DTH.DHT11)
+
+def loop(dm):
+    global last
+
+    result = th.read()
+    # Only publish fresh readings, not the cached one between conversions
+    if result.is_valid() and result.ticks != last:
+        last = result.ticks
+        print("Temperature: {} C, humidity: {} %".format(result.temperature, result.humidity))
+        dm.publish("temp", result.temperature)
+        dm.publish("hum", result.humidity)
+    elif th.error or not result.is_valid():
+        # A failed or not yet possible conversion is measured again as soon
+        # as the sensor allows, not a whole wait_time later
+        dm.retry(th.ready())
@@ -1,14 +1,16 @@
-from lib.tsl2561_driver import *
-
 lux_sensor = None
 
 def setup(dm):
     global lux_sensor
 
+    from lib.tsl2561_driver import device
     lux_sensor = device()
     lux_sensor.init()
 
 def loop(dm):
-    value = lux_sensor.getLux()
+    # The integration wait runs on the worker thread
+    dm.submit(lux_sensor.getLux, (), done)
+
+def done(dm, value):
     print("Lux value: " + str(value))
     dm.publish("lux", value)
@@ -0,0 +1,236 @@
+"""Minimal MQTT 3.1.1 broker stand-in for the fleet simulator.
+
+Speaks the subset lib/mqtt.py uses: CONNECT with persistent sessions,
+SUBSCRIBE, QoS 0/1 PUBLISH, PINGREQ and DISCONNECT. Nothing is routed
+between clients; every PUBLISH is recorded with its virtual arrival time so
+the runner can work out throughput and latency afterwards. The runner can
+send to subscribed clients itself with ``send``. QoS 1 messages for a
+persistent session are queued while its client is away and delivered, with
+any unacknowledged ones, when it reconnects.
+
+With ``tls`` it listens with a throwaway self-signed certificate and counts
+how many handshakes resumed a saved TLS session.
+"""
+import asyncio
+import datetime
+import os
+import ssl
+import struct
+import tempfile
+
+
+class Broker:
+
+    def __init__(self, clock, host='127.0.0.1', port=1883, persist=False, tls=False):
+        self.clock = clock
+        self.host = host
+        self.port = port
+        # Keep persistent sessions across restarts, like a broker with a store
+        self.persist = persist
+        self.tls = tls
+        # Kept across restarts, so session tickets stay valid
+        self.context = None
+        self.handshakes = 0
+        self.resumed = 0
+        self.server = None
+        # client id -> {topic: granted QoS}
+        self.sessions = {}
+        # client id -> [(topic, payload)] waiting for the client to connect
+        self.queued = {}
+        # client id -> {pid: (topic, payload)} sent at QoS 1, not yet acked
+        self.inflight = {}
+        self.pid = 0
+        self.clients = {}
+        self.writers = set()
+        # (virtual ms, client id, session present)
+        self.connects = []
+        # (virtual ms, topic, payload)
+        self.messages = []
+        self.bytes_in = 0
+        self.pings = 0
+        # (virtual ms down, virtual ms up)
+        self.restarts = []
+
+    async def start(self):
+        if self.tls and self.context is None:
+            self.context = self._tls_context()
+        self.server = await asyncio.start_server(self._serve, self.host, self.port, backlog=4096,
+                ssl=self.context)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        try:
+            await asyncio.wait_for(self.server.wait_closed(), 5)
+        except asyncio.TimeoutError:
+            pass
+        self.clients.clear()
+        if not self.persist:
+            self.sessions.clear()
+            self.queued.clear()
+            self.inflight.clear()
+
+    async def restart(self, downtime):
+        """Drops every client at once and refuses connections for ``downtime`` ms."""
+        down = self.clock.ticks_ms()
+        await self.stop()
+        await asyncio.sleep(self.clock.wall(downtime))
+        await self.start()
+        self.restarts.append((down, self.clock.ticks_ms()))
+
+    async def _read(self, reader):
+        head = await reader.readexactly(1)
+        size = 0
+        shift = 0
+        while 1:
+            b = (await reader.readexactly(1))[0]
+            size |= (b & 0x7f) << shift
+            if not b & 0x80:
+                break
+            shift += 7
+        body = await reader.readexactly(size) if size else b''
+        self.bytes_in += 2 + size
+        return head[0], body
+
+    async def _serve(self, reader, writer):
+        self.writers.add(writer)
+        client_id = None
+        tls = writer.get_extra_info('ssl_object')
+        if tls is not None:
+            self.handshakes += 1
+            if tls.session_reused:
+                self.resumed += 1
+        try:
+            while 1:
+                op, body = await self._read(reader)
+                kind = op & 0xf0
+                if kind == 0x10:
+                    client_id = self._connect(body, writer)
+                elif kind == 0x30:
+                    self._publish(op, body, writer)
+                elif kind == 0x40:
+                    self.inflight.get(client_id, {}).pop(struct.unpack_from("!H", body)[0], None)
+                elif kind == 0x80:
+                    self._subscribe(client_id, body, writer)
+                elif kind == 0xc0:
+                    self.pings += 1
+                    writer.write(b"\xd0\0")
+                elif kind == 0xe0:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError, asyncio.CancelledError):
+            # Cancelled by stop(); ending quietly keeps asyncio from logging it
+            pass
+        finally:
+            self.writers.discard(writer)
+            if client_id is not None and self.clients.get(client_id) is writer:
+                del self.clients[client_id]
+            writer.close()
+
+    def _tls_context(self):
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.x509.oid import NameOID
+
+        key = ec.generate_private_key(ec.SECP256R1())
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, self.host)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+                .public_key(key.public_key()).serial_number(x509.random_serial_number())
+                .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+                .sign(key, hashes.SHA256()))
+        path = os.path.join(tempfile.mkdtemp(prefix='broker-'), 'broker.pem')
+        with open(path, 'wb') as f:
+            f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption()))
+            f.write(cert.public_bytes(serialization.Encoding.PEM))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(path)
+        return context
+
+    def _connect(self, body, writer):
+        n = struct.unpack_from("!H", body)[0]
+        flags = body[2 + n + 1]
+        pos = 2 + n + 4
+        n = struct.unpack_from("!H", body, pos)[0]
+        client_id = body[pos + 2:pos + 2 + n].decode('utf-8')
+        clean = flags & 0x02
+        if clean:
+            self.sessions.pop(client_id, None)
+            self.queued.pop(client_id, None)
+            self.inflight.pop(client_id, None)
+        present = client_id in self.sessions
+        self.sessions.setdefault(client_id, {})
+        # A second connection with the same id takes over the session
+        old = self.clients.get(client_id)
+        if old is not None:
+            old.close()
+        self.clients[client_id] = writer
+        self.connects.append((self.clock.ticks_ms(), client_id, present))
+        writer.write(bytes((0x20, 0x02, 1 if present else 0, 0)))
+        # Unacknowledged messages go again first, then what queued meanwhile
+        resend = list(self.inflight.pop(client_id, {}).values()) + self.queued.pop(client_id, [])
+        for topic, payload in resend:
+            self._deliver(client_id, writer, topic, payload, 1)
+        return client_id
+
+    def send(self, client_id, topic, payload):
+        """PUBLISH to a client subscribed to ``topic``, at the granted QoS.
+
+        Returns 'sent', 'queued' for a QoS 1 subscriber that is away, or
+        None when nothing subscribed or a QoS 0 subscriber is away.
+        """
+        subs = self.sessions.get(client_id, {})
+        if topic not in subs:
+            return None
+        writer = self.clients.get(client_id)
+        if writer is None:
+            if not subs[topic]:
+                return None
+            self.queued.setdefault(client_id, []).append((topic, payload))
+            return 'queued'
+        self._deliver(client_id, writer, topic, payload, subs[topic])
+        return 'sent'
+
+    def _deliver(self, client_id, writer, topic, payload, qos):
+        name = topic.encode('utf-8')
+        body = struct.pack("!H", len(name)) + name
+        if qos:
+            self.pid = self.pid % 0xffff + 1
+            self.inflight.setdefault(client_id, {})[self.pid] = (topic, payload)
+            body += struct.pack("!H", self.pid)
+        body += payload
+        size = len(body)
+        head = bytearray((0x32 if qos else 0x30,))
+        while 1:
+            b = size & 0x7f
+            size >>= 7
+            head.append(b | 0x80 if size else b)
+            if not size:
+                break
+        writer.write(bytes(head) + body)
+
+    def _publish(self, op, body, writer):
+        n = struct.unpack_from("!H", body)[0]
+        topic = body[2:2 + n].decode('utf-8')
+        pos = 2 + n
+        if op & 0x06:
+            pid = body[pos:pos + 2]
+            pos += 2
+            writer.write(b"\x40\x02" + pid)
+        self.messages.append((self.clock.ticks_ms(), topic, body[pos:]))
+
+    def _subscribe(self, client_id, body, writer):
+        pid = body[:2]
+        pos = 2
+        granted = bytearray()
+        while pos < len(body):
+            n = struct.unpack_from("!H", body, pos)[0]
+            topic = body[pos + 2:pos + 2 + n].decode('utf-8')
+            qos = min(body[pos + 2 + n] & 0x03, 1)
+            pos += 2 + n + 1
+            self.sessions.setdefault(client_id, {})[topic] = qos
+            granted.append(qos)
+        writer.write(bytes((0x90, 2 + len(granted))) + pid + granted)
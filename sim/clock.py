@@ -0,0 +1,99 @@
+"""Virtual time for the fleet simulator.
+
+Virtual time runs ``speed`` times faster than the host's monotonic clock, so
+every process that knows the shared ``start`` instant agrees on it without
+any coordination: the broker in the main process and the nodes in the
+worker processes timestamp on the same axis.
+"""
+import gc
+import os
+import sys
+import threading
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKES = os.path.join(REPO, 'sim', 'fakes')
+
+# Reported by the fake gc.mem_free(), roughly a WiPy after boot
+MEM_FREE = 60000
+
+_monotonic = time.monotonic
+_sleep = time.sleep
+
+# The clock of this process, set by install()
+CLOCK = None
+
+
+class Clock:
+
+    def __init__(self, speed=1.0, start=None, epoch=None, tick=10):
+        self.speed = speed
+        self.start = _monotonic() if start is None else start
+        # Virtual wall time (ms) at ticks_ms() == 0
+        self.epoch = int(time.time() * 1000) if epoch is None else epoch
+        # Virtual ms a zero-timeout poll waits, i.e. one main loop pass
+        self.tick = tick
+        # Per node thread: virtual ms at its last reset
+        self._boot = threading.local()
+
+    def ticks_ms(self):
+        return int((_monotonic() - self.start) * self.speed * 1000)
+
+    def ticks_us(self):
+        return int((_monotonic() - self.start) * self.speed * 1000000)
+
+    def reset(self):
+        """Restarts the calling thread's board ticks at zero, as a reset does."""
+        self._boot.ms = self.ticks_ms()
+
+    def board_ms(self):
+        return self.ticks_ms() - getattr(self._boot, 'ms', 0)
+
+    def board_us(self):
+        return self.ticks_us() - getattr(self._boot, 'ms', 0) * 1000
+
+    def now_ms(self):
+        return self.epoch + self.ticks_ms()
+
+    def wall(self, ms):
+        """Host seconds that ``ms`` virtual milliseconds take."""
+        return max(ms, 0) / 1000 / self.speed
+
+    def sleep(self, seconds):
+        _sleep(max(seconds, 0) / self.speed)
+
+    def args(self):
+        return (self.speed, self.start, self.epoch, self.tick)
+
+
+def install(clock):
+    """Makes this process look like a Pycom board running on ``clock``.
+
+    The MicroPython-only names the node code calls are added to the host's
+    time and gc modules, and sim/fakes is put ahead of everything else on the
+    import path so machine, network, crypto, usocket, ... resolve to fakes.
+    """
+    global CLOCK
+
+    CLOCK = clock
+    for path in (REPO, FAKES):
+        if path in sys.path:
+            sys.path.remove(path)
+    sys.path.insert(0, REPO)
+    sys.path.insert(0, FAKES)
+
+    time.ticks_ms = clock.board_ms
+    time.ticks_us = clock.board_us
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+    time.sleep = clock.sleep
+    time.sleep_ms = lambda ms: clock.sleep(ms / 1000)
+    time.sleep_us = lambda us: clock.sleep(us / 1000000)
+    time.time = lambda: clock.now_ms() / 1000
+
+    # Host memory is not what is being simulated: report a steady heap and
+    # leave CPython's collector alone
+    gc.mem_free = lambda: MEM_FREE
+    gc.mem_alloc = lambda: 0
+    gc.collect = lambda: 0
+    gc.threshold = lambda *args: None
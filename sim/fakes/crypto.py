@@ -0,0 +1,34 @@
+# AES-CFB with 8-bit segments, the mode Pycom's crypto.AES implements.
+# Requires cryptography (gateway/requirements.txt).
+import os
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+
+try:
+    from cryptography.hazmat.decrepit.ciphers.modes import CFB8
+except ImportError:
+    from cryptography.hazmat.primitives.ciphers.modes import CFB8
+
+
+def getrandbits(bits):
+    return os.urandom(bits // 8)
+
+
+class AES:
+
+    MODE_ECB = 1
+    MODE_CBC = 2
+    MODE_CFB = 3
+    MODE_CTR = 6
+
+    def __init__(self, key, mode, IV=None):
+        assert mode == AES.MODE_CFB
+        cipher = Cipher(algorithms.AES(bytes(key)), CFB8(bytes(IV)))
+        self._encryptor = cipher.encryptor()
+        self._decryptor = cipher.decryptor()
+
+    def encrypt(self, data):
+        return self._encryptor.update(data)
+
+    def decrypt(self, data):
+        return self._decryptor.update(data)
@@ -0,0 +1,248 @@
+import random
+import threading
+
+from sim import clock
+
+PWRON_RESET = 0
+HARD_RESET = 1
+WDT_RESET = 2
+DEEPSLEEP_RESET = 3
+SOFT_RESET = 4
+BROWN_OUT_RESET = 5
+
+# Per node, keyed by the node thread's name: RTC memory survives deep sleep
+_rtc_memory = {}
+_reset_cause = {}
+
+
+class DeepSleep(SystemExit):
+    """Unwinds the node thread; sim/node.py sleeps, then boots it again."""
+
+    def __init__(self, ms):
+        super().__init__('deepsleep')
+        self.ms = ms
+
+
+def idle():
+    clock.CLOCK.sleep(0.001)
+
+
+def reset_cause():
+    return _reset_cause.get(threading.current_thread().name, PWRON_RESET)
+
+
+def deepsleep(ms=0):
+    raise DeepSleep(ms)
+
+
+def reset():
+    raise SystemExit('reset')
+
+
+def unique_id():
+    return bytes(random.getrandbits(8) for i in range(6))
+
+
+class WDT:
+    """Records how close the node comes to a watchdog reset instead of resetting."""
+
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+        self.last = clock.CLOCK.ticks_ms()
+        self.max_gap = 0
+        self.expired = 0
+
+    def feed(self):
+        now = clock.CLOCK.ticks_ms()
+        gap = now - self.last
+        if gap > self.max_gap:
+            self.max_gap = gap
+        if gap > self.timeout:
+            self.expired += 1
+        self.last = now
+
+
+class RTC:
+
+    def __init__(self, id=0, **kwargs):
+        self._synced = False
+
+    def ntp_sync(self, server, update_period=3600):
+        self._synced = True
+
+    def synced(self):
+        return self._synced
+
+    def memory(self, data=None):
+        # Like the board's, it takes bytes-like data only
+        node = threading.current_thread().name
+        if data is None:
+            return _rtc_memory.get(node, b'')
+        _rtc_memory[node] = bytes(memoryview(data))
+
+
+class Pin:
+
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    def __init__(self, id, mode=IN, pull=None, value=None, **kwargs):
+        self.id = id
+        self._value = value or 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def init(self, *args, **kwargs):
+        pass
+
+
+class ADC:
+
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+
+    def __init__(self, id=0, bits=12):
+        self.bits = bits
+
+    def channel(self, pin=None, attn=ATTN_0DB, **kwargs):
+        # A noisy microphone level that occasionally gets loud
+        base = random.randint(150, 1500)
+
+        def read():
+            if random.random() < 0.002:
+                return random.randint(2600, 3900)
+            return max(0, base + random.randint(-100, 100))
+        return read
+
+    def deinit(self):
+        pass
+
+
+class _Registers:
+
+    def __init__(self, size=256):
+        self.regs = bytearray(size)
+
+    def read(self, reg, n):
+        return bytes(self.regs[reg:reg + n])
+
+    def write(self, reg, data):
+        self.regs[reg:reg + len(data)] = data
+
+
+class _TSL2561(_Registers):
+
+    def __init__(self):
+        super().__init__()
+        self.regs[0x0a] = 0x50
+        self.light = random.uniform(50, 800)
+
+    # Counts scale with the integration time, which also caps them
+    WEIGHT = (11 / 322, 81 / 322, 1.0, 0)
+    MAX_COUNT = (5047, 37177, 65535, 0)
+
+    def read(self, reg, n):
+        if reg & 0x0f in (0x0c, 0x0e):
+            if reg & 0x0f == 0x0c:
+                self.light = min(max(self.light * random.uniform(0.9, 1.1), 0.05), 40000)
+            timing = self.regs[0x01]
+            counts = self.light * 2 * self.WEIGHT[timing & 0x03] * (16 if timing & 0x10 else 1)
+            if reg & 0x0f == 0x0e:
+                counts /= 3
+            counts = min(int(counts), self.MAX_COUNT[timing & 0x03])
+            return bytes((counts & 0xff, counts >> 8))
+        return super().read(reg & 0x0f, n)
+
+    def write(self, reg, data):
+        super().write(reg & 0x0f, data)
+
+
+class _BME680(_Registers):
+
+    # Calibration words of a typical part, split as the driver reads them
+    # from 0x89 (25 bytes) and 0xe1 (16 bytes)
+    CALIBRATION = bytes.fromhex('00fe660300908d79d758005f1cb6ff271e00004cf4'
+            '24f61e003f4f31002d14789c2366afe8e2120000')
+    # Raw ADC counts for roughly room conditions with the above
+    ADC_TEMP = 488328
+    ADC_PRES = 341405
+    ADC_HUM = 21648
+
+    def __init__(self):
+        super().__init__()
+        self.regs[0x89:0x89 + 25] = self.CALIBRATION[:25]
+        self.regs[0xe1:0xe1 + 16] = self.CALIBRATION[25:]
+        self.regs[0x02] = 0x10
+        self.regs[0x00] = 40
+        self.regs[0xd0] = 0x61
+        self.temp = self.ADC_TEMP + random.randint(-20000, 20000)
+        self.hum = self.ADC_HUM + random.randint(-3000, 3000)
+        self.gas = random.randint(300, 700)
+        self._measure()
+
+    def _measure(self):
+        self.temp += random.randint(-300, 300)
+        self.hum = min(max(self.hum + random.randint(-100, 100), 0), 0xffff)
+        self.gas = min(max(self.gas + random.randint(-5, 5), 1), 0x3ff)
+        pres = self.ADC_PRES + random.randint(-50, 50)
+        field = self.regs
+        # New data, then pressure, temperature, humidity and gas readings
+        field[0x1d] = 0x80
+        field[0x1f:0x22] = bytes((pres >> 12, (pres >> 4) & 0xff, (pres & 0x0f) << 4))
+        field[0x22:0x25] = bytes((self.temp >> 12, (self.temp >> 4) & 0xff, (self.temp & 0x0f) << 4))
+        field[0x25:0x27] = bytes((self.hum >> 8, self.hum & 0xff))
+        # Gas valid, heater stable, range 4
+        field[0x2a:0x2c] = bytes((self.gas >> 2, ((self.gas & 3) << 6) | 0x30 | 4))
+
+    def read(self, reg, n):
+        if reg == 0x1d and n > 1:
+            self._measure()
+        return super().read(reg, n)
+
+    def write(self, reg, data):
+        if reg == 0xe0:
+            return
+        super().write(reg, data)
+
+
+class I2C:
+    """Answers for a TSL2561 at 0x39 and a BME680 at 0x77."""
+
+    MASTER = 0
+
+    def __init__(self, *args, **kwargs):
+        self._devices = {0x39: _TSL2561(), 0x77: _BME680()}
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def scan(self):
+        return list(self._devices)
+
+    def _device(self, addr):
+        try:
+            return self._devices[addr]
+        except KeyError:
+            raise OSError(19)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, **kwargs):
+        return self._device(addr).read(memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, **kwargs):
+        buf[:] = self._device(addr).read(memaddr, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, **kwargs):
+        if isinstance(buf, int):
+            buf = bytes((buf,))
+        self._device(addr).write(memaddr, buf)
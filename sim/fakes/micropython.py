@@ -0,0 +1,6 @@
+def const(value):
+    return value
+
+
+def mem_info(verbose=False):
+    pass
@@ -0,0 +1,113 @@
+import random
+
+from sim import clock
+
+
+class WLAN:
+
+    STA = 1
+    AP = 2
+    STA_AP = 3
+    WEP = 1
+    WPA = 2
+    WPA2 = 3
+
+    def __init__(self, mode=STA, **kwargs):
+        self._connected = False
+        self.connects = 0
+        self.scans = 0
+        # Virtual ms the radio was powered, for the simulator's report
+        self.on_ms = 0
+        self._on = None
+        self.init(mode)
+
+    def init(self, mode=STA, **kwargs):
+        self.mode = mode
+        if self._on is None:
+            self._on = clock.CLOCK.ticks_ms()
+
+    def connect(self, ssid, auth=None, bssid=None, timeout=None, **kwargs):
+        self.ssid = ssid
+        if bssid is None:
+            self.scans += 1
+        self._connected = True
+        self.connects += 1
+
+    def isconnected(self):
+        return self._connected
+
+    def disconnect(self):
+        self._connected = False
+
+    def deinit(self):
+        self._connected = False
+        if self._on is not None:
+            self.on_ms += clock.CLOCK.ticks_ms() - self._on
+            self._on = None
+
+    def radio_on(self):
+        if self._on is None:
+            return self.on_ms
+        return self.on_ms + clock.CLOCK.ticks_ms() - self._on
+
+    def ifconfig(self, *args, **kwargs):
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def joined_ap_info(self):
+        return (b'\x00\x11\x22\x33\x44\x55', self.ssid, 1, -60, WLAN.WPA2)
+
+
+class Bluetooth:
+
+    class _Adv:
+
+        def __init__(self, mac):
+            self.mac = mac
+            self.addr_type = 0
+            self.adv_type = 0
+            self.rssi = random.randint(-90, -40)
+            self.data = b''
+
+    def __init__(self, *args, **kwargs):
+        self._scanning = False
+        self._until = 0
+        self._started = 0
+        # Virtual ms spent scanning, for the simulator's coverage figure
+        self.scan_ms = 0
+
+    def start_scan(self, timeout):
+        if self.isscanning():
+            return
+        self._scanning = True
+        self._started = clock.CLOCK.ticks_ms()
+        self._until = None if timeout < 0 else self._started + timeout * 1000
+
+    def stop_scan(self):
+        if self.isscanning():
+            self._stop(clock.CLOCK.ticks_ms())
+
+    def _stop(self, now):
+        self._scanning = False
+        self.scan_ms += now - self._started
+
+    def isscanning(self):
+        if self._scanning and self._until is not None and clock.CLOCK.ticks_ms() >= self._until:
+            self._stop(self._until)
+        return self._scanning
+
+    def scanned(self):
+        if self.isscanning():
+            return self.scan_ms + clock.CLOCK.ticks_ms() - self._started
+        return self.scan_ms
+
+    def get_advertisements(self):
+        if not self.isscanning():
+            return []
+        return [Bluetooth._Adv(bytes([0, 0, 0, 0, 0, i])) for i in range(random.randint(0, 12))]
+
+    def get_adv(self):
+        advs = self.get_advertisements()
+        return advs[0] if advs else None
+
+    def deinit(self):
+        self.stop_scan()
@@ -0,0 +1,40 @@
+_nvs = {}
+
+
+def heartbeat(state=None):
+    return False
+
+
+def rgbled(color):
+    pass
+
+
+def nvs_set(key, value):
+    _nvs[key] = value
+
+
+def nvs_get(key, default=None):
+    return _nvs.get(key, default)
+
+
+def nvs_erase(key):
+    _nvs.pop(key, None)
+
+
+def nvs_erase_all():
+    _nvs.clear()
+
+
+def pulses_get(pin, timeout):
+    # A DHT11 answer for 45 %RH and 22 C, with a bad checksum now and then
+    import random
+    data = bytearray((45, 0, 22, 0, 67))
+    if random.random() < 0.02:
+        data[4] ^= 1
+    pulses = [(0, 80), (1, 80)]
+    for byte in data:
+        for i in range(7, -1, -1):
+            pulses.append((0, 50))
+            pulses.append((1, 70 if byte >> i & 1 else 26))
+    pulses.append((0, 50))
+    return pulses
@@ -0,0 +1,40 @@
+import select as _select
+
+from sim import clock
+
+POLLIN = _select.POLLIN
+POLLOUT = _select.POLLOUT
+POLLERR = _select.POLLERR
+POLLHUP = _select.POLLHUP
+
+
+class poll:
+
+    def __init__(self):
+        self._p = _select.poll()
+        self._objs = []
+
+    def register(self, obj, mask=POLLIN | POLLOUT):
+        self._p.register(obj, mask)
+        if obj not in self._objs:
+            self._objs.append(obj)
+
+    def unregister(self, obj):
+        self._p.unregister(obj)
+        self._objs.remove(obj)
+
+    def modify(self, obj, mask):
+        self._p.modify(obj, mask)
+
+    def poll(self, timeout=-1):
+        # TLS data already decrypted is readable, as MicroPython's ssl reports it
+        ready = [(obj, POLLIN) for obj in self._objs if getattr(obj, 'pending', None) and obj.pending()]
+        if ready:
+            return ready
+        # A zero timeout waits one loop tick instead, otherwise every node
+        # would spin a host core on check_msg()
+        if timeout == 0:
+            timeout = clock.CLOCK.tick
+        if timeout < 0:
+            return self._p.poll()
+        return self._p.poll(clock.CLOCK.wall(timeout) * 1000)
@@ -0,0 +1,77 @@
+# MicroPython sockets have stream methods (read, readinto, write) on top of
+# the BSD ones; wrap a host socket to match. Like MicroPython's, a blocking
+# readinto only returns once the buffer is full or the peer closed, and a
+# non-blocking one returns None when there is nothing to read.
+import socket as _socket
+
+AF_INET = _socket.AF_INET
+SOCK_STREAM = _socket.SOCK_STREAM
+IPPROTO_TCP = _socket.IPPROTO_TCP
+
+getaddrinfo = _socket.getaddrinfo
+
+
+class socket:
+
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        self._s = _socket.socket(af, type, proto)
+        self._blocking = True
+
+    def fileno(self):
+        return self._s.fileno()
+
+    def connect(self, addr):
+        self._s.connect(addr)
+
+    def settimeout(self, value):
+        self._s.settimeout(value)
+        self._blocking = value != 0
+
+    def setblocking(self, flag):
+        self._s.setblocking(flag)
+        self._blocking = flag
+
+    def close(self):
+        self._s.close()
+
+    def send(self, data):
+        return self._s.send(data)
+
+    def recv(self, n):
+        return self._s.recv(n)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self._blocking:
+            self._s.sendall(data)
+            return len(data)
+        try:
+            return self._s.send(data)
+        except BlockingIOError:
+            return None
+
+    def read(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self._s.recv(n - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def readinto(self, buf, nbytes=0):
+        size = nbytes or len(buf)
+        if not self._blocking:
+            try:
+                return self._s.recv_into(buf, size)
+            except BlockingIOError:
+                return None
+        view = memoryview(buf)
+        n = 0
+        while n < size:
+            chunk = self._s.recv_into(view[n:size])
+            if not chunk:
+                break
+            n += chunk
+        return n
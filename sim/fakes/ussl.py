@@ -0,0 +1,65 @@
+# Pycom's ussl on top of the host ssl module. The board's mbedTLS speaks
+# TLS 1.2, which also makes the session available right after the
+# handshake; save_session() and saved_session work as on Pycom firmware.
+# Certificates are not checked unless ca_certs is given, as on the board.
+import ssl as _ssl
+
+import usocket
+
+CERT_NONE = _ssl.CERT_NONE
+CERT_OPTIONAL = _ssl.CERT_OPTIONAL
+CERT_REQUIRED = _ssl.CERT_REQUIRED
+
+
+class _SSLSocket(usocket.socket):
+
+    def __init__(self, sock, blocking):
+        self._s = sock
+        self._blocking = blocking
+
+    def pending(self):
+        return self._s.pending()
+
+    def write(self, data):
+        try:
+            return super().write(data)
+        except (_ssl.SSLWantReadError, _ssl.SSLWantWriteError):
+            return None
+
+    def readinto(self, buf, nbytes=0):
+        try:
+            return super().readinto(buf, nbytes)
+        except (_ssl.SSLWantReadError, _ssl.SSLWantWriteError):
+            return None
+
+
+# A host session only resumes through the context that made it
+_contexts = {}
+
+
+def _context(keyfile, certfile, cert_reqs, ca_certs):
+    key = (keyfile, certfile, cert_reqs, ca_certs)
+    context = _contexts.get(key)
+    if context is None:
+        context = _ssl.SSLContext(_ssl.PROTOCOL_TLS_CLIENT)
+        context.maximum_version = _ssl.TLSVersion.TLSv1_2
+        context.check_hostname = False
+        context.verify_mode = cert_reqs
+        if ca_certs is not None:
+            context.load_verify_locations(ca_certs)
+        if certfile is not None:
+            context.load_cert_chain(certfile, keyfile)
+        _contexts[key] = context
+    return context
+
+
+def wrap_socket(sock, keyfile=None, certfile=None, server_side=False, cert_reqs=CERT_NONE,
+        ca_certs=None, server_hostname=None, saved_session=None, **kwargs):
+    context = _context(keyfile, certfile, cert_reqs, ca_certs)
+    wrapped = context.wrap_socket(sock._s, server_hostname=server_hostname, session=saved_session)
+    return _SSLSocket(wrapped, sock._blocking)
+
+
+def save_session(sock):
+    return sock._s.session
+
@@ -0,0 +1,33 @@
+import time as _time
+
+
+def ticks_ms():
+    return _time.ticks_ms()
+
+
+def ticks_us():
+    return _time.ticks_us()
+
+
+def ticks_diff(a, b):
+    return a - b
+
+
+def ticks_add(a, b):
+    return a + b
+
+
+def sleep(seconds):
+    _time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    _time.sleep_ms(ms)
+
+
+def sleep_us(us):
+    _time.sleep_us(us)
+
+
+def time():
+    return _time.time()
@@ -0,0 +1,420 @@
+"""Fleet load simulator: many virtual ISUs against one local broker.
+
+Every node runs the real detimotic main loop (Module, _encrypt, MQTTClient)
+on the host fakes in sim/fakes, with its own isu_id, metric uuids and keys
+generated from conf.json. Nodes run as threads spread over a process pool;
+the broker stand-in runs on asyncio in this process. All of them share one
+virtual clock, so the run can go faster than real time with --speed.
+
+Run from the repository root, with the gateway requirements installed:
+
+    python -m sim.fleet --nodes 200 --duration 300 --speed 5 --restart-at 120
+
+The report covers broker-side throughput, publish-to-broker latency of live
+readings and alerts, and, with --restart-at, how the fleet reconnects after
+every connection is dropped at once.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import random
+import string
+import uuid
+
+from sim.broker import Broker
+from sim.clock import REPO, Clock, install
+
+# Virtual ms after a restart counted as the recovery window
+RECOVERY_WINDOW = 10000
+
+
+def _key(rng):
+    return ''.join(rng.choice(string.ascii_letters + string.digits) for i in range(16))
+
+
+def make_confs(count, seed=0, scan_duty=None, alert_rate=None):
+    """Node configurations cloned from conf.json with fresh ids and keys."""
+    with open(os.path.join(REPO, 'conf.json')) as f:
+        base = json.load(f)
+    if scan_duty is not None:
+        for module in base['modules']:
+            if 'scan' in module:
+                module['scan']['duty'] = scan_duty
+    if alert_rate is not None:
+        for module in base['modules']:
+            for name in module['metrics']:
+                module.setdefault('alerts', {}).setdefault(name, {}).setdefault('rate', alert_rate)
+    rng = random.Random(seed)
+    confs = []
+    keys = {}
+    for i in range(count):
+        conf = copy.deepcopy(base)
+        conf['isu_id'] = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        for module in conf['modules']:
+            metrics = {}
+            for name in module['metrics']:
+                metric = {'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)), 'key': _key(rng)}
+                keys[metric['id']] = metric['key']
+                metrics[name] = metric
+            module['metrics'] = metrics
+        confs.append(conf)
+    return confs, keys
+
+
+def make_detimotic_conf(host, port, link=None, worker=True, deepsleep=False, tls=False):
+    with open(os.path.join(REPO, 'detimotic', 'detimotic_conf.json')) as f:
+        conf = json.load(f)
+    conf['worker']['enabled'] = worker
+    if link is not None:
+        conf['link']['mode'] = link
+    conf['gateway']['addr'] = [host]
+    conf['gateway']['port'] = port
+    conf['gateway']['ssl'] = tls
+    conf['deepsleep']['enabled'] = deepsleep
+    return conf
+
+
+def _worker(worker, clock_args, nodes, detimotic_conf, duration, options, results):
+    clock = Clock(*clock_args)
+    install(clock)
+    from sim.node import Node
+    from lib import trace
+
+    # lib is shared by the nodes of a worker, so they trace into one ring;
+    # each node is a thread and gets its own track
+    if options['trace']:
+        trace.enable(options['trace_size'])
+    fleet = [Node(index, conf, detimotic_conf, delay, options['verbose']) for index, conf, delay in nodes]
+    for node in fleet:
+        node.start()
+    clock.sleep((duration - clock.ticks_ms()) / 1000)
+    if options['trace']:
+        trace.disable()
+        root, ext = os.path.splitext(options['trace'])
+        with open('{}-{}{}'.format(root, worker, ext or '.json'), 'w') as f:
+            trace.dump(f.write, pid=worker)
+    results.put([node.report() for node in fleet])
+    results.close()
+    results.join_thread()
+    # Node threads never return from main(), leave without waiting for them
+    os._exit(0)
+
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return None
+    values = sorted(values)
+    return [values[min(len(values) - 1, len(values) * p // 100)] for p in points] + [values[-1]]
+
+
+def _timestamp(plain):
+    from gateway.decoder import SERIES_PREFIX
+    from lib import series
+
+    if plain[:1] == SERIES_PREFIX:
+        return series.decode(plain)[0][-1]
+    return json.loads(plain).get('ts')
+
+
+def latencies(broker, keys, topics):
+    """(metric, sample time, arrival) in virtual ms per topic kind, and the
+    number of alerts of each kind ("above", "clear", ...)."""
+    from gateway.decoder import Decoder
+
+    groups = {}
+    for t, topic, payload in broker.messages:
+        kind, _, metric = topic.partition('/')
+        if kind in topics and metric in keys:
+            groups.setdefault((kind, metric), []).append((t, payload))
+    decoder = Decoder(keys)
+    out = dict((kind, []) for kind in topics)
+    alerts = {}
+    for (kind, metric), items in groups.items():
+        plain = decoder.decrypt(metric, [payload for t, payload in items])
+        for (t, payload), text in zip(items, plain):
+            try:
+                ts = _timestamp(text)
+            except (ValueError, IndexError):
+                continue
+            if ts is not None:
+                out[kind].append((metric, ts - broker.clock.epoch, t))
+            if kind == topics[1]:
+                alert = json.loads(text).get('alert')
+                alerts[alert] = alerts.get(alert, 0) + 1
+    return out, alerts
+
+
+def owners(confs):
+    """Metric uuid -> isu_id."""
+    out = {}
+    for conf in confs:
+        for module in conf['modules']:
+            for metric in module['metrics'].values():
+                out[metric['id']] = conf['isu_id']
+    return out
+
+
+def overtaking(delays, owner, topics):
+    """Alerts that reached the broker while their node still held older
+    telemetry: the alerts' latencies and how long that telemetry waited."""
+    queued = {}
+    for metric, ts, t in delays[topics[0]]:
+        queued.setdefault(owner[metric], []).append((ts, t))
+    alerts = []
+    passed = {}
+    for metric, ts, t in delays[topics[1]]:
+        older = [(qts, qt) for qts, qt in queued.get(owner[metric], ()) if qts < ts and qt > t]
+        if older:
+            alerts.append(t - ts)
+            for qts, qt in older:
+                passed[(owner[metric], qts, qt)] = qt - qts
+    return alerts, list(passed.values())
+
+
+def recovery(broker, down, up, nodes):
+    """Reconnect delays after a restart and the publish rate while recovering."""
+    delays = {}
+    for t, client_id, present in broker.connects:
+        if t >= up and client_id not in delays:
+            delays[client_id] = t - up
+    burst = sum(1 for t, topic, payload in broker.messages if up <= t < up + RECOVERY_WINDOW)
+    return {
+        'reconnected': len(delays),
+        'nodes': nodes,
+        'delay': percentiles(list(delays.values())),
+        'resumed': sum(1 for t, client_id, present in broker.connects if t >= up and present),
+        'rate': burst * 1000 / RECOVERY_WINDOW,
+    }
+
+
+def _fmt(p):
+    if p is None:
+        return 'n/a'
+    return 'p50 {} p90 {} p99 {} max {} ms'.format(*p)
+
+
+def retune(args, broker, confs, detimotic_conf):
+    """Sends the --retune delta to every node's config topic; returns (sent, queued)."""
+    delta = json.loads(args.retune)
+    delta.setdefault('version', 1)
+    payload = json.dumps(delta).encode('utf-8')
+    topic = detimotic_conf['gateway']['config_topic']
+    results = [broker.send(conf['isu_id'], topic + '/' + conf['isu_id'], payload) for conf in confs]
+    return results.count('sent'), results.count('queued')
+
+
+def command(broker, confs, detimotic_conf):
+    """Asks every node to backfill its first metric; returns (sent, queued)."""
+    topic = detimotic_conf['gateway']['command_topic']
+    results = []
+    for conf in confs:
+        metric = next(iter(conf['modules'][0]['metrics'].values()))
+        payload = json.dumps({'op': 'backfill', 'metrics': [metric['id']], 'from': 0, 'to': 2 ** 62})
+        results.append(broker.send(conf['isu_id'], topic + '/' + conf['isu_id'], payload.encode('utf-8')))
+    return results.count('sent'), results.count('queued')
+
+
+def answers(broker, confs, detimotic_conf, at):
+    """Delay in ms from the command to each node's first backfill chunk."""
+    owner = owners(confs)
+    topic = detimotic_conf['gateway']['backfill_topic']
+    first = {}
+    for t, name, payload in broker.messages:
+        kind, _, id = name.partition('/')
+        if kind == topic and t >= at and owner.get(id) not in first:
+            first[owner.get(id)] = t - at
+    first.pop(None, None)
+    return sorted(first.values())
+
+
+def report(args, broker, confs, detimotic_conf, keys, topics, nodes, wall):
+    duration = args.duration * 1000
+    total = len(broker.messages)
+    buckets = {}
+    for t, topic, payload in broker.messages:
+        buckets[t // 1000] = buckets.get(t // 1000, 0) + 1
+    kinds = {}
+    for t, topic, payload in broker.messages:
+        kind = topic.partition('/')[0]
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    print('{} nodes on {} workers, {} s virtual at {}x in {:.1f} s wall'.format(
+            len(nodes), args.workers, args.duration, args.speed, wall))
+    print('published {} msgs, {:.1f} msg/s, peak {} msg/s, {} kB in, {} pings'.format(
+            total, total * 1000 / duration, max(buckets.values()) if buckets else 0,
+            broker.bytes_in // 1024, broker.pings))
+    print('by topic: ' + ', '.join('{} {}'.format(k, kinds[k]) for k in sorted(kinds)))
+    delays, alerts = latencies(broker, keys, topics)
+    for kind, values in sorted(delays.items()):
+        print('latency {} (n={}): {}'.format(kind, len(values), _fmt(percentiles([t - ts for metric, ts, t in values]))))
+    if alerts:
+        print('alerts: ' + ', '.join('{} {}'.format(alerts[k], k) for k in sorted(alerts)))
+    ahead, passed = overtaking(delays, owners(confs), topics)
+    if ahead:
+        print('alerts sent ahead of a backlog (n={}): {}'.format(len(ahead), _fmt(percentiles(ahead))))
+        print('  the telemetry they passed (n={}): {}'.format(len(passed), _fmt(percentiles(passed))))
+    for down, up in broker.restarts:
+        r = recovery(broker, down, up, len(nodes))
+        print('restart at {} s, down {} ms: {}/{} reconnected ({} resumed a session), {}, {:.1f} msg/s in the next {} s'.format(
+                down // 1000, up - down, r['reconnected'], r['nodes'], r['resumed'], _fmt(r['delay']),
+                r['rate'], RECOVERY_WINDOW // 1000))
+
+    if args.retune_at:
+        at = args.retune_at * 1000
+        before = sum(1 for t, topic, payload in broker.messages if t < at)
+        after = total - before
+        print('retune at {} s: {}/{} nodes applied it, {} saved, {:.1f} msg/s before, {:.1f} msg/s after'.format(
+                args.retune_at, sum(1 for n in nodes if n['version']), len(nodes),
+                sum(1 for n in nodes if n['saved']), before * 1000 / at,
+                after * 1000 / max(duration - at, 1)))
+
+    if args.command_at:
+        delays = answers(broker, confs, detimotic_conf, args.command_at * 1000)
+        print('command at {} s: {}/{} nodes answered, {}'.format(
+                args.command_at, len(delays), len(nodes), _fmt(percentiles(delays))))
+
+    scans = [n['scan_ms'] for n in nodes if n['scan_ms'] is not None]
+    if scans:
+        print('ble scan coverage: {:.1f}% of the run on average, {:.1f}% lowest'.format(
+                sum(scans) * 100 / len(scans) / duration, min(scans) * 100 / duration))
+
+    radio = [n['radio_ms'] for n in nodes]
+    if radio:
+        print('wifi radio on: {:.0f} s per hour on average, {} full AP scans'.format(
+                sum(radio) * 3600 / len(radio) / duration, sum(n['wifi_scans'] for n in nodes)))
+
+    # Worker stats come from the health frames: [jobs, busy, full, errors, slowest ms]
+    jobs = [0, 0, 0, 0, 0]
+    for t, topic, payload in broker.messages:
+        if topic.partition('/')[0] == 'health':
+            stats = json.loads(payload).get('worker')
+            if stats:
+                jobs = [a + b for a, b in zip(jobs[:4], stats[:4])] + [max(jobs[4], stats[4])]
+    if jobs[0]:
+        print('background jobs: {} run, {} skipped while busy, {} skipped when full, {} failed, slowest {} ms'.format(*jobs))
+
+    cycles = sum(n['wakes'] for n in nodes)
+    if cycles:
+        # Health frames carry [cycles, awake ms, average awake ms, last sleep ms]
+        frames = [json.loads(payload).get('ds') for t, topic, payload in broker.messages
+                if topic.partition('/')[0] == 'health']
+        frames = [ds for ds in frames if ds]
+        woken = sum(1 for n in nodes if n['wakes'])
+        print('deep sleep: {:.1f} cycles per node, {:.0f} ms awake per cycle, state kept on {}/{} wakes, {} health frames'.format(
+                cycles / len(nodes), sum(n['awake_ms'] for n in nodes) / cycles,
+                sum(n['kept'] for n in nodes), cycles - woken, len(frames)))
+
+    if broker.handshakes:
+        print('tls: {} handshakes, {} resumed a saved session'.format(broker.handshakes, broker.resumed))
+
+    errors = [n for n in nodes if n['error'] is not None]
+    for n in errors:
+        print('node {} died: {}'.format(n['isu'], n['error']))
+    late = [n for n in nodes if n['wdt_expired']]
+    print('{} nodes died, {} would have hit the watchdog (max feed gap {} ms), {} readings still queued'.format(
+            len(errors), len(late), max([n['wdt_gap'] for n in nodes] or [0]),
+            sum(n['pending'] for n in nodes)))
+
+
+async def run(args):
+    clock = Clock(args.speed, tick=args.tick)
+    broker = Broker(clock, port=args.port, persist=args.persist, tls=args.tls)
+    await broker.start()
+    detimotic_conf = make_detimotic_conf(broker.host, broker.port, args.link, not args.no_worker, args.deepsleep,
+            args.tls)
+    gateway = detimotic_conf['gateway']
+    topics = (gateway['telemetry_topic'], gateway['alert_topic'])
+    confs, keys = make_confs(args.nodes, args.seed, args.scan_duty, args.alert_rate)
+
+    # Boots are spread over the ramp so the start is not a reconnect storm too
+    shares = [[] for i in range(args.workers)]
+    for i, conf in enumerate(confs):
+        shares[i % args.workers].append((i, conf, args.ramp * 1000 * i // max(args.nodes, 1)))
+
+    duration = args.duration * 1000
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    options = {'verbose': args.verbose, 'trace': args.trace, 'trace_size': args.trace_size}
+    procs = [ctx.Process(target=_worker, args=(i, clock.args(), share, detimotic_conf, duration, options, results))
+            for i, share in enumerate(shares) if share]
+    for p in procs:
+        p.start()
+
+    # Events scheduled into the run, dealt with before the report
+    tasks = []
+    if args.restart_at:
+        async def restart():
+            await asyncio.sleep(clock.wall(args.restart_at * 1000 - clock.ticks_ms()))
+            await broker.restart(args.downtime * 1000)
+        tasks.append(asyncio.ensure_future(restart()))
+
+    if args.retune_at:
+        async def send():
+            await asyncio.sleep(clock.wall(args.retune_at * 1000 - clock.ticks_ms()))
+            sent, queued = retune(args, broker, confs, detimotic_conf)
+            print('retune sent to {}/{} nodes, {} queued until they reconnect'.format(sent, len(confs), queued))
+        tasks.append(asyncio.ensure_future(send()))
+
+    if args.command_at:
+        async def ask():
+            await asyncio.sleep(clock.wall(args.command_at * 1000 - clock.ticks_ms()))
+            sent, queued = command(broker, confs, detimotic_conf)
+            print('command sent to {}/{} nodes, {} queued until they reconnect'.format(sent, len(confs), queued))
+        tasks.append(asyncio.ensure_future(ask()))
+
+    await asyncio.sleep(clock.wall(duration - clock.ticks_ms()))
+    wall = clock.wall(clock.ticks_ms())
+    loop = asyncio.get_event_loop()
+    nodes = []
+    for p in procs:
+        nodes += await loop.run_in_executor(None, results.get, True, 120)
+    # One set past the end of the run is dropped; an error in one that ran is raised
+    for task in tasks:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            raise result
+    await broker.stop()
+    for p in procs:
+        p.join(5)
+    report(args, broker, confs, detimotic_conf, keys, topics, nodes, wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--duration', type=int, default=120, help='virtual seconds')
+    parser.add_argument('--speed', type=float, default=1.0, help='virtual seconds per host second')
+    parser.add_argument('--tick', type=int, default=10, help='virtual ms per idle main loop pass')
+    parser.add_argument('--ramp', type=int, default=10, help='virtual seconds over which nodes boot')
+    parser.add_argument('--restart-at', type=int, default=0, help='drop all connections at this virtual second')
+    parser.add_argument('--downtime', type=int, default=5, help='virtual seconds the broker stays down')
+    parser.add_argument('--persist', action='store_true', help='keep sessions across the restart')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--retune-at', type=int, default=0, help='send the --retune delta at this virtual second')
+    parser.add_argument('--retune', metavar='JSON', default='{"modules": [{"name": "lmv324", "wait_time": 10000, '
+            '"min_wait": 5000, "max_wait": 60000}]}', help='config delta for --retune-at')
+    parser.add_argument('--command-at', type=int, default=0,
+            help='send every node a backfill command at this virtual second')
+    parser.add_argument('--no-worker', action='store_true', help='run blocking sensor reads in the main loop')
+    parser.add_argument('--tls', action='store_true', help='connect over TLS, resuming saved sessions')
+    parser.add_argument('--deepsleep', action='store_true', help='duty-cycle the nodes through deep sleep')
+    parser.add_argument('--link', choices=('always', 'burst'), help='override the WiFi link mode')
+    parser.add_argument('--scan-duty', type=float, help='override the share of each wait spent scanning for BLE')
+    parser.add_argument('--alert-rate', type=float,
+            help='add a rate-of-change rule (per second) to every metric, e.g. to raise alerts during --restart-at')
+    parser.add_argument('--trace', metavar='FILE', help='write Chrome trace events to FILE-<worker>.json')
+    parser.add_argument('--trace-size', type=int, default=8192, help='trace ring size per worker')
+    parser.add_argument('--verbose', action='store_true', help='show node output')
+    args = parser.parse_args()
+    args.workers = max(1, min(args.workers, args.nodes))
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""One virtual ISU: a private copy of detimotic and its sensor modules.
+
+detimotic keeps its state in module globals, so every node loads its own
+copy of detimotic/detimotic.py and of each sensors/*.py it uses. The lib
+modules are shared, as they would be across threads on one board. The
+configuration comes from the fleet runner instead of the flash files.
+
+With deep sleep enabled, machine.deepsleep() unwinds the node thread; the
+node sleeps the virtual time and boots a fresh copy of detimotic, with its
+RTC memory and a DEEPSLEEP_RESET cause, as the board does.
+"""
+import builtins
+import importlib.util
+import os
+import tempfile
+import threading
+
+from sim.clock import REPO
+
+_import = builtins.__import__
+
+
+def _quiet(*args, **kwargs):
+    pass
+
+
+class Node:
+
+    def __init__(self, index, conf, detimotic_conf, delay=0, verbose=False):
+        self.index = index
+        self.conf = conf
+        self.detimotic_conf = detimotic_conf
+        self.delay = delay
+        self.error = None
+        self._sensors = {}
+        self._builtins = dict(vars(builtins))
+        self._builtins['__import__'] = self._import
+        if not verbose:
+            self._builtins['print'] = _quiet
+        self.saved = 0
+        self.wakes = 0
+        # Wakes whose deep-sleep state survived from the previous cycle
+        self.kept = 0
+        self.awake_ms = 0
+        self.wdt_gap = 0
+        self.wdt_expired = 0
+        self._state_dir = tempfile.mkdtemp(prefix='detimotic-')
+        self._boot()
+        self.thread = threading.Thread(target=self._run, name=conf['isu_id'], daemon=True)
+
+    def _boot(self):
+        # The old copy's worker thread idles on, the board would have lost it
+        self._sensors = {}
+        self.dm = self._load('detimotic_{}'.format(self.index), os.path.join(REPO, 'detimotic', 'detimotic.py'))
+        self.dm.setup_config = self._setup_config
+        self.dm.save_config = self._save_config
+        self.dm.STATE_FILE = os.path.join(self._state_dir, 'state.json')
+
+    def _load(self, name, path):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        module.__builtins__ = self._builtins
+        spec.loader.exec_module(module)
+        return module
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Module.setup() imports sensors by path, as MicroPython allows
+        if name.startswith('sensors/'):
+            if name not in self._sensors:
+                self._sensors[name] = self._load('{}_{}'.format(name.replace('/', '_'), self.index),
+                        os.path.join(REPO, name + '.py'))
+            return self._sensors[name]
+        return _import(name, globals, locals, fromlist, level)
+
+    def _setup_config(self):
+        self.dm.detimotic_conf = self.detimotic_conf
+        self.dm.conf = self.conf
+
+    def _save_config(self):
+        # The fleet shares one conf.json on disk, so nodes only count saves
+        self.saved += 1
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        import machine
+        from sim import clock
+        clock.CLOCK.sleep(self.delay / 1000)
+        clock.CLOCK.reset()
+        while True:
+            try:
+                self.dm.main()
+                return
+            except machine.DeepSleep as e:
+                self._slept(clock.CLOCK.board_ms())
+                clock.CLOCK.sleep(e.ms / 1000)
+            except BaseException as e:
+                self.error = repr(e)
+                return
+            machine._reset_cause[self.thread.name] = machine.DEEPSLEEP_RESET
+            clock.CLOCK.reset()
+            self._boot()
+
+    def _slept(self, awake):
+        dm = self.dm
+        if self.wakes and dm.state['cycles'] == self.wakes + 1:
+            self.kept += 1
+        self.wakes += 1
+        self.awake_ms += awake
+        if dm.watchdog is not None:
+            self.wdt_gap = max(self.wdt_gap, dm.watchdog.max_gap)
+            self.wdt_expired += dm.watchdog.expired
+
+    def report(self):
+        dm = self.dm
+        watchdog = dm.watchdog
+        bluetooth = self._sensors.get('sensors/bluetooth')
+        bt = getattr(bluetooth, 'bt', None)
+        return {
+            'isu': self.conf['isu_id'],
+            'error': self.error,
+            'pending': len(dm.pending),
+            'alerts': len(dm.alerts),
+            'modules': len(dm.modules),
+            'wdt_gap': max(self.wdt_gap, watchdog.max_gap if watchdog is not None else 0),
+            'wdt_expired': self.wdt_expired + (watchdog.expired if watchdog is not None else 0),
+            'scan_ms': bt.scanned() if bt is not None else None,
+            'version': dm.conf.get('version', 0),
+            'saved': self.saved,
+            'radio_ms': dm.wlan.radio_on() if dm.wlan is not None else 0,
+            'wifi_scans': dm.wlan.scans if dm.wlan is not None else 0,
+            'wakes': self.wakes,
+            'kept': self.kept,
+            'awake_ms': self.awake_ms,
+        }
@@ -0,0 +1,192 @@
+"""Adaptive sampling benchmark: samples taken against reconstruction error.
+
+Replays a trace of one metric through lib/adaptive.py the way Module drives
+it (update() with every reading, tick() after every run) and through fixed
+intervals, then rebuilds the signal from the samples by linear
+interpolation and compares it with the trace. The fixed baselines are the
+module's wait_time and an interval giving as many samples as the adaptive
+run did.
+
+Traces are CSV files of "ms,value" rows, e.g. a metric sampled at a fast
+fixed rate by an ISU and exported from the gateway, given per module:
+
+    python -m sim.sampling --trace tsl2561=lux.csv --trace lmv324=db.csv
+
+Without --trace, a week (--days) of synthetic lecture-room days is replayed:
+light for tsl2561, sound level for lmv324 and temperature for bme680.
+Lectures start and end a few minutes off the timetable, as lamps are
+switched by people, so a fixed interval cannot line up with them by luck.
+Interval bounds come from the module entries in conf.json.
+"""
+import argparse
+import bisect
+import csv
+import json
+import math
+import os
+import random
+
+from lib.adaptive import Adaptive
+from sim.clock import REPO
+
+DAY = 86400000
+STEP = 1000
+
+LECTURES = ((8.5, 10.25), (10.5, 12.25), (13.5, 15.25), (15.5, 17.25))
+# Hours a lecture may start or end off the timetable
+LATE = 0.1
+
+
+def _days(rng, days):
+    """(ms, hour of day, lectures of that day) for every STEP."""
+    for day in range(days):
+        lectures = [(start + rng.uniform(-LATE, LATE), end + rng.uniform(-LATE, LATE)) for start, end in LECTURES]
+        for ms in range(0, DAY, STEP):
+            yield day * DAY + ms, ms / 3600000, lectures
+
+
+def _lecture(hour, lectures):
+    for start, end in lectures:
+        if start <= hour < end:
+            return True
+    return False
+
+
+def light(rng, days=1):
+    """Lux: night, daylight through the windows, lamps during lectures."""
+    clouds = 1.0
+    for ms, hour, lectures in _days(rng, days):
+        clouds = min(max(clouds + rng.gauss(0, 0.002), 0.3), 1.0)
+        day = max(math.sin((hour - 6) * math.pi / 14), 0) * 250 * clouds
+        lamps = 450 if _lecture(hour, lectures) else 0
+        yield ms, round(max(day + lamps + rng.gauss(0, 2), 0.1), 1)
+
+
+def sound(rng, days=1):
+    """dB: a quiet room, speech and chatter during lectures, loud breaks."""
+    level = 32.0
+    for ms, hour, lectures in _days(rng, days):
+        if _lecture(hour, lectures):
+            target = 58 + (8 if rng.random() < 0.02 else 0)
+        elif 8 <= hour < 18 and rng.random() < 0.3:
+            target = 45
+        else:
+            target = 32
+        level += (target - level) * 0.3
+        yield ms, round(level + rng.gauss(0, 0.5), 1)
+
+
+def temperature(rng, days=1):
+    """Celsius: night setback, heating at 07:00, occupants warming the room."""
+    temp = 17.0
+    for ms, hour, lectures in _days(rng, days):
+        target = 21.0 if 7 <= hour < 19 else 17.0
+        if _lecture(hour, lectures):
+            target += 1.5
+        temp += (target - temp) / 1800
+        yield ms, round(temp + rng.gauss(0, 0.02), 2)
+
+
+SYNTHETIC = (('tsl2561', 'light', light), ('lmv324', 'sound', sound), ('bme680', 'temperature', temperature))
+
+
+def load(path):
+    """Reads "ms,value" rows, skipping a header, sorted by time."""
+    rows = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            try:
+                rows.append((int(float(row[0])), float(row[1])))
+            except (ValueError, IndexError):
+                continue
+    rows.sort()
+    return rows
+
+
+def module_conf(name):
+    with open(os.path.join(REPO, 'conf.json')) as f:
+        for module in json.load(f)['modules']:
+            if module['name'] == name:
+                return module
+    raise SystemExit('no module {} in conf.json'.format(name))
+
+
+def _at(times, values, t):
+    # The trace value in effect at t
+    return values[max(bisect.bisect_right(times, t) - 1, 0)]
+
+
+def replay(times, values, wait, adaptive=None):
+    """Sample times and values taken over the trace."""
+    taken = []
+    t = times[0]
+    while t <= times[-1]:
+        value = _at(times, values, t)
+        taken.append((t, value))
+        if adaptive is not None:
+            adaptive.update('metric', value)
+            wait = adaptive.tick()
+        t += wait
+    return taken
+
+
+def error(times, values, taken):
+    """RMSE and p99 absolute error of the linear reconstruction."""
+    errors = []
+    j = 0
+    for t, value in zip(times, values):
+        while j + 2 < len(taken) and taken[j + 1][0] <= t:
+            j += 1
+        (t0, v0), (t1, v1) = taken[j], taken[min(j + 1, len(taken) - 1)]
+        if t1 > t0 and t0 <= t <= t1:
+            estimate = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        else:
+            estimate = v0 if t < t1 else v1
+        errors.append(abs(value - estimate))
+    errors.sort()
+    rmse = math.sqrt(sum(e * e for e in errors) / len(errors))
+    return rmse, errors[min(int(len(errors) * 0.99), len(errors) - 1)]
+
+
+def compare(name, label, rows):
+    module = module_conf(name)
+    times = [t for t, v in rows]
+    values = [v for t, v in rows]
+    span = times[-1] - times[0]
+    adaptive = Adaptive(module['wait_time'], module.get('min_wait', module['wait_time']),
+            module.get('max_wait', module['wait_time']))
+    runs = [('adaptive {}-{} ms'.format(adaptive.min_wait, adaptive.max_wait),
+            replay(times, values, module['wait_time'], adaptive))]
+    same = max(span // max(len(runs[0][1]) - 1, 1), 1)
+    runs.append(('fixed {} ms'.format(module['wait_time']), replay(times, values, module['wait_time'])))
+    runs.append(('fixed {} ms, same samples'.format(same), replay(times, values, same)))
+
+    print('{} ({}), {} points over {:.1f} h'.format(label, name, len(rows), span / 3600000))
+    for strategy, taken in runs:
+        rmse, p99 = error(times, values, taken)
+        print('  {:32} {:6} samples ({:5.0f}/h)  rmse {:8.3f}  p99 {:8.3f}'.format(
+                strategy, len(taken), len(taken) * 3600000 / max(span, 1), rmse, p99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--trace', action='append', default=[], metavar='MODULE=FILE',
+            help='replay a recorded "ms,value" CSV with the bounds of MODULE in conf.json')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic traces')
+    parser.add_argument('--days', type=int, default=7, help='length of the synthetic traces')
+    args = parser.parse_args()
+
+    if args.trace:
+        for spec in args.trace:
+            name, _, path = spec.partition('=')
+            rows = load(path)
+            if len(rows) < 2:
+                raise SystemExit('{}: need at least two rows'.format(path))
+            compare(name, os.path.basename(path), rows)
+        return
+    for name, label, trace in SYNTHETIC:
+        compare(name, 'synthetic ' + label, list(trace(random.Random(args.seed), args.days)))
+
+
+if __name__ == '__main__':
+    main()
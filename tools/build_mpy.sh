@@ -0,0 +1,26 @@
+#!/bin/sh
+# Precompile the ISU sources to .mpy bytecode so the board does not have to
+# compile them on every reset. The mpy-cross version must match the firmware.
+#
+# Usage: tools/build_mpy.sh [build dir]
+
+set -e
+
+MPY_CROSS=${MPY_CROSS:-mpy-cross}
+OUT=${1:-build}
+
+cd "$(dirname "$0")/.."
+rm -rf "$OUT"
+
+for dir in detimotic lib sensors; do
+    mkdir -p "$OUT/$dir"
+    for src in "$dir"/*.py; do
+        "$MPY_CROSS" -o "$OUT/${src%.py}.mpy" "$src"
+    done
+done
+
+# Entry points and configuration stay as source
+cp boot.py main.py conf.json "$OUT/"
+cp detimotic/detimotic_conf.json "$OUT/detimotic/"
+
+echo "Upload the contents of $OUT/ to /flash"